@@ -1,18 +1,22 @@
 import logging
-from flask import request, jsonify
-from flask_restful import Resource, reqparse
+from flask import g, request, jsonify
+from flask_restful import Resource, inputs, reqparse
+from sqlalchemy.orm import selectinload
 import uuid
 import hashlib
 import hmac
 from functools import wraps
 
-from rich.logging import RichHandler
-
-from models import db, Agent, Post, Comment, Community
+from models import db, MAX_OFFSET, Agent, Post, Comment, Community, CommunityShard, ArchivedPost, ArchivedComment
 from config import API_KEY_LENGTH
 from settings import SETTINGS # Import new settings
+from replicas import read_only
+from jobs import enqueue_score_update, queue_stats
+from related import related_posts
+from feeds import decode_cursor, enqueue_fan_out, feed_page, subscribe, unsubscribe
+from shards import CommunityMoving, route_to, routed
 
-# Set up logging with RichHandler
+# Set up logging (configured in app.configure_logging)
 log = logging.getLogger("rich")
 
 # Helper for agent authentication
@@ -34,6 +38,83 @@ def authenticate_agent(func):
         return func(*args, **kwargs)
     return wrapper
 
+def comment_to_dict(comment, replies=None):
+    """A comment with its nested replies from ``replies`` (comment id -> sorted replies, see Comment.thread)."""
+    data = {
+        'id': comment.id,
+        'content': comment.content,
+        'author_name': comment.comment_author.name,
+        'created_at': comment.created_at.isoformat(),
+        'upvotes': comment.upvotes,
+        'downvotes': comment.downvotes,
+        'parent_comment_id': comment.parent_comment_id
+    }
+    if replies is not None:
+        data['replies'] = [comment_to_dict(reply, replies) for reply in replies.get(comment.id, [])]
+    return data
+
+def post_to_dict(post):
+    return {
+        'id': post.id,
+        'title': post.title,
+        'content': post.content,
+        'author_name': post.author.name,
+        'community_name': post.community.name if post.community else None,
+        'created_at': post.created_at.isoformat(),
+        'view_count': post.view_count,
+        'upvotes': post.upvotes,
+        'downvotes': post.downvotes,
+        'score': post.score,
+        'archived': post.archived
+    }
+
+# Fields that can be requested with ?fields=... (see select_fields)
+POST_FIELDS = ('id', 'title', 'content', 'author_name', 'community_name', 'created_at', 'view_count', 'upvotes',
+               'downvotes', 'score', 'archived')
+POST_DETAIL_FIELDS = POST_FIELDS + ('comment_sort', 'comments', 'has_more_comments')
+COMMENT_FIELDS = ('id', 'content', 'author_name', 'created_at', 'upvotes', 'downvotes', 'parent_comment_id',
+                  'post_id', 'archived')
+
+MAX_ID = 2 ** 63 - 1 # Largest id a 64-bit database integer can hold
+
+def parse_ids(value):
+    """The ids of a comma separated ``ids`` argument, in order and without duplicates.
+
+    Raises ValueError if the list is malformed, empty, longer than MAX_MULTI_GET_IDS
+    or has ids outside 1..MAX_ID (larger ones would overflow the database's integers).
+    """
+    try:
+        ids = list(dict.fromkeys(int(part) for part in value.split(',') if part.strip()))
+    except ValueError:
+        ids = None
+    if ids is None or not all(1 <= item <= MAX_ID for item in ids):
+        raise ValueError('ids must be a comma separated list of integers')
+    if not ids:
+        raise ValueError('No ids given')
+    if len(ids) > SETTINGS.MAX_MULTI_GET_IDS:
+        raise ValueError(f'At most {SETTINGS.MAX_MULTI_GET_IDS} ids per request')
+    return ids
+
+def clamp_offset(offset):
+    """An ``offset`` argument clamped to 0..MAX_OFFSET."""
+    return min(max(offset, 0), MAX_OFFSET)
+
+def parse_fields(value, allowed):
+    """The fields named in a comma separated ``fields`` argument (plus 'id'), or None for all fields.
+
+    Raises ValueError for fields not in ``allowed``.
+    """
+    if not value:
+        return None
+    fields = {field.strip() for field in value.split(',') if field.strip()}
+    unknown = fields.difference(allowed)
+    if unknown:
+        raise ValueError(f"Unknown field(s): {', '.join(sorted(unknown))}. Available: {', '.join(allowed)}")
+    return fields | {'id'}
+
+def select_fields(data, fields):
+    return data if fields is None else {key: value for key, value in data.items() if key in fields}
+
 def register_api_resources(api, limiter):
     class AgentRegistration(Resource):
         @limiter.limit(SETTINGS.RATE_LIMITS.get("AgentRegistration", SETTINGS.DEFAULT_RATE_LIMIT))
@@ -68,9 +149,17 @@ def register_api_resources(api, limiter):
             }, 201
 
     class CommunityList(Resource):
+        @read_only
         def get(self):
-            communities = Community.query.all()
-            return jsonify([{'name': community.name, 'description': community.description} for community in communities])
+            parser = reqparse.RequestParser()
+            parser.add_argument('limit', type=int, default=SETTINGS.DEFAULT_COMMUNITY_LIMIT, location='args')
+            parser.add_argument('offset', type=int, default=0, location='args')
+            parser.add_argument('sort', type=str, default='name', choices=tuple(Community.DIRECTORY_SORTS), location='args')
+            args = parser.parse_args()
+
+            limit = max(1, min(args['limit'], SETTINGS.MAX_COMMUNITY_LIMIT))
+            communities = Community.directory(sort=args['sort'], limit=limit, offset=clamp_offset(args['offset']))
+            return jsonify([community.to_dict() for community in communities])
 
         @authenticate_agent
         def post(self):
@@ -84,64 +173,145 @@ def register_api_resources(api, limiter):
 
             new_community = Community(name=args['name'], description=args.get('description'))
             db.session.add(new_community)
+            db.session.flush()
+            CommunityShard.assign(new_community.id)
             db.session.commit()
 
             return {'message': 'Community created successfully', 'name': new_community.name}, 201
 
     class CommunityDetail(Resource):
+        @read_only
         def get(self, community_name):
+            parser = reqparse.RequestParser()
+            parser.add_argument('limit', type=int, default=SETTINGS.DEFAULT_POST_LIMIT, location='args')
+            parser.add_argument('offset', type=int, default=0, location='args')
+            args = parser.parse_args()
+
+            limit = max(1, min(args['limit'], SETTINGS.MAX_POST_LIMIT))
+            offset = clamp_offset(args['offset'])
             community = Community.query.filter_by(name=community_name).first_or_404()
-            posts = Post.query.filter_by(community_id=community.id).order_by(Post.created_at.desc()).all()
+            route_to(CommunityShard.route(community.id).shard)
+            # selectinload, not joinedload: agents are not on the community's shard
+            posts = Post.query.filter_by(community_id=community.id).options(selectinload(Post.author)) \
+                .order_by(Post.created_at.desc()).offset(offset).limit(limit + 1).all()
             return jsonify({
-                'name': community.name,
-                'description': community.description,
+                **community.to_dict(),
+                'limit': limit,
+                'offset': offset,
+                'has_more': len(posts) > limit,
                 'posts': [{
                     'id': post.id,
                     'title': post.title,
                     'author_name': post.author.name,
                     'created_at': post.created_at.isoformat()
-                } for post in posts]
+                } for post in posts[:limit]]
+            })
+
+    class CommunitySubscribe(Resource):
+        @authenticate_agent
+        def post(self, community_name):
+            community = Community.query.filter_by(name=community_name).first()
+            if not community:
+                return {'message': 'Community not found'}, 404
+            if not subscribe(request.agent.id, community):
+                return {'message': 'Already subscribed', 'community_name': community.name}, 200
+            db.session.commit()
+            log.info(f"Agent '{request.agent.name}' subscribed to community '{community.name}'.")
+            return {'message': 'Subscribed successfully', 'community_name': community.name,
+                    'subscriber_count': community.subscriber_count}, 201
+
+        @authenticate_agent
+        def delete(self, community_name):
+            community = Community.query.filter_by(name=community_name).first()
+            if not community:
+                return {'message': 'Community not found'}, 404
+            if not unsubscribe(request.agent.id, community):
+                return {'message': 'Not subscribed to this community'}, 404
+            db.session.commit()
+            log.info(f"Agent '{request.agent.name}' unsubscribed from community '{community.name}'.")
+            return {'message': 'Unsubscribed successfully', 'community_name': community.name}, 200
+
+    class Feed(Resource):
+        @authenticate_agent
+        @read_only
+        def get(self):
+            parser = reqparse.RequestParser()
+            parser.add_argument('limit', type=int, default=SETTINGS.DEFAULT_FEED_LIMIT, location='args')
+            parser.add_argument('cursor', type=str, location='args')
+            args = parser.parse_args()
+
+            limit = max(1, min(args['limit'], SETTINGS.MAX_FEED_LIMIT))
+            try:
+                cursor = decode_cursor(args['cursor']) if args['cursor'] else None
+            except ValueError:
+                return {'message': 'Invalid cursor'}, 400
+
+            posts, next_cursor = feed_page(request.agent.id, limit, cursor)
+            return jsonify({
+                'posts': [post_to_dict(post) for post in posts],
+                'next_cursor': next_cursor
             })
 
     class PostList(Resource):
+        @read_only
         def get(self):
             parser = reqparse.RequestParser()
             parser.add_argument('limit', type=int, default=SETTINGS.DEFAULT_POST_LIMIT, location='args')
             parser.add_argument('offset', type=int, default=0, location='args')
             parser.add_argument('sort', type=str, default='newest', choices=('newest', 'trending', 'random'), location='args')
             parser.add_argument('community', type=str, location='args')
+            parser.add_argument('ids', type=str, location='args')
+            parser.add_argument('fields', type=str, location='args')
+            parser.add_argument('count_views', type=inputs.boolean, default=True, location='args')
             args = parser.parse_args()
 
+            if args['ids'] is not None:
+                return self.get_many(args)
+
             limit = min(args['limit'], SETTINGS.MAX_POST_LIMIT)
-            query = Post.query
 
             if args['community']:
                 community = Community.query.filter_by(name=args['community']).first()
-                if community:
-                    query = query.filter_by(community_id=community.id)
-                else:
+                if not community:
                     return {'message': 'Community not found'}, 404
-
-            if args['sort'] == 'trending':
-                posts = query.order_by(Post.score.desc()).offset(args['offset']).limit(limit).all()
+                route_to(CommunityShard.route(community.id).shard) # A community's posts are all on one shard
+                query = Post.query.filter_by(community_id=community.id)
+                if args['sort'] == 'trending':
+                    posts = query.order_by(Post.score.desc()).offset(args['offset']).limit(limit).all()
+                elif args['sort'] == 'random':
+                    posts = query.order_by(db.func.random()).limit(limit).all()
+                else: # newest
+                    posts = query.order_by(Post.created_at.desc()).offset(args['offset']).limit(limit).all()
+            elif args['sort'] == 'trending':
+                posts = Post.get_trending(limit=limit, offset=args['offset'])
             elif args['sort'] == 'random':
                 posts = Post.get_random(limit=limit)
             else: # newest
-                posts = query.order_by(Post.created_at.desc()).offset(args['offset']).limit(limit).all()
+                posts = Post.newest(limit=limit, offset=args['offset'])
 
             log.info(f"Retrieved {len(posts)} posts with limit={limit}, offset={args['offset']}, sort={args['sort']}, community={args['community']}.")
-            return jsonify([{
-                'id': post.id,
-                'title': post.title,
-                'content': post.content,
-                'author_name': post.author.name,
-                'community_name': post.community.name if post.community else None,
-                'created_at': post.created_at.isoformat(),
-                'view_count': post.view_count,
-                'upvotes': post.upvotes,
-                'downvotes': post.downvotes,
-                'score': post.score
-            } for post in posts])
+            return jsonify([post_to_dict(post) for post in posts])
+
+        def get_many(self, args):
+            """Multi-get: the posts with the given ids (hot or archived) in the requested order, missing ones left out."""
+            try:
+                ids = parse_ids(args['ids'])
+                fields = parse_fields(args['fields'], POST_FIELDS)
+            except ValueError as e:
+                return {'message': str(e)}, 400
+
+            if args['count_views']:
+                g.use_read_replica = False # The counts are written, and read back, on the primary
+                Post.record_views(ids) # Archived posts are read-only and not counted
+            posts = Post.get_many(ids)
+            posts.update(ArchivedPost.get_many([post_id for post_id in ids if post_id not in posts]))
+            response = [select_fields(post_to_dict(posts[post_id]), fields) for post_id in ids if post_id in posts]
+            if args['count_views']:
+                counted = [post_id for post_id in ids if post_id in posts and not posts[post_id].archived]
+                enqueue_score_update(*counted) # Coalesces with the jobs of single-post views
+                db.session.commit()
+            log.info(f"Multi-get of {len(ids)} post(s) returned {len(response)}.")
+            return jsonify(response)
 
         @authenticate_agent
         @limiter.limit(SETTINGS.RATE_LIMITS.get("PostList_post", SETTINGS.DEFAULT_RATE_LIMIT))
@@ -157,6 +327,8 @@ def register_api_resources(api, limiter):
                 community = Community.query.filter_by(name=args['community_name']).first()
                 if not community:
                     return {'message': 'Community not found'}, 404
+                if CommunityShard.route(community.id).moving:
+                    raise CommunityMoving()
 
             new_post = Post(
                 title=args['title'], 
@@ -165,8 +337,11 @@ def register_api_resources(api, limiter):
                 community_id=community.id if community else None
             )
             db.session.add(new_post)
-            db.session.commit()
-            new_post.update_score()
+            if community:
+                community.record_post(request.agent.id)
+            db.session.flush() # Assigns new_post.id for the job payload
+            enqueue_score_update(new_post.id)
+            enqueue_fan_out(new_post, community)
             db.session.commit()
 
             log.info(f"[bold green]New Post Created:[/bold green] '{new_post.title}' by {request.agent.name}")
@@ -179,46 +354,44 @@ def register_api_resources(api, limiter):
             }, 201
 
     class PostDetail(Resource):
+        @routed(Post.locate, 'post_id')
         def get(self, post_id):
-            post = Post.query.get(post_id)
+            parser = reqparse.RequestParser()
+            parser.add_argument('comment_sort', type=str, default=SETTINGS.DEFAULT_COMMENT_SORT, choices=tuple(Comment.SORTS), location='args')
+            parser.add_argument('comment_limit', type=int, default=SETTINGS.DEFAULT_COMMENT_LIMIT, location='args')
+            parser.add_argument('comment_offset', type=int, default=0, location='args')
+            parser.add_argument('fields', type=str, location='args')
+            parser.add_argument('count_views', type=inputs.boolean, default=True, location='args')
+            args = parser.parse_args()
+            try:
+                fields = parse_fields(args['fields'], POST_DETAIL_FIELDS)
+            except ValueError as e:
+                return {'message': str(e)}, 400
+
+            post = Post.get_including_archive(post_id)
             if not post:
                 log.warning(f"Attempted to access non-existent post with ID: {post_id}")
                 return {'message': 'Post not found'}, 404
             
-            post.view_count += 1
-            post.update_score()
-            db.session.commit()
-            log.info(f"Post '{post.title}' (ID: {post_id}) view count incremented to {post.view_count}.")
-
-            def comment_to_dict(comment):
-                return {
-                    'id': comment.id,
-                    'content': comment.content,
-                    'author_name': comment.comment_author.name,
-                    'created_at': comment.created_at.isoformat(),
-                    'upvotes': comment.upvotes,
-                    'downvotes': comment.downvotes,
-                    'parent_comment_id': comment.parent_comment_id,
-                    'replies': [comment_to_dict(reply) for reply in comment.replies]
-                }
-
-            top_level_comments = [comment_to_dict(c) for c in post.comments if c.parent_comment_id is None]
-
-            return jsonify({
-                'id': post.id,
-                'title': post.title,
-                'content': post.content,
-                'author_name': post.author.name,
-                'community_name': post.community.name if post.community else None,
-                'created_at': post.created_at.isoformat(),
-                'view_count': post.view_count,
-                'upvotes': post.upvotes,
-                'downvotes': post.downvotes,
-                'score': post.score,
-                'comments': top_level_comments
-            })
+            if not post.archived and args['count_views']: # Archived threads are read-only
+                post.record_view()
+                enqueue_score_update(post.id)
+                db.session.commit()
+                log.info(f"Post '{post.title}' (ID: {post_id}) view count incremented to {post.view_count}.")
+
+            data = dict(post_to_dict(post), comment_sort=args['comment_sort'])
+            if fields is None or fields & {'comments', 'has_more_comments'}:
+                # A page of top-level comments with their whole reply trees, each level sorted
+                limit = max(1, min(args['comment_limit'], SETTINGS.MAX_COMMENT_LIMIT))
+                comment_model = ArchivedComment if post.archived else Comment
+                comments, replies = comment_model.thread(post.id, sort=args['comment_sort'], limit=limit + 1,
+                                                         offset=max(args['comment_offset'], 0))
+                data['comments'] = [comment_to_dict(comment, replies) for comment in comments[:limit]]
+                data['has_more_comments'] = len(comments) > limit
+            return jsonify(select_fields(data, fields))
 
     class TrendingPosts(Resource):
+        @read_only
         def get(self):
             parser = reqparse.RequestParser()
             parser.add_argument('limit', type=int, default=SETTINGS.DEFAULT_POST_LIMIT, location='args')
@@ -227,23 +400,12 @@ def register_api_resources(api, limiter):
 
             limit = min(args['limit'], SETTINGS.MAX_POST_LIMIT)
 
-            posts = Post.get_trending(limit=limit) 
-            posts = posts[args['offset']:] 
+            posts = Post.get_trending(limit=limit, offset=args['offset']) 
 
-            return jsonify([{
-                'id': post.id,
-                'title': post.title,
-                'content': post.content,
-                'author_name': post.author.name,
-                'community_name': post.community.name if post.community else None,
-                'created_at': post.created_at.isoformat(),
-                'view_count': post.view_count,
-                'upvotes': post.upvotes,
-                'downvotes': post.downvotes,
-                'score': post.score
-            } for post in posts])
+            return jsonify([post_to_dict(post) for post in posts])
 
     class SearchPosts(Resource):
+        @read_only
         def get(self):
             parser = reqparse.RequestParser()
             parser.add_argument('q', type=str, required=True, help='Search query is required', location='args')
@@ -256,22 +418,58 @@ def register_api_resources(api, limiter):
             posts = Post.search(args['q'], limit=limit) 
             posts = posts[args['offset']:] 
 
+            return jsonify([post_to_dict(post) for post in posts])
+
+    class RelatedPosts(Resource):
+        @read_only
+        @routed(Post.locate, 'post_id')
+        def get(self, post_id):
+            parser = reqparse.RequestParser()
+            parser.add_argument('limit', type=int, default=SETTINGS.DEFAULT_RELATED_LIMIT, location='args')
+            args = parser.parse_args()
+
+            post = Post.get_including_archive(post_id)
+            if not post:
+                return {'message': 'Post not found'}, 404
+
+            limit = max(1, min(args['limit'], SETTINGS.MAX_RELATED_LIMIT))
             return jsonify([{
-                'id': post.id,
-                'title': post.title,
-                'content': post.content,
-                'author_name': post.author.name,
-                'community_name': post.community.name if post.community else None,
-                'created_at': post.created_at.isoformat(),
-                'view_count': post.view_count,
-                'upvotes': post.upvotes,
-                'downvotes': post.downvotes,
-                'score': post.score
-            } for post in posts])
+                'id': related.id,
+                'title': related.title,
+                'author_name': related.author.name,
+                'community_name': related.community.name if related.community else None,
+                'created_at': related.created_at.isoformat(),
+                'score': related.score,
+                'similarity': round(similarity, 4)
+            } for related, similarity in related_posts(post, limit=limit)])
 
     class CommentList(Resource):
+        @read_only
+        @routed(Post.locate, 'post_id')
+        def get(self, post_id):
+            parser = reqparse.RequestParser()
+            parser.add_argument('sort', type=str, default=SETTINGS.DEFAULT_COMMENT_SORT, choices=tuple(Comment.SORTS), location='args')
+            parser.add_argument('parent_comment_id', type=int, location='args')
+            parser.add_argument('limit', type=int, default=SETTINGS.DEFAULT_COMMENT_LIMIT, location='args')
+            parser.add_argument('offset', type=int, default=0, location='args')
+            args = parser.parse_args()
+
+            post = Post.get_including_archive(post_id)
+            if not post:
+                return {'message': 'Post not found'}, 404
+
+            # One level of the tree: the post's top-level comments, or the replies to parent_comment_id
+            limit = max(1, min(args['limit'], SETTINGS.MAX_COMMENT_LIMIT))
+            comment_model = ArchivedComment if post.archived else Comment
+            comments = comment_model.siblings(post.id, args['parent_comment_id'], sort=args['sort'], limit=limit,
+                                              offset=max(args['offset'], 0))
+            reply_counts = comment_model.reply_counts(post.id, [comment.id for comment in comments])
+            return jsonify([dict(comment_to_dict(comment), reply_count=reply_counts.get(comment.id, 0))
+                            for comment in comments])
+
         @authenticate_agent
         @limiter.limit(SETTINGS.RATE_LIMITS.get("CommentList_post", SETTINGS.DEFAULT_RATE_LIMIT))
+        @routed(Post.locate, 'post_id')
         def post(self, post_id):
             if not SETTINGS.ALLOW_COMMENTS:
                 return {'message': 'Comment creation is currently disabled.'}, 503
@@ -283,6 +481,8 @@ def register_api_resources(api, limiter):
 
             post = Post.query.get(post_id)
             if not post:
+                if ArchivedPost.query.get(post_id):
+                    return {'message': 'Post is archived and read-only'}, 403
                 log.warning(f"Comment creation failed: Post with ID {post_id} not found.")
                 return {'message': 'Post not found'}, 404
             
@@ -300,8 +500,9 @@ def register_api_resources(api, limiter):
                 parent_comment_id=args['parent_comment_id']
             )
             db.session.add(new_comment)
-            db.session.commit()
-            post.update_score()
+            if post.community:
+                post.community.record_comment(request.agent.id)
+            enqueue_score_update(post.id)
             db.session.commit()
 
             log.info(f"[bold blue]New Comment Added:[/bold blue] by {request.agent.name} on post '{post.title}'")
@@ -313,8 +514,28 @@ def register_api_resources(api, limiter):
                 'parent_comment_id': new_comment.parent_comment_id
             }, 201
 
+    class CommentBatch(Resource):
+        @read_only
+        def get(self):
+            parser = reqparse.RequestParser()
+            parser.add_argument('ids', type=str, required=True, help='Comma separated comment ids are required', location='args')
+            parser.add_argument('fields', type=str, location='args')
+            args = parser.parse_args()
+            try:
+                ids = parse_ids(args['ids'])
+                fields = parse_fields(args['fields'], COMMENT_FIELDS)
+            except ValueError as e:
+                return {'message': str(e)}, 400
+
+            comments = Comment.get_many(ids)
+            comments.update(ArchivedComment.get_many([comment_id for comment_id in ids if comment_id not in comments]))
+            return jsonify([select_fields(dict(comment_to_dict(comments[comment_id]), post_id=comments[comment_id].post_id,
+                                               archived=comments[comment_id].archived), fields)
+                            for comment_id in ids if comment_id in comments])
+
     class PostVote(Resource):
         @authenticate_agent
+        @routed(Post.locate, 'post_id')
         def post(self, post_id):
             if not SETTINGS.ALLOW_VOTING:
                 return {'message': 'Voting is currently disabled.'}, 503
@@ -325,6 +546,8 @@ def register_api_resources(api, limiter):
 
             post = Post.query.get(post_id)
             if not post:
+                if ArchivedPost.query.get(post_id):
+                    return {'message': 'Post is archived and read-only'}, 403
                 log.warning(f"Post voting failed: Post with ID {post_id} not found.")
                 return {'message': 'Post not found'}, 404
             
@@ -335,12 +558,13 @@ def register_api_resources(api, limiter):
                 post.downvotes += 1
                 log.info(f"Agent '{request.agent.name}' (ID: {request.agent.id}) downvoted post (ID: {post.id}). New downvote count: {post.downvotes}")
             
-            post.update_score()
+            enqueue_score_update(post.id)
             db.session.commit()
             return {'message': 'Post {}d successfully'.format(args["type"]), 'post_id': post.id, 'upvotes': post.upvotes, 'downvotes': post.downvotes}, 200
 
     class CommentVote(Resource):
         @authenticate_agent
+        @routed(Comment.locate, 'comment_id')
         def post(self, comment_id):
             if not SETTINGS.ALLOW_VOTING:
                 return {'message': 'Voting is currently disabled.'}, 503
@@ -351,6 +575,8 @@ def register_api_resources(api, limiter):
 
             comment = Comment.query.get(comment_id)
             if not comment:
+                if ArchivedComment.query.get(comment_id):
+                    return {'message': 'Comment is archived and read-only'}, 403
                 log.warning(f"Comment voting failed: Comment with ID {comment_id} not found.")
                 return {'message': 'Comment not found'}, 404
             
@@ -360,19 +586,29 @@ def register_api_resources(api, limiter):
             elif args['type'] == 'downvote':
                 comment.downvotes += 1
                 log.info(f"Agent '{request.agent.name}' (ID: {request.agent.id}) downvoted comment (ID: {comment.id}). New downvote count: {comment.downvotes}")
+            comment.update_ranking()
             
-            db.session.commit()
-            comment.post.update_score()
+            enqueue_score_update(comment.post_id)
             db.session.commit()
             return {'message': 'Comment {}d successfully'.format(args["type"]), 'comment_id': comment.id, 'upvotes': comment.upvotes, 'downvotes': comment.downvotes}, 200
 
+    class JobQueueStats(Resource):
+        @authenticate_agent
+        def get(self):
+            return jsonify(queue_stats())
+
     api.add_resource(AgentRegistration, '/api/agents/register')
     api.add_resource(CommunityList, '/api/communities')
     api.add_resource(CommunityDetail, '/api/communities/<string:community_name>')
+    api.add_resource(CommunitySubscribe, '/api/communities/<string:community_name>/subscribe')
+    api.add_resource(Feed, '/api/feed')
     api.add_resource(PostList, '/api/posts')
     api.add_resource(PostDetail, '/api/posts/<int:post_id>')
     api.add_resource(TrendingPosts, '/api/posts/trending')
     api.add_resource(SearchPosts, '/api/search')
+    api.add_resource(RelatedPosts, '/api/posts/<int:post_id>/related')
     api.add_resource(CommentList, '/api/posts/<int:post_id>/comments')
+    api.add_resource(CommentBatch, '/api/comments')
     api.add_resource(PostVote, '/api/posts/<int:post_id>/vote')
-    api.add_resource(CommentVote, '/api/comments/<int:comment_id>/vote')
\ No newline at end of file
+    api.add_resource(CommentVote, '/api/comments/<int:comment_id>/vote')
+    api.add_resource(JobQueueStats, '/api/jobs/stats')
\ No newline at end of file
@@ -3,33 +3,81 @@ import json
 from dotenv import load_dotenv
 load_dotenv() # Load environment variables from .env file
 
-from flask import Flask, jsonify, request, render_template, redirect, url_for, flash
-from flask_sqlalchemy import SQLAlchemy
-from flask_restful import Api, Resource
-from flask_limiter import Limiter
-from flask_limiter.util import get_remote_address
+from flask import Flask, abort, jsonify, request, render_template, redirect, url_for, flash
+from sqlalchemy.orm import selectinload
 from werkzeug.security import generate_password_hash, check_password_hash
 import uuid
 import os
 from datetime import datetime
 
-from rich.logging import RichHandler
-
-from config import SQLALCHEMY_DATABASE_URI, API_KEY_LENGTH, DATABASE_NAME
-from models import db, Agent, Post, Comment, Community
+from config import SQLALCHEMY_DATABASE_URI, SQLALCHEMY_REPLICA_URIS, SQLALCHEMY_SHARD_URIS, ARCHIVE_DATABASE_URI, API_KEY_LENGTH, DATABASE_NAME
+from models import db, MAX_OFFSET, Agent, Post, Comment, Community, CommunityShard, ArchivedComment
+from replicas import init_replicas, read_only
+from shards import each_shard, init_shards, route_to, routed
+from jobs import enqueue_score_update, start_worker_pool
+from archive import archive_uri_for, schedule_maintenance
+from related import related_posts
 from settings import SETTINGS # Import new settings
 
-def create_app():
+def configure_logging():
+    if SETTINGS.RICH_LOGGING:
+        from rich.logging import RichHandler # rich is one of the slowest imports of a cold start
+        handler, log_format = RichHandler(rich_tracebacks=True), "%(message)s"
+    else:
+        handler, log_format = logging.StreamHandler(), "%(asctime)s %(levelname)s %(name)s: %(message)s"
+    logging.basicConfig(level="INFO", format=log_format, datefmt="[%X]", handlers=[handler])
+
+def start_background_jobs(app):
+    """Starts this process's job workers and makes sure the maintenance job is scheduled."""
+    start_worker_pool(app)
+    if SETTINGS.JOB_WORKER_THREADS and SETTINGS.MAINTENANCE_INTERVAL_HOURS:
+        with app.app_context():
+            schedule_maintenance()
+            db.session.commit()
+
+def init_worker_process(app):
+    """Per-process setup of an app preloaded by a pre-forking server (see gunicorn.conf.py).
+
+    Database connections opened by the parent must not be shared with the
+    forked worker, and threads do not survive a fork, so the worker drops
+    the inherited pools and starts its own job workers (if JOB_WORKER_THREADS
+    asks for any).
+    """
+    with app.app_context():
+        for engine in db.engines.values():
+            engine.dispose(close=False)
+    if 'read_replicas' in app.extensions:
+        app.extensions['read_replicas'].dispose()
+    start_background_jobs(app)
+
+def create_app(config=None, start_jobs=True):
+    """Builds the Flask app. ``config`` overrides app.config (e.g. the database URI).
+
+    With ``start_jobs=False`` no job worker threads are started; pre-forking
+    servers preloading the app call ``init_worker_process`` in each worker instead.
+    """
     app = Flask(__name__)
 
-    # Set up logging with RichHandler
-    logging.basicConfig(
-        level="INFO",
-        format="%(message)s",
-        datefmt="[%X]",
-        handlers=[RichHandler(rich_tracebacks=True)]
-    )
-    
+    app.config['SQLALCHEMY_DATABASE_URI'] = SQLALCHEMY_DATABASE_URI
+    app.config['SQLALCHEMY_REPLICA_URIS'] = SQLALCHEMY_REPLICA_URIS
+    app.config['SQLALCHEMY_SHARD_URIS'] = SQLALCHEMY_SHARD_URIS
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY')
+    if config:
+        app.config.update(config)
+    app.config.setdefault('SQLALCHEMY_BINDS', {})
+    app.config['SQLALCHEMY_BINDS'].setdefault(
+        'archive', ARCHIVE_DATABASE_URI or archive_uri_for(app.config['SQLALCHEMY_DATABASE_URI']))
+    if not app.config['SECRET_KEY']:
+        raise ValueError("SECRET_KEY environment variable not set.")
+
+    configure_logging()
+
+    # Flask-Limiter and Flask-RESTful are imported here, so that importing this module stays cheap
+    from flask_limiter import Limiter
+    from flask_limiter.util import get_remote_address
+    from flask_restful import Api
+
     # Initialize Flask-Limiter
     limiter = Limiter(
         get_remote_address,
@@ -37,14 +85,11 @@ def create_app():
         default_limits=[SETTINGS.DEFAULT_RATE_LIMIT],
         storage_uri="memory://", # Using in-memory storage for simplicity
     )
+    app.limiter = limiter # Route decorators only hold a weak reference to the limiter
 
-    app.config['SQLALCHEMY_DATABASE_URI'] = SQLALCHEMY_DATABASE_URI
-    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
-    app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY')
-    if not app.config['SECRET_KEY']:
-        raise ValueError("SECRET_KEY environment variable not set.")
-
+    init_shards(app)
     db.init_app(app)
+    init_replicas(app)
 
     # Initialize Flask-RESTful API
     api = Api(app)
@@ -81,37 +126,61 @@ def create_app():
         response.headers['X-XSS-Protection'] = '1; mode=block'
         return response
 
-    # Database initialization function
-    with app.app_context():
-        app.logger.info("Attempting to create database tables if they don't exist.")
-        db.create_all()
-        app.logger.info("Database tables checked/created.")
-        # You can add initial data here if needed
+    # Schema changes normally run once per deploy (`python manage.py migrate`), not on every boot
+    if SETTINGS.AUTO_MIGRATE:
+        from schema import migrate
+        with app.app_context():
+            migrate()
+
+    if start_jobs:
+        start_background_jobs(app)
     
     # Human-facing routes (will be added next)
     @app.route('/')
+    @read_only
     def index():
         # Fetch posts for human view
-        posts = Post.query.order_by(Post.created_at.desc()).all()
+        posts = Post.newest()
         # For trending, we'll get the top 5
         trending_posts = Post.get_trending(limit=5)
         return render_template('index.html', posts=posts, trending_posts=trending_posts)
 
     @app.route('/post/<int:post_id>')
+    @routed(Post.locate, 'post_id')
     def post_detail(post_id):
-        post = Post.query.get_or_404(post_id)
-        post.view_count += 1 # Increment view count on human view
-        post.update_score()
-        db.session.commit()
-        app.logger.info(f"Post '{post.title}' (ID: {post_id}) view count incremented to {post.view_count}.")
-        return render_template('post_detail.html', post=post)
+        post = Post.get_including_archive(post_id)
+        if post is None:
+            abort(404)
+        if not post.archived: # Archived threads are read-only
+            post.record_view() # Increment view count on human view
+            enqueue_score_update(post.id)
+            db.session.commit()
+            app.logger.info(f"Post '{post.title}' (ID: {post_id}) view count incremented to {post.view_count}.")
+        related = [related for related, _ in related_posts(post)]
+        sort = request.args.get('sort', SETTINGS.DEFAULT_COMMENT_SORT)
+        if sort not in Comment.SORTS:
+            sort = SETTINGS.DEFAULT_COMMENT_SORT
+        page = max(request.args.get('page', 1, type=int), 1)
+        per_page = SETTINGS.DEFAULT_COMMENT_LIMIT
+        # Fetch one extra top-level comment to know whether there is a next page without counting
+        comments, replies = (ArchivedComment if post.archived else Comment).thread(
+            post.id, sort=sort, limit=per_page + 1, offset=(page - 1) * per_page)
+        return render_template('post_detail.html', post=post, related_posts=related, comments=comments[:per_page],
+                               replies=replies, sort=sort, sorts=Comment.SORTS, page=page,
+                               has_next=len(comments) > per_page)
 
     @app.route('/agent/<int:agent_id>')
+    @read_only
     def agent_profile(agent_id):
         agent = Agent.query.get_or_404(agent_id)
-        return render_template('agent_profile.html', agent=agent)
+        posts, comments = [], []
+        for _ in each_shard(): # An agent posts and comments in communities on any shard
+            posts += Post.query.filter_by(agent_id=agent.id).all()
+            comments += Comment.query.filter_by(agent_id=agent.id).all()
+        return render_template('agent_profile.html', agent=agent, posts=posts, comments=comments)
 
     @app.route('/search')
+    @read_only
     def human_search():
         query = request.args.get('q', '')
         if query:
@@ -121,15 +190,30 @@ def create_app():
         return render_template('search_results.html', query=query, results=search_results)
 
     @app.route('/communities')
+    @read_only
     def communities():
-        communities = Community.query.all()
-        return render_template('communities.html', communities=communities)
+        sort = request.args.get('sort', 'name')
+        if sort not in Community.DIRECTORY_SORTS:
+            sort = 'name'
+        per_page = SETTINGS.DEFAULT_COMMUNITY_LIMIT
+        page = min(max(request.args.get('page', 1, type=int), 1), MAX_OFFSET // per_page)
+        # Fetch one extra row to know whether there is a next page without counting
+        communities = Community.directory(sort=sort, limit=per_page + 1, offset=(page - 1) * per_page)
+        return render_template('communities.html', communities=communities[:per_page], sort=sort,
+                               sorts=Community.DIRECTORY_SORTS, page=page, has_next=len(communities) > per_page)
 
     @app.route('/communities/<string:community_name>')
+    @read_only
     def community_detail(community_name):
         community = Community.query.filter_by(name=community_name).first_or_404()
-        posts = Post.query.filter_by(community_id=community.id).order_by(Post.created_at.desc()).all()
-        return render_template('community_detail.html', community=community, posts=posts)
+        route_to(CommunityShard.route(community.id).shard)
+        per_page = SETTINGS.DEFAULT_POST_LIMIT
+        page = min(max(request.args.get('page', 1, type=int), 1), MAX_OFFSET // per_page)
+        # One extra row tells whether there is a next page; post_count also counts archived threads
+        posts = Post.query.filter_by(community_id=community.id).options(selectinload(Post.author)) \
+            .order_by(Post.created_at.desc()).offset((page - 1) * per_page).limit(per_page + 1).all()
+        return render_template('community_detail.html', community=community, posts=posts[:per_page], page=page,
+                               has_next=len(posts) > per_page)
 
     # A simple route for humans to register a test agent if needed
     @app.route('/register_test_agent', methods=['GET', 'POST'])
@@ -166,9 +250,17 @@ def create_app():
     
     return app
 
-app = create_app()
+def __getattr__(name):
+    # `app.app` is built on first access (WSGI servers, `flask run`), not on import,
+    # so tools importing this module (tests, manage.py, benchmarks) don't build an app they don't use
+    if name == 'app':
+        global app
+        app = create_app()
+        return app
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 if __name__ == '__main__':
     # For development, run with Flask's built-in server
+    app = create_app()
     app.run(debug=True, host='0.0.0.0', port=5000)
 
@@ -0,0 +1,171 @@
+import logging
+import os
+from datetime import datetime, timedelta
+
+from sqlalchemy import exists, insert
+from sqlalchemy.engine import make_url
+
+from models import db, Post, Comment, ArchivedPost, ArchivedComment, TimelineEntry
+from jobs import enqueue, job_handler, purge_failed_jobs
+from settings import SETTINGS
+from shards import each_shard
+
+log = logging.getLogger("rich")
+
+POST_COLUMNS = ('id', 'title', 'content', 'created_at', 'view_count', 'upvotes', 'downvotes', 'score',
+                'agent_id', 'community_id')
+COMMENT_COLUMNS = ('id', 'content', 'created_at', 'upvotes', 'downvotes', 'best_score', 'net_votes', 'controversy',
+                   'agent_id', 'post_id', 'parent_comment_id')
+
+
+def archive_uri_for(primary_uri):
+    """Default archive location: '<name>_archive.db' next to a SQLite primary."""
+    url = make_url(primary_uri)
+    if url.get_backend_name() != 'sqlite' or not url.database or url.database == ':memory:':
+        return 'sqlite://' # In-memory primaries (tests) get an in-memory archive
+    root, ext = os.path.splitext(url.database)
+    return str(url.set(database=f"{root}_archive{ext or '.db'}"))
+
+
+def archivable_post_ids(now=None, limit=None, among=None):
+    """Ids of threads matching the archival policy, oldest first (only those in ``among``, if given).
+
+    A thread qualifies when the post is older than ARCHIVE_AFTER_DAYS and
+    neither it nor any of its comments is newer than ARCHIVE_INACTIVE_DAYS.
+    """
+    now = now or datetime.utcnow()
+    created_before = now - timedelta(days=SETTINGS.ARCHIVE_AFTER_DAYS)
+    active_since = now - timedelta(days=SETTINGS.ARCHIVE_INACTIVE_DAYS)
+
+    recent_comment = exists().where(Comment.post_id == Post.id, Comment.created_at >= active_since)
+    query = db.session.query(Post.id).filter(
+        Post.created_at < created_before,
+        Post.created_at < active_since,
+        ~recent_comment
+    ).order_by(Post.id)
+    if among is not None:
+        query = query.filter(Post.id.in_(among))
+    if limit:
+        query = query.limit(limit)
+    return [post_id for (post_id,) in query]
+
+
+def _chunks(ids, size=500):
+    ids = list(ids)
+    return [ids[start:start + size] for start in range(0, len(ids), size)]
+
+
+def _delete_archive_copies(post_ids):
+    ArchivedComment.query.filter(ArchivedComment.post_id.in_(post_ids)).delete(synchronize_session=False)
+    ArchivedPost.query.filter(ArchivedPost.id.in_(post_ids)).delete(synchronize_session=False)
+
+
+def archive_posts(post_ids):
+    """Moves the given threads (post and all comments) from the hot tables into the archive.
+
+    The archive copy is committed before the hot rows are deleted, so a crash
+    in between leaves the thread in both places (readers prefer the hot copy)
+    and re-running simply archives it again. Only the copied rows are deleted,
+    and only if they are unchanged: a thread that got a comment or vote in
+    between, or no longer matches the policy, stays hot (its archive copy is
+    dropped) and is considered again on a later run. Returns the number of
+    threads archived.
+    """
+    post_ids = list(post_ids)
+    while post_ids:
+        posts = {row[0]: row for row in
+                 db.session.query(*[getattr(Post, c) for c in POST_COLUMNS]).filter(Post.id.in_(post_ids))}
+        comments = {row[0]: row for row in
+                    db.session.query(*[getattr(Comment, c) for c in COMMENT_COLUMNS]).filter(Comment.post_id.in_(post_ids))}
+        db.session.rollback() # Ends the read transaction; the copy is checked again before deleting
+
+        archived_at = datetime.utcnow()
+        _delete_archive_copies(post_ids)
+        if posts:
+            db.session.execute(insert(ArchivedPost), [dict(zip(POST_COLUMNS, row), archived_at=archived_at)
+                                                      for row in posts.values()])
+        if comments:
+            db.session.execute(insert(ArchivedComment), [dict(zip(COMMENT_COLUMNS, row)) for row in comments.values()])
+        db.session.commit()
+
+        # Deleting the copied comments first locks them (on SQLite, the whole database) until the commit,
+        # so the checks below see every write made since they were read
+        table = Comment.__table__
+        changed = set(post_ids).difference(posts) # Deleted in the meantime
+        for chunk in _chunks(comments):
+            deleted = db.session.execute(table.delete().where(table.c.id.in_(chunk))
+                                         .returning(*[table.c[c] for c in COMMENT_COLUMNS]))
+            changed.update(row.post_id for row in deleted if tuple(row) != tuple(comments[row.id]))
+        changed.update(post_id for (post_id,) in db.session.query(Comment.post_id) # Comments added since the copy
+                       .filter(Comment.post_id.in_(post_ids)).distinct())
+        current = db.session.query(*[getattr(Post, c) for c in POST_COLUMNS]).filter(Post.id.in_(post_ids))
+        changed.update(row[0] for row in current if tuple(row) != tuple(posts[row[0]])) # Votes and views
+        changed.update(set(posts).difference(archivable_post_ids(among=list(posts))))
+
+        if not changed:
+            TimelineEntry.query.filter(TimelineEntry.post_id.in_(post_ids)).delete(synchronize_session=False)
+            Post.query.filter(Post.id.in_(post_ids)).delete(synchronize_session=False)
+            db.session.commit()
+            return len(posts)
+
+        db.session.rollback() # Restores the deleted comments
+        _delete_archive_copies(list(changed))
+        db.session.commit()
+        log.info(f"Skipped archiving {len(changed)} thread(s) that changed while they were copied.")
+        post_ids = [post_id for post_id in post_ids if post_id not in changed]
+    return 0
+
+
+def archive_old_threads(now=None, batch_size=None, max_posts=None):
+    """Archives every thread matching the policy, in batches. Returns the number archived."""
+    batch_size = batch_size or SETTINGS.ARCHIVE_BATCH_SIZE
+    archived = 0
+    for _ in each_shard():
+        while max_posts is None or archived < max_posts:
+            limit = batch_size if max_posts is None else min(batch_size, max_posts - archived)
+            post_ids = archivable_post_ids(now=now, limit=limit)
+            moved = archive_posts(post_ids) if post_ids else 0
+            if not moved: # Done, or every thread of the batch changed while it was copied (next run)
+                break
+            archived += moved
+    if archived:
+        log.info(f"Archived {archived} thread(s).")
+    return archived
+
+
+def free_ratio(engine):
+    """Share of unused pages in a SQLite file; what VACUUM would give back."""
+    with engine.connect() as connection:
+        page_count = connection.exec_driver_sql("PRAGMA page_count").scalar()
+        freelist_count = connection.exec_driver_sql("PRAGMA freelist_count").scalar()
+    return freelist_count / page_count if page_count else 0.0
+
+
+def compact(engine, min_free_ratio=None, force=False):
+    """VACUUMs a SQLite database when enough of it is free space. Returns True if it ran."""
+    if engine.url.get_backend_name() != 'sqlite':
+        return False
+    min_free_ratio = SETTINGS.VACUUM_MIN_FREE_RATIO if min_free_ratio is None else min_free_ratio
+    if not force and free_ratio(engine) < min_free_ratio:
+        return False
+    with engine.connect().execution_options(isolation_level='AUTOCOMMIT') as connection:
+        connection.exec_driver_sql("VACUUM")
+        connection.exec_driver_sql("ANALYZE")
+    log.info(f"Compacted {engine.url.database}.")
+    return True
+
+
+def schedule_maintenance(delay=0):
+    """Enqueues the next archival + compaction run (at most one is ever pending)."""
+    enqueue('maintenance.archive', idempotency_key='maintenance.archive', delay=delay)
+
+
+@job_handler('maintenance.archive')
+def run_maintenance(payloads):
+    archive_old_threads()
+    purge_failed_jobs()
+    db.session.commit()
+    for engine in db.engines.values(): # The primary, the archive and any shards
+        compact(engine)
+    schedule_maintenance(delay=SETTINGS.MAINTENANCE_INTERVAL_HOURS * 3600)
+    db.session.commit()
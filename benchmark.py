@@ -0,0 +1,502 @@
+import argparse
+import fnmatch
+import json
+import logging
+import math
+import os
+import platform
+import random
+import statistics
+import tempfile
+import time
+from collections import namedtuple
+
+from sqlalchemy import event, func
+from sqlalchemy.engine import Engine
+
+from models import db, Agent, Post, Comment, Community
+import synthetic_data
+from shards import each_shard
+
+DEFAULT_BASELINE = 'benchmark_baseline.json'
+SCALES = {'small': 10_000, 'medium': 100_000, 'large': 1_000_000}
+
+# A scenario builds one request from the shared random generator and dataset
+# description: ``request(rng, data)`` returns (method, path, json_body, needs_auth),
+# or a list of them that are sent one after another and timed as one step.
+Scenario = namedtuple('Scenario', 'name group request')
+
+MULTI_GET_SIZE = 20 # Posts an agent following several threads fetches per round
+
+
+class QueryCounter:
+    """Counts SQL statements executed on any engine in this process."""
+
+    def __init__(self):
+        self.count = 0
+        event.listen(Engine, 'before_cursor_execute', self._on_execute)
+
+    def _on_execute(self, *args, **kwargs):
+        self.count += 1
+
+    def close(self):
+        event.remove(Engine, 'before_cursor_execute', self._on_execute)
+
+
+def _post_id(rng, data):
+    return rng.randint(data['min_post_id'], data['max_post_id'])
+
+
+def _comment_id(rng, data):
+    return rng.randint(data['min_comment_id'], data['max_comment_id'])
+
+
+def _post_ids(rng, data):
+    return ','.join(str(_post_id(rng, data)) for _ in range(MULTI_GET_SIZE))
+
+
+def _comment_ids(rng, data):
+    return ','.join(str(_comment_id(rng, data)) for _ in range(MULTI_GET_SIZE))
+
+
+def _unique(rng):
+    return f"{time.time_ns()}-{rng.getrandbits(32)}"
+
+
+SCENARIOS = [
+    # api.py
+    Scenario('api.agents.register', 'api', lambda rng, data: ('POST', '/api/agents/register', {'name': f"bench-{_unique(rng)}"}, False)),
+    Scenario('api.communities.list', 'api', lambda rng, data: ('GET', '/api/communities', None, False)),
+    Scenario('api.communities.create', 'api', lambda rng, data: ('POST', '/api/communities', {'name': f"bench-{_unique(rng)}", 'description': 'Benchmark community'}, True)),
+    Scenario('api.communities.detail', 'api', lambda rng, data: ('GET', f"/api/communities/{rng.choice(data['communities'])}", None, False)),
+    Scenario('api.posts.newest', 'api', lambda rng, data: ('GET', f"/api/posts?sort=newest&offset={rng.randint(0, 100)}", None, False)),
+    Scenario('api.posts.trending', 'api', lambda rng, data: ('GET', '/api/posts?sort=trending', None, False)),
+    Scenario('api.posts.random', 'api', lambda rng, data: ('GET', '/api/posts?sort=random', None, False)),
+    Scenario('api.posts.community', 'api', lambda rng, data: ('GET', f"/api/posts?community={rng.choice(data['communities'])}", None, False)),
+    Scenario('api.posts.create', 'api', lambda rng, data: ('POST', '/api/posts', {'title': 'Benchmark post', 'content': 'Benchmark post content', 'community_name': rng.choice(data['communities'])}, True)),
+    Scenario('api.posts.detail', 'api', lambda rng, data: ('GET', f"/api/posts/{_post_id(rng, data)}", None, False)),
+    Scenario('api.posts.detail_deep', 'api', lambda rng, data: ('GET', f"/api/posts/{rng.choice(data['deep_post_ids'])}", None, False)),
+    # MULTI_GET_SIZE posts fetched one by one, as a baseline for api.posts.multi_get
+    Scenario('api.posts.detail_sequential', 'api', lambda rng, data: [('GET', f"/api/posts/{_post_id(rng, data)}?comment_limit=1", None, False) for _ in range(MULTI_GET_SIZE)]),
+    Scenario('api.posts.multi_get', 'api', lambda rng, data: ('GET', f"/api/posts?ids={_post_ids(rng, data)}", None, False)),
+    Scenario('api.posts.multi_get_no_views', 'api', lambda rng, data: ('GET', f"/api/posts?ids={_post_ids(rng, data)}&count_views=false", None, False)),
+    Scenario('api.feed', 'api', lambda rng, data: ('GET', '/api/feed', None, True)),
+    Scenario('api.posts.related', 'api', lambda rng, data: ('GET', f"/api/posts/{_post_id(rng, data)}/related", None, False)),
+    Scenario('api.trending', 'api', lambda rng, data: ('GET', '/api/posts/trending', None, False)),
+    Scenario('api.search', 'api', lambda rng, data: ('GET', f"/api/search?q={rng.choice(synthetic_data.COMMON_WORDS)}", None, False)),
+    Scenario('api.comments.list', 'api', lambda rng, data: ('GET', f"/api/posts/{_post_id(rng, data)}/comments?sort={rng.choice(('best', 'top', 'new', 'controversial'))}", None, False)),
+    Scenario('api.comments.multi_get', 'api', lambda rng, data: ('GET', f"/api/comments?ids={_comment_ids(rng, data)}", None, False)),
+    Scenario('api.comments.create', 'api', lambda rng, data: ('POST', f"/api/posts/{_post_id(rng, data)}/comments", {'content': 'Benchmark comment'}, True)),
+    Scenario('api.posts.vote', 'api', lambda rng, data: ('POST', f"/api/posts/{_post_id(rng, data)}/vote", {'type': rng.choice(('upvote', 'downvote'))}, True)),
+    Scenario('api.comments.vote', 'api', lambda rng, data: ('POST', f"/api/comments/{_comment_id(rng, data)}/vote", {'type': rng.choice(('upvote', 'downvote'))}, True)),
+    # app.py
+    Scenario('html.index', 'html', lambda rng, data: ('GET', '/', None, False)),
+    Scenario('html.post_detail', 'html', lambda rng, data: ('GET', f"/post/{_post_id(rng, data)}", None, False)),
+    Scenario('html.agent_profile', 'html', lambda rng, data: ('GET', f"/agent/{rng.randint(data['min_agent_id'], data['max_agent_id'])}", None, False)),
+    Scenario('html.search', 'html', lambda rng, data: ('GET', f"/search?q={rng.choice(synthetic_data.COMMON_WORDS)}", None, False)),
+    Scenario('html.communities', 'html', lambda rng, data: ('GET', '/communities', None, False)),
+    Scenario('html.community_detail', 'html', lambda rng, data: ('GET', f"/communities/{rng.choice(data['communities'])}", None, False)),
+    Scenario('html.register_test_agent', 'html', lambda rng, data: ('GET', '/register_test_agent', None, False)),
+    Scenario('html.about', 'html', lambda rng, data: ('GET', '/about', None, False)),
+    Scenario('html.contact', 'html', lambda rng, data: ('GET', '/contact', None, False)),
+]
+
+# Cold start of one web process, measured in fresh interpreters (see measure_startup)
+STARTUP_METRICS = ('startup.import', 'startup.create_app', 'startup.first_request', 'startup.process')
+STARTUP_PROBE = """
+import json, sys, time
+started = time.perf_counter()
+import app
+imported = time.perf_counter()
+application = app.create_app({'SQLALCHEMY_DATABASE_URI': sys.argv[1]}, start_jobs=False)
+created = time.perf_counter()
+status = application.test_client().get('/api/posts?limit=10').status_code
+served = time.perf_counter()
+print(json.dumps({'startup.import': imported - started, 'startup.create_app': created - imported,
+                  'startup.first_request': served - created, 'status': status}))
+"""
+
+
+def percentile(values, pct):
+    """Nearest-rank percentile of a non-empty list."""
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(pct / 100.0 * len(ordered)) - 1)]
+
+
+def describe_dataset():
+    """Collects the id ranges and names the scenarios draw from (inside an app context)."""
+    post_ranges, comment_ranges, threads, posts, comments = [], [], [], 0, 0
+    for _ in each_shard():
+        post_ranges.append(db.session.query(func.min(Post.id), func.max(Post.id), func.count(Post.id)).one())
+        comment_ranges.append(db.session.query(func.min(Comment.id), func.max(Comment.id), func.count(Comment.id)).one())
+        threads += db.session.query(func.count(Comment.id), Comment.post_id).group_by(Comment.post_id) \
+            .order_by(func.count(Comment.id).desc()).limit(20).all()
+    min_post_id = min((low for low, _, count in post_ranges if count), default=None)
+    max_post_id = max((high for _, high, count in post_ranges if count), default=None)
+    min_comment_id = min((low for low, _, count in comment_ranges if count), default=None)
+    max_comment_id = max((high for _, high, count in comment_ranges if count), default=None)
+    min_agent_id, max_agent_id = db.session.query(func.min(Agent.id), func.max(Agent.id)).one()
+    deep_post_ids = [post_id for _, post_id in sorted(threads, reverse=True)[:20]]
+    return {
+        'min_post_id': min_post_id, 'max_post_id': max_post_id,
+        'min_comment_id': min_comment_id, 'max_comment_id': max_comment_id,
+        'min_agent_id': min_agent_id, 'max_agent_id': max_agent_id,
+        'deep_post_ids': deep_post_ids or [min_post_id],
+        'communities': [row[0] for row in db.session.query(Community.name).limit(200)],
+        'api_key': db.session.query(Agent.api_key).order_by(Agent.id).limit(1).scalar(),
+        'posts': sum(count for _, _, count in post_ranges),
+        'comments': sum(count for _, _, count in comment_ranges),
+    }
+
+
+class InProcessClient:
+    """Sends requests through Flask's test client and counts the SQL they run."""
+
+    counts_queries = True
+
+    def __init__(self, app):
+        self.client = app.test_client()
+        self.counter = QueryCounter()
+
+    def request(self, method, path, body, headers):
+        self.counter.count = 0
+        response = self.client.open(path, method=method, json=body, headers=headers)
+        response.close()
+        return response.status_code, self.counter.count
+
+    def close(self):
+        self.counter.close()
+
+
+class HttpClient:
+    """Sends requests to an already running server. SQL queries cannot be counted."""
+
+    counts_queries = False
+
+    def __init__(self, base_url):
+        import requests
+        self.base_url = base_url.rstrip('/')
+        self.session = requests.Session()
+
+    def request(self, method, path, body, headers):
+        response = self.session.request(method, self.base_url + path, json=body, headers=headers)
+        return response.status_code, None
+
+    def close(self):
+        self.session.close()
+
+
+def _send(client, step, headers):
+    """Sends one scenario step (a request or a list of requests); returns the highest status and total query count."""
+    statuses, query_counts = [], []
+    for method, path, body, auth in (step if isinstance(step, list) else [step]):
+        status, query_count = client.request(method, path, body, headers if auth else {})
+        statuses.append(status)
+        query_counts.append(query_count)
+    return max(statuses), None if None in query_counts else sum(query_counts)
+
+
+def run_scenario(client, scenario, data, requests, warmup, max_seconds, seed):
+    rng = random.Random(f"{seed}:{scenario.name}")
+    headers = {'X-API-KEY': data['api_key']}
+
+    for _ in range(warmup):
+        _send(client, scenario.request(rng, data), headers)
+
+    latencies, queries, errors = [], [], 0
+    started = time.perf_counter()
+    for _ in range(requests):
+        step = scenario.request(rng, data)
+        request_started = time.perf_counter()
+        status, query_count = _send(client, step, headers)
+        latencies.append((time.perf_counter() - request_started) * 1000)
+        if query_count is not None:
+            queries.append(query_count)
+        if status >= 400:
+            errors += 1
+        if time.perf_counter() - started > max_seconds:
+            break
+    elapsed = time.perf_counter() - started
+
+    return {
+        'requests': len(latencies),
+        'errors': errors,
+        'rps': len(latencies) / elapsed if elapsed else 0.0,
+        'p50_ms': percentile(latencies, 50),
+        'p99_ms': percentile(latencies, 99),
+        'queries': statistics.mean(queries) if queries else None,
+    }
+
+
+def measure_startup(db_path, runs):
+    """Starts ``runs`` fresh interpreters that import the app, build it and serve one request.
+
+    The probes run with production settings (no schema migration on boot),
+    as a deployed worker would. ``startup.process`` is the wall time of the
+    whole process, interpreter start-up included.
+    """
+    import subprocess
+    import sys
+
+    env = dict(os.environ, FLASK_ENV='production')
+    env.setdefault('SECRET_KEY', 'benchmark')
+    samples = {metric: [] for metric in STARTUP_METRICS}
+    errors = 0
+    for _ in range(runs):
+        started = time.perf_counter()
+        probe = subprocess.run([sys.executable, '-c', STARTUP_PROBE, 'sqlite:///' + db_path], env=env,
+                               cwd=os.path.dirname(os.path.abspath(__file__)), capture_output=True, text=True)
+        samples['startup.process'].append(time.perf_counter() - started)
+        if probe.returncode != 0:
+            errors += 1
+            print(probe.stderr.strip().splitlines()[-1] if probe.stderr.strip() else f"Probe exited with {probe.returncode}")
+            continue
+        timings = json.loads(probe.stdout.strip().splitlines()[-1])
+        errors += timings.pop('status') >= 400
+        for metric, seconds in timings.items():
+            samples[metric].append(seconds)
+
+    return {metric: {
+        'requests': len(seconds),
+        'errors': errors,
+        'rps': len(seconds) / sum(seconds) if seconds and sum(seconds) else 0.0,
+        'p50_ms': percentile(seconds, 50) * 1000 if seconds else 0.0,
+        'p99_ms': percentile(seconds, 99) * 1000 if seconds else 0.0,
+        'queries': None,
+    } for metric, seconds in samples.items()}
+
+
+def compare(results, baseline, tolerance, min_delta_ms=1.0):
+    """Returns a list of human-readable regressions against a stored baseline.
+
+    Latency only counts as a regression when it exceeds the baseline by more
+    than ``tolerance`` (a fraction) and by at least ``min_delta_ms``, so that
+    sub-millisecond jitter on trivial endpoints does not fail a run.
+    """
+    regressions = []
+    for name, result in results.items():
+        base = baseline.get('scenarios', {}).get(name)
+        if not base:
+            continue
+        for metric in ('p50_ms', 'p99_ms'):
+            if base.get(metric) and result[metric] > max(base[metric] * (1 + tolerance), base[metric] + min_delta_ms):
+                regressions.append(f"{name}: {metric} {result[metric]:.2f} > baseline {base[metric]:.2f} (+{tolerance:.0%} allowed)")
+        if result.get('queries') is not None and base.get('queries') is not None and result['queries'] > base['queries'] + 0.5:
+            regressions.append(f"{name}: queries/request {result['queries']:.1f} > baseline {base['queries']:.1f}")
+    return regressions
+
+
+def print_report(results, baseline=None):
+    header = f"{'scenario':<30} {'requests':>8} {'errors':>6} {'req/s':>9} {'p50 ms':>9} {'p99 ms':>9} {'queries':>8} {'p50 vs base':>11}"
+    print(header)
+    print('-' * len(header))
+    for name, result in results.items():
+        base = (baseline or {}).get('scenarios', {}).get(name)
+        delta = f"{(result['p50_ms'] / base['p50_ms'] - 1):+.0%}" if base and base.get('p50_ms') else '-'
+        queries = f"{result['queries']:.1f}" if result['queries'] is not None else '-'
+        print(f"{name:<30} {result['requests']:>8} {result['errors']:>6} {result['rps']:>9.1f} "
+              f"{result['p50_ms']:>9.2f} {result['p99_ms']:>9.2f} {queries:>8} {delta:>11}")
+
+
+def prepare_database(app, posts, seed, progress=print):
+    """Seeds the benchmark database once; an already populated file is reused."""
+    from schema import migrate
+    with app.app_context():
+        migrate()
+        if not Post.newest(limit=1):
+            started = time.perf_counter()
+            counts = synthetic_data.generate(posts=posts, seed=seed, progress=progress)
+            progress(f"Seeded {counts} in {time.perf_counter() - started:.1f}s")
+        return describe_dataset()
+
+
+# Hot-path queries whose cost grows with the size of the hot tables, for --archive-comparison
+HOT_QUERIES = (
+    ('newest posts', lambda data: Post.query.order_by(Post.created_at.desc()).limit(20).all()),
+    ('trending posts', lambda data: Post.query.order_by(Post.score.desc()).limit(20).all()),
+    ('community page', lambda data: Post.query.filter_by(community_id=data['community_id'])
+        .order_by(Post.created_at.desc()).limit(20).all()),
+    ('search', lambda data: Post.search('agent', limit=20, include_archive=False)),
+    ('post count', lambda data: db.session.query(func.count(Post.id)).scalar()),
+)
+
+
+def time_hot_queries(data, repeat):
+    """Median milliseconds of each HOT_QUERIES entry (inside an app context)."""
+    timings = {}
+    for name, query in HOT_QUERIES:
+        samples = []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            query(data)
+            samples.append((time.perf_counter() - started) * 1000)
+            db.session.rollback()
+        timings[name] = statistics.median(samples)
+    return timings
+
+
+def archive_comparison(db_path, repeat=20, progress=print):
+    """Times the hot queries on a copy of the dataset before and after archiving old threads."""
+    import shutil
+    from app import create_app
+    from archive import archive_old_threads, compact
+    from schema import migrate
+
+    work_dir = tempfile.mkdtemp(prefix='bench_archive_')
+    work_db = os.path.join(work_dir, 'hot.db')
+    try:
+        shutil.copyfile(db_path, work_db)
+        app = create_app({'SQLALCHEMY_DATABASE_URI': 'sqlite:///' + work_db, 'RATELIMIT_ENABLED': False},
+                         start_jobs=False)
+        with app.app_context():
+            migrate() # Creates the archive tables
+            data = {'community_id': db.session.query(Post.community_id).group_by(Post.community_id)
+                    .order_by(func.count(Post.id).desc()).limit(1).scalar()}
+            posts_before = db.session.query(func.count(Post.id)).scalar()
+            size_before = os.path.getsize(work_db)
+            before = time_hot_queries(data, repeat)
+
+            # Archive relative to the newest post, so the result does not depend on today's date
+            now = db.session.query(func.max(Post.created_at)).scalar()
+            started = time.perf_counter()
+            archived = archive_old_threads(now=now)
+            for engine in db.engines.values():
+                compact(engine, force=True)
+            progress(f"Archived {archived} of {posts_before} threads and compacted in "
+                     f"{time.perf_counter() - started:.1f}s")
+            after = time_hot_queries(data, repeat)
+            archive_size = os.path.getsize(os.path.join(work_dir, 'hot_archive.db'))
+            size_after = os.path.getsize(work_db)
+            for engine in db.engines.values():
+                engine.dispose()
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    header = f"{'query':<20} {'before ms':>10} {'after ms':>10} {'speedup':>8}"
+    print(header)
+    print('-' * len(header))
+    for name, _ in HOT_QUERIES:
+        print(f"{name:<20} {before[name]:>10.2f} {after[name]:>10.2f} {before[name] / max(after[name], 1e-6):>7.1f}x")
+    print(f"Hot database: {size_before / 2**20:.1f} MB -> {size_after / 2**20:.1f} MB "
+          f"(archive: {archive_size / 2**20:.1f} MB)")
+    return {'before_ms': before, 'after_ms': after, 'archived': archived,
+            'hot_bytes_before': size_before, 'hot_bytes_after': size_after, 'archive_bytes': archive_size}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run reproducible performance benchmarks against the forum.")
+    parser.add_argument("--scale", default='small',
+                        help=f"Dataset size: one of {', '.join(SCALES)} or a post count (default: small)")
+    parser.add_argument("--seed", type=int, default=1234, help="Random seed for data and requests (default: 1234)")
+    parser.add_argument("--db", default=None,
+                        help="SQLite file for the dataset; reused if it already has posts "
+                             "(default: bench_<posts>_<seed>.db in the temp directory)")
+    parser.add_argument("--base-url", default=None,
+                        help="Benchmark a running server (e.g. http://127.0.0.1:5000) instead of the in-process test "
+                             "client. --db must point at that server's database.")
+    parser.add_argument("-k", "--scenarios", default='*',
+                        help="Comma separated scenario names or glob patterns (default: all)")
+    parser.add_argument("-n", "--requests", type=int, default=200, help="Requests per scenario (default: 200)")
+    parser.add_argument("--warmup", type=int, default=5, help="Warm-up requests per scenario (default: 5)")
+    parser.add_argument("--max-seconds", type=float, default=10.0,
+                        help="Stop a scenario early after this many seconds (default: 10)")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE, help=f"Baseline file (default: {DEFAULT_BASELINE})")
+    parser.add_argument("--save-baseline", action='store_true', help="Store these results as the new baseline")
+    parser.add_argument("--compare", action='store_true',
+                        help="Compare against the baseline and exit with status 1 on regressions")
+    parser.add_argument("--tolerance", type=float, default=0.25,
+                        help="Allowed latency increase over the baseline, as a fraction (default: 0.25)")
+    parser.add_argument("--min-delta-ms", type=float, default=1.0,
+                        help="Ignore latency increases smaller than this many milliseconds (default: 1.0)")
+    parser.add_argument("--startup-runs", type=int, default=5,
+                        help="Fresh processes started for the startup.* measurements (default: 5)")
+    parser.add_argument("--list", action='store_true', help="List scenarios and exit")
+    parser.add_argument("--archive-comparison", action='store_true',
+                        help="Instead of the scenarios, time hot queries on a copy of the dataset before and after "
+                             "archiving old threads")
+    args = parser.parse_args()
+
+    if args.list:
+        for scenario in SCENARIOS:
+            print(scenario.name)
+        for metric in STARTUP_METRICS:
+            print(metric)
+        return 0
+
+    posts = SCALES[args.scale] if args.scale in SCALES else int(args.scale)
+    patterns = [pattern.strip() for pattern in args.scenarios.split(',') if pattern.strip()]
+    selected = [s for s in SCENARIOS if any(fnmatch.fnmatch(s.name, pattern) for pattern in patterns)]
+    startup = any(fnmatch.fnmatch(metric, pattern) for metric in STARTUP_METRICS for pattern in patterns)
+    if not selected and not startup:
+        print(f"Error: No scenario matches '{args.scenarios}'. Use --list to see them.")
+        return 2
+
+    db_path = os.path.abspath(args.db or os.path.join(tempfile.gettempdir(), f"bench_{posts}_{args.seed}.db"))
+    from app import create_app
+    from jobs import Worker
+    # Background jobs are drained between scenarios, outside the timings
+    app = create_app({'SQLALCHEMY_DATABASE_URI': 'sqlite:///' + db_path, 'RATELIMIT_ENABLED': False},
+                     start_jobs=False)
+    logging.getLogger().setLevel(logging.WARNING) # per-request INFO logging would dominate the timings
+    data = prepare_database(app, posts, args.seed)
+    print(f"Dataset {db_path}: {data['posts']} posts, {data['comments']} comments")
+    if args.archive_comparison:
+        archive_comparison(db_path)
+        return 0
+
+    if args.base_url:
+        client = HttpClient(args.base_url)
+    else:
+        client = InProcessClient(app)
+        if any('related' in s.name or s.name == 'html.post_detail' for s in selected):
+            # Servers build the related posts index in the background; build it up front here
+            # so that the timed lookups do not just return the empty pre-build answer
+            from related import get_index
+            with app.app_context():
+                get_index(app).refresh()
+
+    results = {}
+    if startup:
+        print(f"Measuring startup ({args.startup_runs} processes)...")
+        results.update((metric, result) for metric, result in measure_startup(db_path, args.startup_runs).items()
+                       if any(fnmatch.fnmatch(metric, pattern) for pattern in patterns))
+    try:
+        for scenario in selected:
+            print(f"Running {scenario.name}...")
+            results[scenario.name] = run_scenario(client, scenario, data, args.requests, args.warmup,
+                                                  args.max_seconds, args.seed)
+            Worker(app).drain()
+    finally:
+        client.close()
+
+    baseline = None
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    print_report(results, baseline)
+
+    if args.save_baseline:
+        with open(args.baseline, 'w') as f:
+            json.dump({
+                'meta': {'posts': posts, 'seed': args.seed, 'python': platform.python_version(),
+                         'mode': 'http' if args.base_url else 'in-process',
+                         'created_at': time.strftime('%Y-%m-%dT%H:%M:%S')},
+                'scenarios': results,
+            }, f, indent=2)
+        print(f"Baseline written to {args.baseline}")
+
+    if args.compare:
+        if not baseline:
+            print(f"Error: No baseline found at {args.baseline}. Run with --save-baseline first.")
+            return 2
+        regressions = compare(results, baseline, args.tolerance, args.min_delta_ms)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        if regressions:
+            return 1
+        print("No regressions against the baseline.")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -8,5 +8,16 @@ DATABASE_NAME = 'site.db'
 SQLALCHEMY_DATABASE_URI = 'sqlite:///' + os.path.join(BASE_DIR, DATABASE_NAME)
 SQLALCHEMY_TRACK_MODIFICATIONS = False
 
+# Archive of old threads (see archive.py). Defaults to site_archive.db next to site.db.
+ARCHIVE_DATABASE_URI = os.environ.get('ARCHIVE_DATABASE_URI')
+
+# Read replicas (optional): comma separated URIs in DATABASE_REPLICA_URIS, e.g.
+# "sqlite:////srv/forum/replica1.db,sqlite:////srv/forum/replica2.db"
+SQLALCHEMY_REPLICA_URIS = [uri for uri in os.environ.get('DATABASE_REPLICA_URIS', '').split(',') if uri]
+
+# Shards (optional): comma separated URIs in DATABASE_SHARD_URIS. Communities are spread over
+# site.db and these databases (see shards.py).
+SQLALCHEMY_SHARD_URIS = [uri for uri in os.environ.get('DATABASE_SHARD_URIS', '').split(',') if uri]
+
 # API Key generation (for agents)
 API_KEY_LENGTH = 32 # Length of the generated API key (e.g., 32 characters for a UUID-like string)
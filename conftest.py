@@ -0,0 +1,44 @@
+import logging
+
+import pytest
+
+from app import create_app
+from models import db
+from settings import SETTINGS
+
+
+@pytest.fixture
+def make_forum(tmp_path, monkeypatch):
+    """Builds an app on a fresh SQLite database in tmp_path and registers an agent.
+
+    ``settings`` overrides SETTINGS attributes for the test and ``config`` the
+    app config (e.g. replica or shard URIs). Job worker threads are off: tests
+    run jobs with jobs.Worker(app).drain(). Returns (app, client, headers),
+    the headers carrying the agent's API key.
+    """
+    apps = []
+
+    def make(settings=None, config=None, database='forum.db', agent='Tester'):
+        for name, value in {'JOB_WORKER_THREADS': 0, **(settings or {})}.items():
+            monkeypatch.setattr(SETTINGS, name, value)
+        app = create_app({'SQLALCHEMY_DATABASE_URI': 'sqlite:///' + str(tmp_path / database),
+                          'RATELIMIT_ENABLED': False, **(config or {})})
+        logging.getLogger().setLevel(logging.CRITICAL)
+        apps.append(app)
+        client = app.test_client()
+        headers = {'X-API-KEY': client.post('/api/agents/register', json={'name': agent}).get_json()['api_key']}
+        return app, client, headers
+
+    yield make
+    for app in apps:
+        if 'read_replicas' in app.extensions:
+            app.extensions['read_replicas'].dispose()
+        with app.app_context():
+            for engine in db.engines.values():
+                engine.dispose()
+
+
+@pytest.fixture
+def forum(make_forum):
+    """An app with default settings: (app, client, headers)."""
+    return make_forum()
@@ -0,0 +1,208 @@
+import heapq
+from datetime import datetime
+
+from sqlalchemy import and_, delete, func, insert, or_
+from models import db, insert_if_missing, Community, CommunityShard, CommunitySubscription, Post, TimelineEntry
+from jobs import enqueue, job_handler
+from settings import SETTINGS
+from shards import each_shard, on_shard
+
+
+def fans_out(community):
+    """Whether new posts of a community are pushed into subscriber timelines (else merged on read)."""
+    return 0 < community.subscriber_count <= SETTINGS.FANOUT_MAX_SUBSCRIBERS
+
+
+def subscribe(agent_id, community):
+    """Subscribes an agent to a community; returns False if it already was. The caller commits."""
+    if not insert_if_missing(CommunitySubscription, agent_id=agent_id, community_id=community.id,
+                             created_at=datetime.utcnow()):
+        return False # Also when a concurrent request subscribed first
+    community.subscriber_count = Community.subscriber_count + 1
+    db.session.flush()
+    db.session.refresh(community, ['subscriber_count'])
+    if fans_out(community):
+        _backfill(agent_id, [community.id]) # So the feed is complete right away, not only from the next post on
+        trim_timelines([agent_id])
+    return True
+
+
+def unsubscribe(agent_id, community):
+    """Removes a subscription and its timeline entries; returns False if there was none. The caller commits.
+
+    When the community drops to FANOUT_MAX_SUBSCRIBERS subscribers, the
+    remaining subscribers' timelines are filled with its older posts by a
+    'feed.backfill' job: until now they were merged in on read.
+    """
+    removed = db.session.execute(delete(CommunitySubscription).where(
+        CommunitySubscription.agent_id == agent_id, CommunitySubscription.community_id == community.id)).rowcount
+    if not removed:
+        return False # Also when a concurrent request unsubscribed first
+    community.subscriber_count = Community.subscriber_count - 1
+    db.session.execute(delete(TimelineEntry).where(TimelineEntry.agent_id == agent_id,
+                                                   TimelineEntry.community_id == community.id))
+    db.session.flush()
+    db.session.refresh(community, ['subscriber_count'])
+    if fans_out(community) and community.subscriber_count == SETTINGS.FANOUT_MAX_SUBSCRIBERS:
+        enqueue('feed.backfill', {'community_id': community.id}, idempotency_key=f'feed.backfill:{community.id}')
+    return True
+
+
+def _backfill(agent_id, community_ids):
+    """Copies the newest posts of the given communities into an agent's timeline."""
+    newest = _newest_posts(community_ids)
+    if newest:
+        db.session.execute(insert(TimelineEntry), [
+            {'agent_id': agent_id, 'post_id': post_id, 'community_id': community_id, 'created_at': created_at}
+            for post_id, (created_at, community_id) in newest])
+
+
+def _newest_posts(community_ids):
+    """The newest TIMELINE_MAX_ENTRIES posts of the given communities: [(post_id, (created_at, community_id))]."""
+    recent = {} # Read from each shard and written to the primary, so no INSERT ... SELECT
+    for _ in each_shard(): # A community being moved has its posts on two shards for a while
+        recent.update((post_id, (created_at, community_id)) for post_id, community_id, created_at in
+                      db.session.query(Post.id, Post.community_id, Post.created_at)
+                      .filter(Post.community_id.in_(community_ids))
+                      .order_by(Post.created_at.desc(), Post.id.desc()).limit(SETTINGS.TIMELINE_MAX_ENTRIES))
+    return heapq.nlargest(SETTINGS.TIMELINE_MAX_ENTRIES, recent.items(), key=lambda item: (item[1][0], item[0]))
+
+
+def trim_timelines(agent_ids):
+    """Deletes all but the newest TIMELINE_MAX_ENTRIES timeline entries of the given agents."""
+    agent_ids = list(agent_ids)
+    for start in range(0, len(agent_ids), 500):
+        over_limit = db.session.query(TimelineEntry.agent_id) \
+            .filter(TimelineEntry.agent_id.in_(agent_ids[start:start + 500])) \
+            .group_by(TimelineEntry.agent_id).having(func.count() > SETTINGS.TIMELINE_MAX_ENTRIES)
+        for (agent_id,) in over_limit.all():
+            oldest_kept = db.session.query(TimelineEntry.created_at, TimelineEntry.post_id) \
+                .filter(TimelineEntry.agent_id == agent_id) \
+                .order_by(TimelineEntry.created_at.desc(), TimelineEntry.post_id.desc()) \
+                .offset(SETTINGS.TIMELINE_MAX_ENTRIES - 1).limit(1).one()
+            db.session.execute(delete(TimelineEntry).where(
+                TimelineEntry.agent_id == agent_id, _before(TimelineEntry.created_at, TimelineEntry.post_id, oldest_kept)))
+
+
+def rebuild_timelines():
+    """Recomputes every timeline from the subscriptions (after bulk imports that bypass subscribe)."""
+    TimelineEntry.query.delete()
+    fan_out_communities = {}
+    subscriptions = db.session.query(CommunitySubscription.agent_id, Community) \
+        .join(Community, Community.id == CommunitySubscription.community_id)
+    for agent_id, community in subscriptions:
+        if fans_out(community):
+            fan_out_communities.setdefault(agent_id, []).append(community.id)
+    for agent_id, community_ids in fan_out_communities.items():
+        _backfill(agent_id, community_ids) # Already limited to TIMELINE_MAX_ENTRIES
+    db.session.commit()
+
+
+def enqueue_fan_out(post, community):
+    """Schedules pushing a new post into its subscribers' timelines, if the community fans out."""
+    if community is not None and fans_out(community):
+        enqueue('feed.fan_out', {'post_id': post.id}, idempotency_key=f'feed.fan_out:{post.id}')
+
+
+@job_handler('feed.fan_out')
+def fan_out_posts(payloads):
+    post_ids = {payload['post_id'] for payload in payloads}
+    # At-least-once delivery: replace what an earlier attempt may have written instead of duplicating it
+    db.session.execute(delete(TimelineEntry).where(TimelineEntry.post_id.in_(post_ids)))
+    recipients = set()
+    posts = {}
+    for _ in each_shard():
+        posts.update((post_id, (community_id, created_at)) for post_id, community_id, created_at in
+                     db.session.query(Post.id, Post.community_id, Post.created_at)
+                     .filter(Post.id.in_(post_ids), Post.community_id.isnot(None)))
+    for post_id, (community_id, created_at) in posts.items():
+        subscribers = [agent_id for (agent_id,) in db.session.query(CommunitySubscription.agent_id)
+                       .filter(CommunitySubscription.community_id == community_id)]
+        if subscribers:
+            db.session.execute(insert(TimelineEntry), [
+                {'agent_id': agent_id, 'post_id': post_id, 'community_id': community_id, 'created_at': created_at}
+                for agent_id in subscribers])
+            recipients.update(subscribers)
+    trim_timelines(recipients)
+    db.session.commit()
+
+
+@job_handler('feed.backfill')
+def backfill_communities(payloads):
+    community_ids = {payload['community_id'] for payload in payloads}
+    recipients = set()
+    for community in Community.query.filter(Community.id.in_(community_ids)):
+        if not fans_out(community):
+            continue # Grew past the threshold again before the job ran
+        subscribers = [agent_id for (agent_id,) in db.session.query(CommunitySubscription.agent_id)
+                       .filter(CommunitySubscription.community_id == community.id)]
+        # Replaces posts fanned out since the crossing, and whatever an earlier attempt wrote
+        db.session.execute(delete(TimelineEntry).where(TimelineEntry.community_id == community.id))
+        newest = _newest_posts([community.id])
+        rows = [{'agent_id': agent_id, 'post_id': post_id, 'community_id': community.id, 'created_at': created_at}
+                for agent_id in subscribers for post_id, (created_at, _) in newest]
+        for start in range(0, len(rows), 5000):
+            db.session.execute(insert(TimelineEntry), rows[start:start + 5000])
+        recipients.update(subscribers)
+    trim_timelines(recipients)
+    db.session.commit()
+
+
+def _before(created_at_column, id_column, cursor):
+    """Rows strictly after ``cursor`` in (created_at, id) descending order."""
+    created_at, row_id = cursor
+    return or_(created_at_column < created_at, and_(created_at_column == created_at, id_column < row_id))
+
+
+def encode_cursor(created_at, post_id):
+    return f"{created_at.isoformat()}_{post_id}"
+
+
+def decode_cursor(cursor):
+    """Parses a cursor from encode_cursor; raises ValueError if it is malformed."""
+    created_at, post_id = cursor.rsplit('_', 1)
+    return datetime.fromisoformat(created_at), int(post_id)
+
+
+def feed_page(agent_id, limit, cursor=None):
+    """One page of an agent's feed, newest first: (posts, next_cursor or None).
+
+    Posts of fan-out communities come from the agent's timeline; posts of
+    communities above FANOUT_MAX_SUBSCRIBERS are read from each community's
+    (community_id, created_at) index. Both streams are already sorted, so a
+    k-way merge yields the page. Paging is by (created_at, id) cursor, which
+    stays stable while new posts arrive.
+    """
+    subscriptions = db.session.query(Community) \
+        .join(CommunitySubscription, CommunitySubscription.community_id == Community.id) \
+        .filter(CommunitySubscription.agent_id == agent_id).all()
+
+    timeline = db.session.query(TimelineEntry.created_at, TimelineEntry.post_id) \
+        .filter(TimelineEntry.agent_id == agent_id)
+    if cursor:
+        timeline = timeline.filter(_before(TimelineEntry.created_at, TimelineEntry.post_id, cursor))
+    streams = [[tuple(row) for row in timeline.order_by(TimelineEntry.created_at.desc(), TimelineEntry.post_id.desc())
+                .limit(limit + 1)]]
+
+    for community in subscriptions:
+        if fans_out(community):
+            continue
+        with on_shard(CommunityShard.route(community.id).shard):
+            posts = db.session.query(Post.created_at, Post.id).filter(Post.community_id == community.id)
+            if cursor:
+                posts = posts.filter(_before(Post.created_at, Post.id, cursor))
+            streams.append([tuple(row) for row in posts.order_by(Post.created_at.desc(), Post.id.desc()).limit(limit + 1)])
+
+    page, seen = [], set()
+    for created_at, post_id in heapq.merge(*streams, reverse=True):
+        if post_id in seen: # A community crossing the fan-out threshold can have a post in both streams
+            continue
+        seen.add(post_id)
+        page.append((created_at, post_id))
+        if len(page) > limit:
+            break
+    next_cursor = encode_cursor(*page[limit - 1]) if len(page) > limit else None
+    page = page[:limit]
+
+    posts = Post.get_many(post_id for _, post_id in page)
+    return [posts[post_id] for _, post_id in page if post_id in posts], next_cursor
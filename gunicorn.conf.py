@@ -0,0 +1,18 @@
+# Gunicorn configuration: `python -m gunicorn -c gunicorn.conf.py`
+#
+# The app is built once in the master process and forked into the workers,
+# so workers start without re-importing and re-initializing everything.
+# Run `python manage.py migrate` before starting; the app does not change
+# the schema on boot outside development.
+import os
+
+wsgi_app = "app:create_app(start_jobs=False)"
+preload_app = True
+workers = int(os.environ.get("WEB_CONCURRENCY", 4))
+bind = os.environ.get("BIND", "127.0.0.1:8000")
+
+
+def post_worker_init(worker):
+    # Connections and threads of the master must not be shared with the forked worker
+    from app import init_worker_process
+    init_worker_process(worker.wsgi)
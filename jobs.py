@@ -0,0 +1,244 @@
+import json
+import logging
+import threading
+import uuid
+from datetime import datetime, timedelta
+
+from sqlalchemy import case, func, text, update
+
+from models import db, Job, Post, Comment
+from settings import SETTINGS
+from shards import each_shard
+
+log = logging.getLogger("rich")
+
+# kind -> function receiving the list of payloads of one claimed batch
+HANDLERS = {}
+
+
+def job_handler(kind):
+    """Registers a batch handler for a job kind.
+
+    Delivery is at-least-once: a handler may see a payload again after a crash
+    or a failed batch, so it must be idempotent (recompute, don't increment).
+    """
+    def decorator(func):
+        HANDLERS[kind] = func
+        return func
+    return decorator
+
+
+def enqueue(kind, payload=None, idempotency_key=None, delay=0, max_attempts=None):
+    """Adds a job to the current session; it is committed with the caller's own write.
+
+    If a pending job with the same ``idempotency_key`` exists (committed or in
+    this session), no new job is added: bursts of identical work coalesce.
+    The caller's changes are flushed first and the pending job is updated,
+    not just looked up, so it stays locked until the caller commits: a worker
+    claiming it meanwhile waits and then sees the caller's write. Returns the
+    new job, or None if the work was merged into a pending one.
+    """
+    if idempotency_key:
+        db.session.flush()
+        run_at = datetime.utcnow() + timedelta(seconds=delay)
+        coalesced = db.session.execute(
+            update(Job).where(Job.idempotency_key == idempotency_key, Job.status == 'pending')
+            .values(run_at=case((Job.run_at > run_at, run_at), else_=Job.run_at)), # The earlier of both
+            execution_options={'synchronize_session': False}).rowcount
+        if coalesced:
+            return None
+
+    job = _new_job(kind, payload, idempotency_key, delay, max_attempts)
+    db.session.add(job)
+    return job
+
+
+def _new_job(kind, payload, idempotency_key, delay=0, max_attempts=None):
+    return Job(
+        kind=kind,
+        payload=json.dumps(payload or {}),
+        idempotency_key=idempotency_key,
+        run_at=datetime.utcnow() + timedelta(seconds=delay),
+        max_attempts=max_attempts or SETTINGS.JOB_MAX_ATTEMPTS
+    )
+
+
+def enqueue_many(kind, payloads):
+    """Adds one job per ``{idempotency_key: payload}`` item, coalescing like enqueue.
+
+    One UPDATE locks the pending jobs of all keys, instead of one per job.
+    """
+    if not payloads:
+        return
+    db.session.flush()
+    now = datetime.utcnow()
+    coalesced = {key for (key,) in db.session.execute(
+        update(Job).where(Job.idempotency_key.in_(payloads), Job.status == 'pending')
+        .values(run_at=case((Job.run_at > now, now), else_=Job.run_at)).returning(Job.idempotency_key),
+        execution_options={'synchronize_session': False})}
+    for key in sorted(set(payloads) - coalesced):
+        db.session.add(_new_job(kind, payloads[key], key))
+
+
+def queue_stats():
+    """Queue depth and lag, for monitoring."""
+    now = datetime.utcnow()
+    counts = dict(db.session.query(Job.status, func.count(Job.id)).group_by(Job.status).all())
+    by_kind = dict(db.session.query(Job.kind, func.count(Job.id)).filter(Job.status == 'pending').group_by(Job.kind).all())
+    oldest_due = db.session.query(func.min(Job.run_at)).filter(Job.status == 'pending', Job.run_at <= now).scalar()
+    return {
+        'pending': counts.get('pending', 0),
+        'running': counts.get('running', 0),
+        'failed': counts.get('failed', 0),
+        'pending_by_kind': by_kind,
+        # How long the oldest due job has been waiting for a worker
+        'lag_seconds': (now - oldest_due).total_seconds() if oldest_due else 0.0
+    }
+
+
+def purge_failed_jobs(now=None):
+    """Deletes failed jobs last attempted more than JOB_FAILED_RETENTION_DAYS ago; returns how many."""
+    cutoff = (now or datetime.utcnow()) - timedelta(days=SETTINGS.JOB_FAILED_RETENTION_DAYS)
+    purged = Job.query.filter(Job.status == 'failed', Job.run_at < cutoff).delete(synchronize_session=False)
+    if purged:
+        log.info(f"Purged {purged} failed job(s).")
+    return purged
+
+
+# Jobs a worker may claim: due pending jobs, and running jobs of a worker that crashed
+CLAIMABLE = "(status = 'pending' AND run_at <= :now) OR (status = 'running' AND locked_at < :stale)"
+
+
+class Worker:
+    """Claims batches of due jobs and runs their handlers (one app, one thread)."""
+
+    def __init__(self, app, batch_size=None):
+        self.app = app
+        self.batch_size = batch_size or SETTINGS.JOB_BATCH_SIZE
+
+    def claim(self):
+        """Atomically marks up to batch_size due jobs as running and returns them.
+
+        Jobs left running longer than JOB_VISIBILITY_TIMEOUT (crashed worker)
+        are claimed again, which is what makes delivery at-least-once, unless
+        they used up their attempts: a job that keeps crashing its worker is
+        marked failed instead. An idle queue costs one SELECT, not a write.
+        """
+        token = uuid.uuid4().hex
+        now = datetime.utcnow()
+        params = {'now': now, 'stale': now - timedelta(seconds=SETTINGS.JOB_VISIBILITY_TIMEOUT)}
+        if db.session.execute(text(f"SELECT 1 FROM job WHERE {CLAIMABLE} LIMIT 1"), params).first() is None:
+            db.session.rollback() # Ends the read transaction
+            return []
+        db.session.execute(text(
+            "UPDATE job SET status = 'failed', locked_by = NULL, locked_at = NULL, "
+            "last_error = 'Worker did not finish the job within JOB_VISIBILITY_TIMEOUT' "
+            "WHERE status = 'running' AND locked_at < :stale AND attempts >= max_attempts"
+        ), params)
+        db.session.execute(text(
+            "UPDATE job SET status = 'running', locked_by = :token, locked_at = :now, attempts = attempts + 1 "
+            f"WHERE id IN (SELECT id FROM job WHERE {CLAIMABLE} ORDER BY id LIMIT :limit)"
+        ), {**params, 'token': token, 'limit': self.batch_size})
+        db.session.commit()
+        return Job.query.filter_by(locked_by=token, status='running').order_by(Job.id).all()
+
+    def run_batch(self):
+        """Runs one batch; returns the number of jobs claimed (0 when the queue is drained)."""
+        jobs = self.claim()
+        by_kind = {}
+        for job in jobs:
+            by_kind.setdefault(job.kind, []).append(job)
+
+        for kind, batch in by_kind.items():
+            handler = HANDLERS.get(kind)
+            try:
+                if handler is None:
+                    raise LookupError(f"No handler registered for job kind '{kind}'")
+                handler([json.loads(job.payload) for job in batch])
+                for job in batch:
+                    db.session.delete(job)
+                db.session.commit()
+            except Exception as e:
+                db.session.rollback()
+                log.exception(f"Job batch of {len(batch)} '{kind}' job(s) failed")
+                self._retry_later(batch, e)
+        return len(jobs)
+
+    def _retry_later(self, batch, error):
+        for job in batch:
+            job.locked_by = None
+            job.locked_at = None
+            job.last_error = repr(error)
+            if job.attempts >= job.max_attempts:
+                job.status = 'failed'
+            else:
+                job.status = 'pending'
+                job.run_at = datetime.utcnow() + timedelta(seconds=SETTINGS.JOB_RETRY_BASE_DELAY * 2 ** (job.attempts - 1))
+        db.session.commit()
+
+    def drain(self):
+        """Processes jobs until none are due. Returns the number of jobs processed."""
+        processed = 0
+        with self.app.app_context():
+            while True:
+                claimed = self.run_batch()
+                if not claimed:
+                    return processed
+                processed += claimed
+
+    def run_forever(self, stop_event=None):
+        stop_event = stop_event or threading.Event()
+        while not stop_event.is_set():
+            try:
+                if not self.drain():
+                    stop_event.wait(SETTINGS.JOB_POLL_INTERVAL)
+            except Exception:
+                log.exception("Job worker error; retrying after the poll interval")
+                stop_event.wait(SETTINGS.JOB_POLL_INTERVAL)
+
+
+class WorkerPool:
+    """Background threads running Workers inside the web process."""
+
+    def __init__(self, app, threads=None, batch_size=None):
+        self.app = app
+        self.threads = threads or SETTINGS.JOB_WORKER_THREADS
+        self.batch_size = batch_size
+        self._stop = threading.Event()
+        self._threads = []
+
+    def start(self):
+        for i in range(self.threads):
+            thread = threading.Thread(target=Worker(self.app, self.batch_size).run_forever, args=(self._stop,),
+                                      name=f"job-worker-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        return self
+
+    def stop(self, timeout=5):
+        self._stop.set()
+        for thread in self._threads:
+            thread.join(timeout)
+
+
+def start_worker_pool(app):
+    """Starts the in-process pool unless JOB_WORKER_THREADS is 0 (the default outside development;
+    jobs are then processed by `manage.py worker`)."""
+    if SETTINGS.JOB_WORKER_THREADS > 0:
+        app.extensions['job_workers'] = WorkerPool(app).start()
+
+
+def enqueue_score_update(*post_ids):
+    """Schedules recomputing the scores of posts, as one coalesced 'post.update_score' job per post."""
+    enqueue_many('post.update_score', {f'post.update_score:{post_id}': {'post_id': post_id} for post_id in post_ids})
+
+
+@job_handler('post.update_score')
+def update_post_scores(payloads):
+    post_ids = {payload['post_id'] for payload in payloads}
+    for _ in each_shard():
+        comment_counts = dict(db.session.query(Comment.post_id, func.count(Comment.id))
+                              .filter(Comment.post_id.in_(post_ids)).group_by(Comment.post_id).all())
+        for post in Post.query.filter(Post.id.in_(post_ids)): # Posts deleted in the meantime are skipped
+            post.update_score(comment_count=comment_counts.get(post.id, 0))
+    db.session.commit()
@@ -0,0 +1,176 @@
+import argparse
+import time
+
+from sqlalchemy.engine import make_url
+
+
+def _sqlite_path(uri):
+    url = make_url(uri)
+    if url.get_backend_name() != 'sqlite' or not url.database:
+        return None
+    return url.database[len('file:'):] if url.database.startswith('file:') else url.database
+
+
+def migrate(app, args):
+    """Creates missing tables, columns and indexes; run once per deploy."""
+    from schema import migrate as migrate_schema
+
+    with app.app_context():
+        changes = migrate_schema() # Each change is logged
+    print(f"Schema up to date ({len(changes)} change(s) applied)")
+    return 0
+
+
+def replicate(app, args):
+    """Copies the SQLite primary onto file replicas, once or every --interval seconds."""
+    from replicas import copy_sqlite_database
+
+    primary = _sqlite_path(app.config['SQLALCHEMY_DATABASE_URI'])
+    targets = args.targets or [path for path in map(_sqlite_path, app.config['SQLALCHEMY_REPLICA_URIS']) if path]
+    if not primary:
+        print("Error: File replication requires a SQLite primary database.")
+        return 1
+    if not targets:
+        print("Error: No replica files given and no SQLite DATABASE_REPLICA_URIS configured.")
+        return 1
+
+    while True:
+        started = time.perf_counter()
+        for target in targets:
+            copy_sqlite_database(primary, target)
+        print(f"Copied {primary} to {len(targets)} replica(s) in {(time.perf_counter() - started) * 1000:.0f} ms")
+        if not args.interval:
+            return 0
+        time.sleep(args.interval)
+
+
+def worker(app, args):
+    """Processes background jobs until interrupted (or until drained with --once)."""
+    import json
+    import threading
+    from archive import schedule_maintenance
+    from jobs import Worker, WorkerPool, queue_stats
+    from models import db
+    from settings import SETTINGS
+
+    if args.stats:
+        with app.app_context():
+            print(json.dumps(queue_stats(), indent=2))
+        return 0
+    if args.once:
+        processed = Worker(app, args.batch_size).drain()
+        print(f"Processed {processed} job(s)")
+        return 0
+
+    if SETTINGS.MAINTENANCE_INTERVAL_HOURS:
+        with app.app_context():
+            schedule_maintenance() # Web processes without job threads leave this to the workers
+            db.session.commit()
+    pool = WorkerPool(app, threads=args.threads, batch_size=args.batch_size).start()
+    print(f"Started {pool.threads} job worker thread(s). Press Ctrl+C to stop.")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        pool.stop()
+    return 0
+
+
+def archive(app, args):
+    """Moves old, inactive threads to the archive database and compacts the database files."""
+    from archive import archivable_post_ids, archive_old_threads, compact, schedule_maintenance
+    from models import db
+
+    with app.app_context():
+        if args.schedule:
+            schedule_maintenance()
+            db.session.commit()
+            print("Scheduled the maintenance job (run `manage.py worker` to process it).")
+            return 0
+        if args.dry_run:
+            print(f"{len(archivable_post_ids(limit=args.max_posts))} thread(s) would be archived")
+            return 0
+
+        started = time.perf_counter()
+        archived = archive_old_threads(max_posts=args.max_posts)
+        print(f"Archived {archived} thread(s) in {time.perf_counter() - started:.1f} s")
+        for bind_key, engine in db.engines.items(): # The primary, the archive and any shards
+            if compact(engine, force=args.vacuum):
+                print(f"Compacted the {bind_key or 'primary'} database")
+    return 0
+
+
+def rebalance(app, args):
+    """Moves a community to another shard, or lists how communities and posts are spread."""
+    from models import Community
+    from rebalance import move_community, shard_sizes
+
+    with app.app_context():
+        if not args.community:
+            for shard, (communities, posts) in shard_sizes().items():
+                print(f"Shard {shard}: {communities} communities, {posts} posts")
+            return 0
+        if args.to is None:
+            print("Error: Give the target shard with --to.")
+            return 1
+        community = Community.query.filter_by(name=args.community).first()
+        if community is None:
+            print(f"Error: Community '{args.community}' not found.")
+            return 1
+        started = time.perf_counter()
+        try:
+            copied = move_community(community, args.to)
+        except ValueError as e:
+            print(f"Error: {e}")
+            return 1
+        print(f"Moved '{community.name}' to shard {args.to} ({copied} rows) in {time.perf_counter() - started:.1f} s")
+    return 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Maintenance commands for the forum.")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    command = commands.add_parser('migrate', help="Bring the database schema up to date with the models")
+    command.set_defaults(handler=migrate)
+
+    command = commands.add_parser('replicate', help="Copy the SQLite primary to file replicas (local read replicas)")
+    command.add_argument('targets', nargs='*',
+                         help="Replica files to write (default: the SQLite files in DATABASE_REPLICA_URIS)")
+    command.add_argument('-i', '--interval', type=float, default=0,
+                         help="Keep copying every INTERVAL seconds instead of copying once")
+    command.set_defaults(handler=replicate)
+
+    command = commands.add_parser('worker', help="Process background jobs (score updates and other derived data)")
+    command.add_argument('-t', '--threads', type=int, default=2, help="Worker threads (default: 2)")
+    command.add_argument('-b', '--batch-size', type=int, default=None,
+                         help="Jobs claimed per batch (default: JOB_BATCH_SIZE)")
+    command.add_argument('--once', action='store_true', help="Process all due jobs, then exit")
+    command.add_argument('--stats', action='store_true', help="Print queue depth and lag, then exit")
+    command.set_defaults(handler=worker)
+
+    command = commands.add_parser('archive', help="Move old, inactive threads to the archive database")
+    command.add_argument('--dry-run', action='store_true', help="Only count the threads that would be archived")
+    command.add_argument('--max-posts', type=int, default=None, help="Archive at most this many threads")
+    command.add_argument('--vacuum', action='store_true',
+                         help="Always VACUUM afterwards (default: only past VACUUM_MIN_FREE_RATIO)")
+    command.add_argument('--schedule', action='store_true',
+                         help="Enqueue the recurring maintenance job instead of archiving now")
+    command.set_defaults(handler=archive)
+
+    command = commands.add_parser('rebalance', help="Move a community to another shard (or list the shards)")
+    command.add_argument('community', nargs='?', help="Name of the community to move (default: list the shards)")
+    command.add_argument('--to', type=int, default=None, help="Shard to move it to (0 is the primary database)")
+    command.set_defaults(handler=rebalance)
+
+    args = parser.parse_args()
+
+    from settings import SETTINGS
+    if args.handler is migrate:
+        SETTINGS.AUTO_MIGRATE = False # Report the changes here instead of applying them while booting
+    from app import create_app
+    app = create_app(start_jobs=False) # Commands start their own workers, if any, instead of the web app's pool
+    return args.handler(app, args)
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -1,9 +1,37 @@
 from datetime import datetime
+import math
+import random
+import threading
 import uuid
+from flask import current_app
 from flask_sqlalchemy import SQLAlchemy
-from sqlalchemy import desc, func
+from sqlalchemy import desc, event, exists, func, select, update
+from sqlalchemy import inspect as sa_inspect
+from sqlalchemy.orm import selectinload
 
-db = SQLAlchemy()
+from replicas import RoutingSession
+from settings import SETTINGS
+from shards import PRIMARY, Route, current_shard, each_shard, is_sharded, merge_shards, shard_count
+
+db = SQLAlchemy(session_options={'class_': RoutingSession})
+
+
+# Offsets are clamped to this: larger ones overflow the database's 64-bit integers once a LIMIT is added
+MAX_OFFSET = 2 ** 62
+
+def insert_if_missing(model, **values):
+    """Inserts a row unless one with the same primary key exists; returns True if it was inserted.
+
+    Unlike checking with session.get() first, concurrent requests adding the
+    same row don't fail with an IntegrityError: the loser's insert is skipped.
+    """
+    table = model.__table__
+    if db.session.get_bind(mapper=sa_inspect(model)).dialect.name == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert as dialect_insert
+    else:
+        from sqlalchemy.dialects.sqlite import insert as dialect_insert
+    statement = dialect_insert(table).values(**values).on_conflict_do_nothing(index_elements=table.primary_key.columns)
+    return db.session.execute(statement).rowcount == 1
 
 class Community(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -11,11 +39,260 @@ class Community(db.Model):
     description = db.Column(db.String(200), nullable=True)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
 
+    # Aggregates maintained on write (see record_post/record_comment)
+    post_count = db.Column(db.Integer, default=0, nullable=False, index=True)
+    comment_count = db.Column(db.Integer, default=0, nullable=False, index=True)
+    member_count = db.Column(db.Integer, default=0, nullable=False, index=True) # Distinct agents that posted or commented
+    last_activity_at = db.Column(db.DateTime, nullable=True, index=True)
+    subscriber_count = db.Column(db.Integer, default=0, nullable=False) # Decides fan-out vs. merge-on-read (see feeds.py)
+
     posts = db.relationship('Post', backref='community', lazy=True)
 
+    # Directory sort orders; the id tie-breaker keeps offset pagination stable
+    DIRECTORY_SORTS = {
+        'name': lambda: (Community.name.asc(),),
+        'newest': lambda: (desc(Community.created_at), desc(Community.id)),
+        'posts': lambda: (desc(Community.post_count), desc(Community.id)),
+        'comments': lambda: (desc(Community.comment_count), desc(Community.id)),
+        'members': lambda: (desc(Community.member_count), desc(Community.id)),
+        'activity': lambda: (desc(Community.last_activity_at), desc(Community.id)),
+    }
+
     def __repr__(self):
         return f'<Community {self.name}>'
 
+    def _touch(self, agent_id, when):
+        if self.last_activity_at is None or when > self.last_activity_at:
+            self.last_activity_at = when
+        if insert_if_missing(CommunityMember, community_id=self.id, agent_id=agent_id, joined_at=when):
+            self.member_count = Community.member_count + 1
+
+    def record_post(self, agent_id, when=None):
+        """Updates the counters for a new post. Call before committing the post."""
+        self.post_count = Community.post_count + 1 # Incremented in SQL so concurrent writers don't lose updates
+        self._touch(agent_id, when or datetime.utcnow())
+
+    def record_comment(self, agent_id, when=None):
+        """Updates the counters for a new comment. Call before committing the comment."""
+        self.comment_count = Community.comment_count + 1
+        self._touch(agent_id, when or datetime.utcnow())
+
+    def to_dict(self):
+        return {
+            'name': self.name,
+            'description': self.description,
+            'created_at': self.created_at.isoformat() if self.created_at else None,
+            'post_count': self.post_count,
+            'comment_count': self.comment_count,
+            'member_count': self.member_count,
+            'last_activity_at': self.last_activity_at.isoformat() if self.last_activity_at else None,
+            'subscriber_count': self.subscriber_count
+        }
+
+    @classmethod
+    def directory(cls, sort='name', limit=50, offset=0):
+        """Returns a page of communities ordered by one of DIRECTORY_SORTS."""
+        return cls.query.order_by(*cls.DIRECTORY_SORTS[sort]()).offset(offset).limit(limit).all()
+
+    @classmethod
+    def refresh_stats(cls):
+        """Recomputes every community's aggregates from the post and comment tables and the archive.
+
+        Used to backfill databases created before the counters existed and after
+        bulk imports that bypass record_post/record_comment. Like the counters
+        maintained on write, the totals include archived threads.
+        """
+        stats = {community_id: {'id': community_id, 'post_count': 0, 'comment_count': 0, 'member_count': 0,
+                                'last_activity_at': None, 'subscriber_count': 0}
+                 for (community_id,) in db.session.query(cls.id)}
+
+        def merge_activity(community_id, when):
+            current = stats[community_id]['last_activity_at']
+            if when is not None and (current is None or when > current):
+                stats[community_id]['last_activity_at'] = when
+
+        members = set()
+
+        def count(post_model, comment_model):
+            posts = db.session.query(post_model.community_id, func.count(post_model.id), func.max(post_model.created_at)) \
+                .filter(post_model.community_id.isnot(None)).group_by(post_model.community_id)
+            for community_id, count, last in posts:
+                if community_id in stats: # Archived posts may outlive their community
+                    stats[community_id]['post_count'] += count
+                    merge_activity(community_id, last)
+
+            comments = db.session.query(post_model.community_id, func.count(comment_model.id),
+                                        func.max(comment_model.created_at)) \
+                .join(post_model, comment_model.post_id == post_model.id) \
+                .filter(post_model.community_id.isnot(None)).group_by(post_model.community_id)
+            for community_id, count, last in comments:
+                if community_id in stats:
+                    stats[community_id]['comment_count'] += count
+                    merge_activity(community_id, last)
+
+            posters = db.session.query(post_model.community_id, post_model.agent_id) \
+                .filter(post_model.community_id.isnot(None))
+            commenters = db.session.query(post_model.community_id, comment_model.agent_id) \
+                .join(post_model, comment_model.post_id == post_model.id).filter(post_model.community_id.isnot(None))
+            members.update((community_id, agent_id) for community_id, agent_id in
+                           set(posters.distinct()) | set(commenters.distinct()) if community_id in stats)
+
+        for _ in each_shard(): # A community moved between shards may briefly have rows on two of them
+            count(Post, Comment)
+        count(ArchivedPost, ArchivedComment)
+        for community_id, _ in members:
+            stats[community_id]['member_count'] += 1
+
+        subscribers = db.session.query(CommunitySubscription.community_id, func.count()) \
+            .group_by(CommunitySubscription.community_id)
+        for community_id, count in subscribers:
+            stats[community_id]['subscriber_count'] = count
+
+        CommunityMember.query.delete()
+        if members:
+            db.session.execute(db.insert(CommunityMember), [{'community_id': c, 'agent_id': a} for c, a in members])
+        if stats:
+            db.session.execute(update(cls), list(stats.values()))
+        db.session.commit()
+
+class CommunityMember(db.Model):
+    """An agent that has posted or commented in a community; backs Community.member_count."""
+    community_id = db.Column(db.Integer, db.ForeignKey('community.id'), primary_key=True)
+    agent_id = db.Column(db.Integer, db.ForeignKey('agent.id'), primary_key=True)
+    joined_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+class CommunitySubscription(db.Model):
+    """An agent following a community; its posts appear in the agent's feed (see feeds.py)."""
+    agent_id = db.Column(db.Integer, db.ForeignKey('agent.id'), primary_key=True)
+    community_id = db.Column(db.Integer, db.ForeignKey('community.id'), primary_key=True, index=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+class CommunityShard(db.Model):
+    """Routing table: the shard holding a community's posts and comments (see shards.py).
+
+    Communities without a row, and posts without a community, live on the
+    primary (shard 0). ``moving`` is set while rebalance.move_community copies
+    the community to another shard; writes to it are refused meanwhile.
+    """
+    community_id = db.Column(db.Integer, db.ForeignKey('community.id'), primary_key=True)
+    shard = db.Column(db.Integer, nullable=False, default=0, index=True)
+    moving = db.Column(db.Boolean, nullable=False, default=False)
+
+    @classmethod
+    def route(cls, community_id):
+        if community_id is None or not is_sharded():
+            return PRIMARY
+        row = db.session.get(cls, community_id)
+        return Route(row.shard, row.moving) if row else PRIMARY
+
+    @classmethod
+    def assign(cls, community_id):
+        """Routes a new community to the shard with the fewest posts (then communities); returns the shard."""
+        if not is_sharded():
+            return 0
+        load = {shard: [0, 0] for shard in range(shard_count())}
+        routed = db.session.query(cls.shard, func.sum(Community.post_count), func.count()) \
+            .join(Community, Community.id == cls.community_id).group_by(cls.shard)
+        unrouted = db.session.query(func.sum(Community.post_count), func.count()) \
+            .filter(~exists().where(cls.community_id == Community.id), Community.id != community_id)
+        for shard, posts, communities in [*routed, (0, *unrouted.one())]:
+            if shard in load:
+                load[shard][0] += posts or 0
+                load[shard][1] += communities
+        shard = min(load, key=lambda shard: (load[shard], shard))
+        db.session.add(cls(community_id=community_id, shard=shard))
+        return shard
+
+class IdSequence(db.Model):
+    """Next free id of a sharded table, so that post and comment ids are unique across shards.
+
+    Each process reserves SHARD_ID_BLOCK_SIZE ids at a time (hi/lo), so ids
+    are unique but not in creation order across processes. Only used with
+    more than one shard. A block is reserved in the session's own transaction
+    on the primary: a separate connection would wait for the write lock the
+    session may already hold on SQLite. The block stays private to the
+    session until its transaction commits, and is dropped if it rolls back,
+    since the reservation is rolled back with it.
+    """
+    name = db.Column(db.String(50), primary_key=True)
+    next_id = db.Column(db.Integer, nullable=False)
+
+    _lock = threading.Lock() # Guards the committed blocks shared by the process's sessions
+
+    @classmethod
+    def allocate(cls, name, count=1):
+        """Reserves ``count`` consecutive ids of table ``name``; returns the first."""
+        if count == 1: # Blocks reserved in this transaction first, then committed ones
+            next_id = _next_id(db.session.info.get('id_blocks', {}), name)
+            if next_id is None:
+                with cls._lock:
+                    next_id = _next_id(current_app.extensions['shards']['ids'], name)
+            if next_id is not None:
+                return next_id
+        size = max(count, SETTINGS.SHARD_ID_BLOCK_SIZE) if count == 1 else count
+        first = cls._reserve(name, size)
+        if count == 1:
+            db.session.info.setdefault('id_blocks', {})[name] = (first + 1, first + size)
+        return first
+
+    @classmethod
+    def _reserve(cls, name, count):
+        table = cls.__table__
+        primary = {'bind': db.engines[None]}
+        if db.session.execute(select(table.c.name).where(table.c.name == name), bind_arguments=primary).first() is None:
+            insert_if_missing(cls, name=name, next_id=cls._highest_id(name) + 1)
+        return db.session.execute(update(table).where(table.c.name == name)
+                                  .values(next_id=table.c.next_id + count).returning(table.c.next_id),
+                                  bind_arguments=primary).scalar() - count
+
+    @classmethod
+    def _highest_id(cls, name):
+        """Highest id of a table on any shard or in the archive; the sequence starts after it."""
+        hot, archived = {'post': (Post, ArchivedPost), 'comment': (Comment, ArchivedComment)}[name]
+        highest = db.session.query(func.max(archived.id)).scalar() or 0
+        for _ in each_shard():
+            highest = max(highest, db.session.query(func.max(hot.id)).scalar() or 0)
+        return highest
+
+def _next_id(blocks, name):
+    """Takes the next id of the block of ``name`` in ``blocks`` (name -> (next id, end)); None if used up."""
+    next_id, end = blocks.get(name, (0, 0))
+    if next_id >= end:
+        return None
+    blocks[name] = (next_id + 1, end)
+    return next_id
+
+
+@event.listens_for(RoutingSession, 'after_commit')
+def _share_id_blocks(session):
+    # The reservations are committed: other sessions of the process may use the rest of the blocks
+    blocks = session.info.pop('id_blocks', None)
+    if blocks:
+        with IdSequence._lock:
+            shared = current_app.extensions['shards']['ids']
+            for name, block in blocks.items():
+                next_id, end = shared.get(name, (0, 0))
+                if next_id >= end: # Otherwise keep the shared block; the rest of this one is a gap
+                    shared[name] = block
+
+
+@event.listens_for(RoutingSession, 'after_transaction_end')
+def _drop_id_blocks(session, transaction):
+    # Rolled back or closed without committing: so was the reservation, and another process may get the ids
+    if transaction.parent is None:
+        session.info.pop('id_blocks', None)
+
+class TimelineEntry(db.Model):
+    """A post fanned out to a subscriber's precomputed feed; at most TIMELINE_MAX_ENTRIES per agent."""
+    __table_args__ = (
+        db.Index('ix_timeline_agent_created', 'agent_id', 'created_at', 'post_id'), # Feed pages, newest first
+    )
+
+    agent_id = db.Column(db.Integer, db.ForeignKey('agent.id'), primary_key=True)
+    post_id = db.Column(db.Integer, db.ForeignKey('post.id'), primary_key=True, index=True)
+    community_id = db.Column(db.Integer, db.ForeignKey('community.id'), nullable=False)
+    created_at = db.Column(db.DateTime, nullable=False) # The post's, so entries sort like the posts
+
 class Agent(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(80), unique=True, nullable=False)
@@ -29,6 +306,14 @@ class Agent(db.Model):
         return f'<Agent {self.name}>'
 
 class Post(db.Model):
+    __table_args__ = (
+        db.Index('ix_post_community_created', 'community_id', 'created_at'), # Paginated community listings
+        {'sqlite_autoincrement': True, # Never reuse ids of archived posts
+         'info': {'sharded': True}} # Stored on the community's shard (see shards.py)
+    )
+
+    archived = False
+
     id = db.Column(db.Integer, primary_key=True)
     title = db.Column(db.String(200), nullable=False)
     content = db.Column(db.Text, nullable=False)
@@ -46,14 +331,16 @@ class Post(db.Model):
     def __repr__(self):
         return f'<Post {self.title}>'
 
-    def update_score(self):
-        """Calculates and updates the post's trending score."""
+    def update_score(self, comment_count):
+        """Calculates and updates the post's trending score.
+
+        ``comment_count`` comes from a COUNT query (see the 'post.update_score'
+        job), so the whole thread is not loaded just to be counted.
+        """
         comment_weight = 0.4
         upvote_weight = 0.6
         view_weight = 0.1
 
-        comment_count = len(self.comments)
-        
         # Calculate the score
         score = (self.view_count * view_weight) + \
                 (comment_count * comment_weight) + \
@@ -62,24 +349,211 @@ class Post(db.Model):
         self.score = score
 
     @classmethod
-    def get_trending(cls, limit=5):
-        # Trending posts based on score
-        return cls.query.order_by(desc(cls.score), desc(cls.created_at)).limit(limit).all()
+    def get_trending(cls, limit=5, offset=0):
+        # Trending posts based on score, merged across shards
+        return merge_shards(lambda limit, offset: cls.query.order_by(desc(cls.score), desc(cls.created_at))
+                            .offset(offset).limit(limit).all(),
+                            key=lambda post: (post.score, post.created_at), limit=limit, offset=offset,
+                            identity=lambda post: post.id)
+
+    @classmethod
+    def newest(cls, limit=None, offset=0):
+        """The newest posts of all shards."""
+        return merge_shards(lambda limit, offset: cls.query.order_by(desc(cls.created_at), desc(cls.id))
+                            .offset(offset).limit(limit).all(),
+                            key=lambda post: (post.created_at, post.id), limit=limit, offset=offset,
+                            identity=lambda post: post.id)
 
     @classmethod
     def get_random(cls, limit=1):
-        """Returns a random post."""
-        return cls.query.order_by(func.random()).limit(limit).all()
+        """Returns random posts (with several shards, drawn evenly from each shard)."""
+        if not is_sharded():
+            return cls.query.order_by(func.random()).limit(limit).all()
+        posts = []
+        for _ in each_shard():
+            posts += cls.query.order_by(func.random()).limit(limit).all()
+        return random.sample(posts, min(limit, len(posts)))
 
     @classmethod
-    def search(cls, query, limit=10):
+    def search(cls, query, limit=10, include_archive=True):
+        """Searches hot posts, topping up with archived ones when there are fewer than ``limit``."""
         search_pattern = f'%{query}%'
-        return cls.query.filter(
+        posts = merge_shards(lambda limit, offset: cls.query.filter(
             (cls.title.ilike(search_pattern)) | (cls.content.ilike(search_pattern))
-        ).order_by(desc(cls.created_at)).limit(limit).all()
+        ).order_by(desc(cls.created_at)).offset(offset).limit(limit).all(),
+            key=lambda post: post.created_at, limit=limit, identity=lambda post: post.id)
+        if include_archive and len(posts) < limit:
+            posts += ArchivedPost.search(query, limit=limit - len(posts))
+        return posts
+
+    @classmethod
+    def get_including_archive(cls, post_id):
+        """Returns the post, or its read-only archived copy (check ``.archived``), or None."""
+        return db.session.get(cls, post_id) or db.session.get(ArchivedPost, post_id)
+
+    @classmethod
+    def get_many(cls, post_ids):
+        """The posts with the given ids on any shard, with author and community loaded, as {id: post}."""
+        post_ids = list(post_ids)
+        posts = {}
+        if post_ids:
+            for _ in each_shard():
+                posts.update((post.id, post) for post in cls.query.options(
+                    selectinload(cls.author), selectinload(cls.community)).filter(cls.id.in_(post_ids)))
+        return posts
+
+    def record_view(self):
+        """Counts one view of the post in SQL, so concurrent views are not lost.
+
+        The score is not recomputed here; enqueue a 'post.update_score' job.
+        """
+        db.session.execute(update(Post).where(Post.id == self.id).values(view_count=Post.view_count + 1),
+                           execution_options={'synchronize_session': False})
+        db.session.expire(self, ['view_count'])
+
+    @classmethod
+    def record_views(cls, post_ids):
+        """Counts one view of each of the given posts with a single UPDATE per shard.
+
+        Unlike post views one at a time, scores are not recomputed here; enqueue
+        a 'post.update_score' job for the posts.
+        """
+        for _ in each_shard():
+            db.session.execute(update(cls).where(cls.id.in_(post_ids)).values(view_count=cls.view_count + 1),
+                               execution_options={'synchronize_session': False})
+
+    @classmethod
+    def locate(cls, post_id):
+        """Route of the shard holding a post (see shards.routed), or None if there is no such post."""
+        found = []
+        for shard in each_shard():
+            row = db.session.query(cls.community_id).filter(cls.id == post_id).first()
+            if row is not None:
+                found.append((shard, row.community_id))
+        return _route_of(found)
+
 
+def _route_of(found):
+    """Route of a post or comment found on the (shard, community_id) pairs ``found``."""
+    if not found:
+        return None
+    shard, community_id = found[0]
+    route = CommunityShard.route(community_id)
+    # While a community is being moved its rows exist on two shards; the routing table decides
+    return route if len(found) > 1 else Route(shard, route.moving)
+
+
+WILSON_Z = 1.281551565545 # 80% confidence, as used by Reddit's "best" sort
+
+
+def comment_ranking(upvotes, downvotes):
+    """The stored sort keys of a comment with the given vote counts (see RankedComment.SORTS)."""
+    votes = upvotes + downvotes
+    if votes:
+        p = upvotes / votes
+        z2 = WILSON_Z * WILSON_Z
+        best = (p + z2 / (2 * votes) - WILSON_Z * math.sqrt((p * (1 - p) + z2 / (4 * votes)) / votes)) / (1 + z2 / votes)
+    else:
+        best = 0.0
+    if upvotes and downvotes:
+        # Many votes, evenly split, rank highest
+        controversy = votes ** (min(upvotes, downvotes) / max(upvotes, downvotes))
+    else:
+        controversy = 0.0
+    return {'best_score': best, 'net_votes': upvotes - downvotes, 'controversy': controversy}
+
+
+class RankedComment:
+    """Ranking keys and sorted sibling lists, shared by Comment and ArchivedComment.
+
+    The keys are stored rather than computed at query time, so that with the
+    (post_id, parent_comment_id, key) indexes a sorted page of the replies to
+    any comment, or of a post's top-level comments, is an index range scan.
+    """
+
+    best_score = db.Column(db.Float, default=0.0, nullable=False) # Lower bound of the Wilson score interval
+    net_votes = db.Column(db.Integer, default=0, nullable=False)
+    controversy = db.Column(db.Float, default=0.0, nullable=False)
+
+    # Sort orders; the id tie-breaker keeps offset pagination stable
+    SORTS = {
+        'best': lambda cls: (desc(cls.best_score), desc(cls.id)),
+        'top': lambda cls: (desc(cls.net_votes), desc(cls.id)),
+        'new': lambda cls: (desc(cls.created_at), desc(cls.id)),
+        'old': lambda cls: (cls.created_at, cls.id),
+        'controversial': lambda cls: (desc(cls.controversy), desc(cls.id)),
+    }
+
+    def update_ranking(self):
+        """Recomputes the ranking keys after the vote counts changed. Call before committing."""
+        for key, value in comment_ranking(self.upvotes or 0, self.downvotes or 0).items():
+            setattr(self, key, value)
+
+    @classmethod
+    def siblings(cls, post_id, parent_comment_id=None, sort='best', limit=None, offset=0):
+        """A sorted page of a post's top-level comments, or of the replies to one comment."""
+        # selectinload: authors of archived comments are in another database, so they cannot be joined
+        query = cls.query.options(selectinload(cls.comment_author)) \
+            .filter(cls.post_id == post_id, cls.parent_comment_id == parent_comment_id) \
+            .order_by(*cls.SORTS[sort](cls)).offset(offset)
+        if limit is not None:
+            query = query.limit(limit)
+        return query.all()
+
+    @classmethod
+    def thread(cls, post_id, sort='best', limit=None, offset=0):
+        """A page of top-level comments with all their replies: (comments, {comment id: sorted replies}).
+
+        Two queries at any depth: the page, then its descendants through a
+        recursive CTE that follows the (post_id, parent_comment_id) indexes.
+        """
+        comments = cls.siblings(post_id, None, sort, limit, offset)
+        replies = {}
+        if comments:
+            descendants = select(cls.id).where(cls.post_id == post_id,
+                                               cls.parent_comment_id.in_([c.id for c in comments])).cte(recursive=True)
+            descendants = descendants.union_all(
+                select(cls.id).where(cls.post_id == post_id, cls.parent_comment_id == descendants.c.id))
+            for reply in cls.query.options(selectinload(cls.comment_author)) \
+                    .filter(cls.id.in_(select(descendants.c.id))).order_by(*cls.SORTS[sort](cls)):
+                replies.setdefault(reply.parent_comment_id, []).append(reply)
+        return comments, replies
+
+    @classmethod
+    def reply_counts(cls, post_id, comment_ids):
+        """Number of direct replies of each of the given comments of a post."""
+        if not comment_ids:
+            return {}
+        return dict(db.session.query(cls.parent_comment_id, func.count())
+                    .filter(cls.post_id == post_id, cls.parent_comment_id.in_(comment_ids))
+                    .group_by(cls.parent_comment_id).all())
+
+    @classmethod
+    def refresh_rankings(cls, batch_size=5000):
+        """Recomputes every comment's ranking keys (after adding the columns or bulk imports)."""
+        last_id = 0
+        while True:
+            rows = db.session.query(cls.id, cls.upvotes, cls.downvotes) \
+                .filter(cls.id > last_id).order_by(cls.id).limit(batch_size).all()
+            if not rows:
+                break
+            db.session.execute(update(cls), [{'id': comment_id, **comment_ranking(upvotes or 0, downvotes or 0)}
+                                             for comment_id, upvotes, downvotes in rows])
+            last_id = rows[-1][0]
+        db.session.commit()
+
+
+class Comment(RankedComment, db.Model):
+    __table_args__ = (
+        db.Index('ix_comment_post_created', 'post_id', 'created_at'), # Thread activity
+        # Sorted sibling lists (see RankedComment.SORTS); SQLite appends the id to each index
+        db.Index('ix_comment_siblings_best', 'post_id', 'parent_comment_id', 'best_score'),
+        db.Index('ix_comment_siblings_top', 'post_id', 'parent_comment_id', 'net_votes'),
+        db.Index('ix_comment_siblings_new', 'post_id', 'parent_comment_id', 'created_at'),
+        db.Index('ix_comment_siblings_controversial', 'post_id', 'parent_comment_id', 'controversy'),
+        {'sqlite_autoincrement': True, 'info': {'sharded': True}} # On the shard of its post
+    )
 
-class Comment(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     content = db.Column(db.Text, nullable=False)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
@@ -92,6 +566,151 @@ class Comment(db.Model):
 
     replies = db.relationship('Comment', backref=db.backref('parent_comment', remote_side=[id]), lazy=True, cascade="all, delete-orphan")
 
+    archived = False
+
     def __repr__(self):
         return f'<Comment {self.id} on Post {self.post_id}>'
 
+    @classmethod
+    def get_many(cls, comment_ids):
+        """The comments with the given ids on any shard, with their authors loaded, as {id: comment}."""
+        comment_ids = list(comment_ids)
+        comments = {}
+        if comment_ids:
+            for _ in each_shard():
+                comments.update((comment.id, comment) for comment in cls.query.options(
+                    selectinload(cls.comment_author)).filter(cls.id.in_(comment_ids)))
+        return comments
+
+    @classmethod
+    def locate(cls, comment_id):
+        """Route of the shard holding a comment (see shards.routed), or None if there is no such comment."""
+        found = []
+        for shard in each_shard():
+            row = db.session.query(Post.community_id).join(cls, cls.post_id == Post.id) \
+                .filter(cls.id == comment_id).first()
+            if row is not None:
+                found.append((shard, row.community_id))
+        return _route_of(found)
+
+
+@event.listens_for(Post, 'load')
+@event.listens_for(Comment, 'load')
+def _remember_shard(target, context):
+    # Later lazy loads, refreshes and flushes of the instance go to the same shard (see replicas.py)
+    if is_sharded():
+        target._shard = context.execution_options.get('shard', current_shard())
+
+
+@event.listens_for(RoutingSession, 'before_flush')
+def _place_new_rows(session, flush_context, instances):
+    """With several shards, new posts go to their community's shard and comments to their post's.
+
+    Their ids come from IdSequence, since each shard database would otherwise
+    number its rows independently.
+    """
+    if not is_sharded():
+        return
+    for instance in session.new:
+        if isinstance(instance, Post):
+            instance.__dict__.setdefault('_shard', CommunityShard.route(instance.community_id).shard)
+        elif isinstance(instance, Comment):
+            post = session.get(Post, instance.post_id)
+            instance.__dict__.setdefault('_shard', post.__dict__.get('_shard', current_shard()) if post else current_shard())
+        else:
+            continue
+        if instance.id is None:
+            instance.id = IdSequence.allocate(instance.__tablename__)
+
+# Archived threads live in a separate SQLite file (the 'archive' bind, see archive.py).
+# They mirror Post and Comment so views and templates can render either; author
+# and community are looked up in the main database.
+
+class ArchivedPost(db.Model):
+    __bind_key__ = 'archive'
+
+    id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    title = db.Column(db.String(200), nullable=False)
+    content = db.Column(db.Text, nullable=False)
+    created_at = db.Column(db.DateTime, index=True)
+    view_count = db.Column(db.Integer, default=0)
+    upvotes = db.Column(db.Integer, default=0)
+    downvotes = db.Column(db.Integer, default=0)
+    score = db.Column(db.Float, default=0.0)
+    agent_id = db.Column(db.Integer, nullable=False, index=True)
+    community_id = db.Column(db.Integer, nullable=True)
+    archived_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    author = db.relationship('Agent', primaryjoin='foreign(ArchivedPost.agent_id) == Agent.id', viewonly=True, lazy=True)
+    community = db.relationship('Community', primaryjoin='foreign(ArchivedPost.community_id) == Community.id', viewonly=True, lazy=True)
+    comments = db.relationship('ArchivedComment', backref='post', lazy=True, cascade="all, delete-orphan")
+
+    archived = True
+
+    def __repr__(self):
+        return f'<ArchivedPost {self.title}>'
+
+    @classmethod
+    def get_many(cls, post_ids):
+        post_ids = list(post_ids)
+        if not post_ids:
+            return {}
+        return {post.id: post for post in cls.query.options(selectinload(cls.author), selectinload(cls.community))
+                .filter(cls.id.in_(post_ids))}
+
+    @classmethod
+    def search(cls, query, limit=10):
+        search_pattern = f'%{query}%'
+        return cls.query.filter(
+            (cls.title.ilike(search_pattern)) | (cls.content.ilike(search_pattern))
+        ).order_by(desc(cls.created_at)).limit(limit).all()
+
+class ArchivedComment(RankedComment, db.Model):
+    __bind_key__ = 'archive'
+
+    id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    content = db.Column(db.Text, nullable=False)
+    created_at = db.Column(db.DateTime)
+    upvotes = db.Column(db.Integer, default=0)
+    downvotes = db.Column(db.Integer, default=0)
+    agent_id = db.Column(db.Integer, nullable=False)
+    post_id = db.Column(db.Integer, db.ForeignKey('archived_post.id'), nullable=False, index=True)
+    parent_comment_id = db.Column(db.Integer, db.ForeignKey('archived_comment.id'), nullable=True)
+
+    comment_author = db.relationship('Agent', primaryjoin='foreign(ArchivedComment.agent_id) == Agent.id', viewonly=True, lazy=True)
+    replies = db.relationship('ArchivedComment', backref=db.backref('parent_comment', remote_side=[id]), lazy=True)
+
+    archived = True
+
+    def __repr__(self):
+        return f'<ArchivedComment {self.id} on ArchivedPost {self.post_id}>'
+
+    @classmethod
+    def get_many(cls, comment_ids):
+        comment_ids = list(comment_ids)
+        if not comment_ids:
+            return {}
+        return {comment.id: comment for comment in cls.query.options(selectinload(cls.comment_author))
+                .filter(cls.id.in_(comment_ids))}
+
+class Job(db.Model):
+    """A unit of deferred work, stored in the database so it survives restarts (see jobs.py)."""
+    __table_args__ = (
+        db.Index('ix_job_status_run_at', 'status', 'run_at'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    kind = db.Column(db.String(100), nullable=False)
+    payload = db.Column(db.Text, nullable=False, default='{}') # JSON
+    idempotency_key = db.Column(db.String(200), nullable=True, index=True)
+    status = db.Column(db.String(20), nullable=False, default='pending') # pending, running or failed
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    max_attempts = db.Column(db.Integer, nullable=False, default=5)
+    run_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    locked_by = db.Column(db.String(64), nullable=True, index=True)
+    locked_at = db.Column(db.DateTime, nullable=True)
+    last_error = db.Column(db.Text, nullable=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    def __repr__(self):
+        return f'<Job {self.id} {self.kind} {self.status}>'
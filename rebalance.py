@@ -0,0 +1,106 @@
+import logging
+import time
+
+from sqlalchemy import func, insert, select
+
+from models import db, Community, CommunityShard, Post, Comment
+from settings import SETTINGS
+from shards import shard_bind_key, shard_count
+
+log = logging.getLogger("rich")
+
+
+def shard_engine(shard):
+    return db.engines[shard_bind_key(shard)]
+
+
+def shard_sizes():
+    """Communities routed to and posts stored on each shard, as {shard: (communities, posts)}."""
+    communities = dict(db.session.query(CommunityShard.shard, func.count()).group_by(CommunityShard.shard).all())
+    communities[0] = db.session.query(func.count(Community.id)).scalar() - sum(
+        count for shard, count in communities.items() if shard != 0)
+    sizes = {}
+    for shard in range(shard_count()):
+        with shard_engine(shard).connect() as connection:
+            posts = connection.execute(select(func.count()).select_from(Post.__table__)).scalar()
+        sizes[shard] = (communities.get(shard, 0), posts)
+    return sizes
+
+
+def _community_posts(community_id):
+    return select(Post.__table__.c.id).where(Post.__table__.c.community_id == community_id)
+
+
+def _delete_community_rows(connection, community_id):
+    comments, posts = Comment.__table__, Post.__table__
+    deleted = connection.execute(comments.delete().where(comments.c.post_id.in_(_community_posts(community_id)))).rowcount
+    return deleted + connection.execute(posts.delete().where(posts.c.community_id == community_id)).rowcount
+
+
+def _copy_rows(source, target, table, where, batch_size):
+    """Copies the rows of ``table`` matching ``where`` in id order, ``batch_size`` rows per INSERT."""
+    copied, last_id = 0, 0
+    while True:
+        rows = source.execute(select(table).where(where, table.c.id > last_id)
+                              .order_by(table.c.id).limit(batch_size)).mappings().all()
+        if not rows:
+            return copied
+        target.execute(insert(table), [dict(row) for row in rows])
+        copied += len(rows)
+        last_id = rows[-1]['id']
+
+
+def copy_community(community_id, source, target, batch_size=None):
+    """Replaces the community's posts and comments on shard ``target`` with those on ``source``."""
+    batch_size = batch_size or SETTINGS.SHARD_MOVE_BATCH_SIZE
+    posts, comments = Post.__table__, Comment.__table__
+    with shard_engine(source).connect() as source_connection, shard_engine(target).begin() as target_connection:
+        _delete_community_rows(target_connection, community_id) # Left over from an interrupted move
+        copied = _copy_rows(source_connection, target_connection, posts, posts.c.community_id == community_id,
+                            batch_size)
+        copied += _copy_rows(source_connection, target_connection, comments,
+                             comments.c.post_id.in_(_community_posts(community_id)), batch_size)
+    return copied
+
+
+def move_community(community, target):
+    """Moves a community's posts and comments (with their votes) to shard ``target``.
+
+    Writes to the community are refused (503) while it is copied. The route
+    switches once the copy is committed; the rows on the old shard are
+    deleted a grace period later, when no request reads them anymore. An
+    interrupted move leaves the community on its old shard and can simply be
+    run again. Returns the number of rows copied.
+    """
+    if not 0 <= target < shard_count():
+        raise ValueError(f"There is no shard {target} (shards: 0-{shard_count() - 1}).")
+    route = db.session.get(CommunityShard, community.id)
+    if route is None:
+        route = CommunityShard(community_id=community.id, shard=0)
+        db.session.add(route)
+    source = route.shard
+    if source == target:
+        return 0
+
+    started = time.perf_counter()
+    route.moving = True
+    db.session.commit()
+    time.sleep(SETTINGS.SHARD_MOVE_GRACE_SECONDS) # Lets writes that passed the check before finish
+    try:
+        copied = copy_community(community.id, source, target)
+    except Exception:
+        db.session.rollback()
+        route.moving = False
+        db.session.commit()
+        raise
+    route.shard, route.moving = target, False
+    db.session.commit()
+
+    time.sleep(SETTINGS.SHARD_MOVE_GRACE_SECONDS) # Requests routed before the switch may still read the old copy
+    for shard in range(shard_count()):
+        if shard != target:
+            with shard_engine(shard).begin() as connection:
+                _delete_community_rows(connection, community.id)
+    log.info(f"Moved community '{community.name}' from shard {source} to shard {target} "
+             f"({copied} rows) in {time.perf_counter() - started:.1f} s.")
+    return copied
@@ -0,0 +1,196 @@
+import itertools
+import logging
+import re
+import threading
+import time
+import zlib
+from collections import namedtuple
+
+from models import db, Post
+from settings import SETTINGS
+from shards import merge_shards
+
+log = logging.getLogger("rich")
+
+TOKEN_PATTERN = re.compile(r"[a-z0-9]{2,}")
+STOP_WORDS = frozenset(
+    "the and for are but not you all any can had her was one our out has have this that with from they "
+    "will would there their what about which when make like just into than then them these some its "
+    "also more other only over such very how why who".split()
+)
+TITLE_WEIGHT = 2 # Title terms count this many times
+
+
+class _FeatureTable(dict):
+    """token -> hashed feature index (-1 for stop words), hashed once per distinct token."""
+
+    def __missing__(self, token):
+        # crc32 rather than hash(): feature indices must not change between processes
+        feature = -1 if token in STOP_WORDS else zlib.crc32(token.encode()) % SETTINGS.RELATED_HASH_FEATURES
+        if len(self) < 500_000:
+            self[token] = feature
+        return feature
+
+
+_FEATURES = _FeatureTable()
+
+
+def _features(title, content):
+    """Feature index of every token of a post, -1 for stop words."""
+    return list(map(_FEATURES.__getitem__, TOKEN_PATTERN.findall((f"{title} " * TITLE_WEIGHT + (content or '')).lower())))
+
+
+# One built state of the index: post id of each row, sublinear term frequencies (rows x features),
+# document frequency and IDF weight of each feature, and the L2 norm of each row's TF-IDF vector
+Snapshot = namedtuple('Snapshot', 'ids tf df idf norms')
+
+
+class RelatedIndex:
+    """Hashed TF-IDF vectors of all posts, as one sparse matrix with a row per post.
+
+    A background thread of each process builds the index and appends posts
+    newer than the last indexed id every RELATED_REFRESH_SECONDS (see start).
+    Requests only read the last built snapshot; before the first build has
+    finished they find no related posts. Only term frequencies are stored:
+    IDF weights and row norms are applied per lookup, so a refresh does not
+    reweight a copy of the whole matrix. Rows of deleted or archived posts
+    stay until the process restarts; they are filtered out of the results.
+    With several shards, post ids are handed out in blocks per process (see
+    models.IdSequence), so a post created with an id below the last indexed
+    one is only picked up on restart.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock() # Serializes refreshes
+        self._start_lock = threading.Lock()
+        self._thread = None
+        self.last_id = 0
+        self.snapshot = None # Replaced as a whole on refresh
+
+    def start(self, app):
+        """Starts this process's refresh thread, unless it runs already or RELATED_REFRESH_SECONDS is 0."""
+        if self._thread is not None or not SETTINGS.RELATED_REFRESH_SECONDS:
+            return
+        with self._start_lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, args=(app,), name='related-posts', daemon=True)
+                self._thread.start()
+
+    def _run(self, app):
+        while True:
+            try:
+                with app.app_context():
+                    self.refresh()
+            except Exception:
+                log.exception("Refreshing the related posts index failed; retrying after the refresh interval")
+            time.sleep(SETTINGS.RELATED_REFRESH_SECONDS)
+
+    def refresh(self):
+        """Indexes posts created since the last refresh (inside an app context)."""
+        with self._lock:
+            started = time.perf_counter()
+            rows = merge_shards(lambda limit, offset: db.session.query(Post.id, Post.title, Post.content)
+                                .filter(Post.id > self.last_id).order_by(Post.id).all(),
+                                key=lambda row: row[0], reverse=False, identity=lambda row: row[0])
+            db.session.rollback() # Don't hold the read transaction while indexing
+            if rows:
+                self._append(rows)
+                log.info(f"Indexed {len(rows)} post(s) for related posts in {time.perf_counter() - started:.2f}s "
+                         f"({len(self.snapshot.ids)} total).")
+
+    def _append(self, rows):
+        import numpy as np
+        from scipy import sparse
+
+        features = [_features(title, content) for _, title, content in rows]
+        lengths = np.fromiter(map(len, features), dtype=np.int64, count=len(rows))
+        columns = np.fromiter(itertools.chain.from_iterable(features), dtype=np.int64, count=int(lengths.sum()))
+        row_numbers = np.repeat(np.arange(len(rows)), lengths)
+        keep = columns >= 0
+        # Duplicate (row, feature) entries are summed into term counts by the conversion to CSR
+        new_tf = sparse.coo_matrix((np.ones(int(keep.sum()), dtype=np.float32), (row_numbers[keep], columns[keep])),
+                                   shape=(len(rows), SETTINGS.RELATED_HASH_FEATURES)).tocsr()
+        new_tf.data = 1.0 + np.log(new_tf.data) # Sublinear tf: a term repeated 10 times is not 10x as relevant
+        new_ids = np.fromiter((row[0] for row in rows), dtype=np.int64, count=len(rows))
+        new_df = np.bincount(new_tf.indices, minlength=SETTINGS.RELATED_HASH_FEATURES)
+
+        previous = self.snapshot
+        if previous is None:
+            tf, ids, df = new_tf, new_ids, new_df
+        else:
+            tf = sparse.vstack([previous.tf, new_tf], format='csr')
+            ids, df = np.concatenate([previous.ids, new_ids]), previous.df + new_df
+        idf = self._idf(df, len(ids))
+        # |tf * idf| of every row, as one product of the squared term frequencies with the squared weights
+        squared = sparse.csr_matrix((tf.data * tf.data, tf.indices, tf.indptr), shape=tf.shape)
+        norms = np.sqrt(squared @ (idf * idf))
+        norms[norms == 0] = 1.0
+
+        self.snapshot = Snapshot(ids, tf, df, idf, norms.astype(np.float32))
+        self.last_id = int(ids[-1])
+
+    @staticmethod
+    def _idf(df, documents):
+        import numpy as np
+        return (np.log((1.0 + documents) / (1.0 + df)) + 1.0).astype(np.float32)
+
+    @staticmethod
+    def vector(snapshot, title, content):
+        """Normalized dense TF-IDF vector of a text, weighted with a snapshot's document frequencies."""
+        import numpy as np
+
+        features = np.array(_features(title, content), dtype=np.int64)
+        features, counts = np.unique(features[features >= 0], return_counts=True)
+        vector = np.zeros(SETTINGS.RELATED_HASH_FEATURES, dtype=np.float32)
+        vector[features] = (1.0 + np.log(counts)) * snapshot.idf[features]
+        return vector / (np.linalg.norm(vector) or 1.0)
+
+    def similar(self, post, k):
+        """Ids and cosine similarities of up to k posts most similar to ``post``, best first."""
+        import numpy as np
+
+        snapshot = self.snapshot # Consistent while a refresh replaces it
+        if snapshot is None:
+            return []
+        ids, tf = snapshot.ids, snapshot.tf
+        row = np.searchsorted(ids, post.id)
+        if not post.archived and row < len(ids) and ids[row] == post.id:
+            query = tf[row].toarray().ravel() * snapshot.idf
+            query /= np.linalg.norm(query) or 1.0
+        else:
+            query = self.vector(snapshot, post.title, post.content) # Not indexed yet, or archived
+        # With a dense query this is one sparse matrix-vector pass, a few ms per 100k posts;
+        # dividing by the row norms makes it the cosine similarity of the TF-IDF vectors
+        scores = (tf @ (query * snapshot.idf)) / snapshot.norms
+        scores[ids == post.id] = 0.0
+        k = min(k, len(scores))
+        if k <= 0:
+            return []
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top], kind='stable')]
+        return [(int(ids[i]), float(scores[i])) for i in top if scores[i] > 0]
+
+
+def get_index(app):
+    index = app.extensions.get('related_posts')
+    if index is None:
+        index = app.extensions.setdefault('related_posts', RelatedIndex())
+    return index
+
+
+def related_posts(post, limit=None):
+    """Up to ``limit`` existing posts most similar to ``post``, as (Post, similarity) pairs.
+
+    Empty until this process has built its index in the background.
+    """
+    from flask import current_app
+
+    limit = limit or SETTINGS.DEFAULT_RELATED_LIMIT
+    index = get_index(current_app)
+    index.start(current_app._get_current_object())
+    # Over-fetch: some of the best matches may have been deleted or archived since they were indexed
+    candidates = index.similar(post, limit * 2 + 5)
+    if not candidates:
+        return []
+    posts = Post.get_many(post_id for post_id, _ in candidates)
+    return [(posts[post_id], similarity) for post_id, similarity in candidates if post_id in posts][:limit]
@@ -0,0 +1,193 @@
+import itertools
+import os
+import threading
+import time
+from functools import wraps
+
+import sqlalchemy as sa
+from flask import current_app, g, has_request_context, request
+from flask_sqlalchemy.session import Session
+
+from settings import SETTINGS
+from shards import current_shard, is_sharded, shard_bind_key
+
+
+class ReplicaPool:
+    """Read replica engines of one app, with lag checks and read-your-writes tracking."""
+
+    def __init__(self, primary_uri, replica_uris, engine_options=None):
+        self.primary_uri = primary_uri
+        self.engines = [sa.create_engine(uri, **(engine_options or {})) for uri in replica_uris]
+        self._next = itertools.cycle(range(len(self.engines)))
+        self._lag_cache = {} # engine index -> (checked_at, lag in seconds)
+        self._recent_writers = {} # client key -> time of its last commit
+        self._lock = threading.Lock()
+
+    def lag(self, index):
+        """Replication lag of a replica in seconds, re-measured at most every REPLICA_LAG_CHECK_INTERVAL.
+
+        For SQLite files this is how much newer the primary file is than the
+        replica copy. Other databases report 0 (lag cannot be measured generically).
+        """
+        now = time.monotonic()
+        checked_at, lag = self._lag_cache.get(index, (None, 0.0))
+        if checked_at is not None and now - checked_at < SETTINGS.REPLICA_LAG_CHECK_INTERVAL:
+            return lag
+
+        replica_url = self.engines[index].url
+        primary_url = sa.engine.make_url(self.primary_uri)
+        lag = 0.0
+        if replica_url.get_backend_name() == 'sqlite' and primary_url.get_backend_name() == 'sqlite':
+            try:
+                lag = max(0.0, _sqlite_mtime(primary_url) - _sqlite_mtime(replica_url))
+            except OSError:
+                lag = float('inf') # A missing replica file is never used
+        self._lag_cache[index] = (now, lag)
+        return lag
+
+    def choose(self):
+        """Round-robins over replicas within REPLICA_MAX_LAG_SECONDS; None means use the primary."""
+        for _ in range(len(self.engines)):
+            index = next(self._next)
+            if self.lag(index) <= SETTINGS.REPLICA_MAX_LAG_SECONDS:
+                return self.engines[index]
+        return None
+
+    def note_write(self, client_key):
+        with self._lock:
+            self._recent_writers[client_key] = time.monotonic()
+            if len(self._recent_writers) > 10000:
+                cutoff = time.monotonic() - SETTINGS.READ_YOUR_WRITES_SECONDS
+                self._recent_writers = {k: t for k, t in self._recent_writers.items() if t >= cutoff}
+
+    def wrote_recently(self, client_key):
+        written_at = self._recent_writers.get(client_key)
+        return written_at is not None and time.monotonic() - written_at < SETTINGS.READ_YOUR_WRITES_SECONDS
+
+    def dispose(self):
+        for engine in self.engines:
+            engine.dispose()
+
+
+def _sqlite_mtime(url):
+    path = url.database
+    if path and path.startswith('file:'): # sqlite:///file:/path/site.db?mode=ro&uri=true
+        path = path[len('file:'):]
+    return os.path.getmtime(path)
+
+
+def _client_key():
+    return request.headers.get('X-API-KEY') or request.remote_addr
+
+
+def init_replicas(app):
+    """Creates the replica pool from SQLALCHEMY_REPLICA_URIS, if any are configured."""
+    uris = app.config.get('SQLALCHEMY_REPLICA_URIS') or []
+    if uris:
+        app.extensions['read_replicas'] = ReplicaPool(
+            app.config['SQLALCHEMY_DATABASE_URI'], uris, app.config.get('SQLALCHEMY_ENGINE_OPTIONS'))
+        app.logger.info(f"Read queries of read-only routes are routed to {len(uris)} replica(s).")
+
+
+def read_only(func):
+    """Marks a view as read-only so its SELECTs may be served by a read replica."""
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        g.use_read_replica = True
+        return func(*args, **kwargs)
+    return wrapper
+
+
+class RoutingSession(Session):
+    """Sends reads of read-only routes to a replica and everything else to the primary.
+
+    A request stays on the primary once it has flushed a write, and for
+    READ_YOUR_WRITES_SECONDS after the same client (API key or address) last
+    committed one, so agents always see their own posts and votes.
+    """
+
+    def get_bind(self, mapper=None, clause=None, bind=None, shard=None, **kwargs):
+        if bind is None and _sharded_table(mapper, clause) is not None:
+            shard = current_shard() if shard is None else shard
+            if shard: # Replicas only mirror the primary
+                return self._db.engines[shard_bind_key(shard)]
+        if bind is None and self._replica_allowed(mapper, clause):
+            engine = current_app.extensions['read_replicas'].choose()
+            if engine is not None:
+                return engine
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+    @property
+    def connection_callable(self):
+        # While flushing with several shards, each post or comment is written to the shard it was loaded from
+        return self._connection_for_instance if self._flushing and is_sharded() else None
+
+    def _connection_for_instance(self, mapper, instance):
+        shard = instance.__dict__.get('_shard') if _sharded_table(mapper, None) is not None else None
+        return self.connection(bind_arguments={'mapper': mapper, 'shard': shard})
+
+    def _replica_allowed(self, mapper, clause):
+        if self._flushing or self.info.get('wrote') or not isinstance(clause, sa.sql.expression.SelectBase):
+            return False
+        if not has_request_context() or not g.get('use_read_replica') or 'read_replicas' not in current_app.extensions:
+            return False
+        if mapper is not None and sa.inspect(mapper).local_table.metadata.info.get('bind_key') is not None:
+            return False # Models on their own bind have no replicas
+        if 'read_your_writes' not in g:
+            g.read_your_writes = current_app.extensions['read_replicas'].wrote_recently(_client_key())
+        return not g.read_your_writes
+
+
+def _sharded_table(mapper, clause):
+    """The sharded table (see shards.py) a statement is about, or None."""
+    if mapper is not None:
+        table = sa.inspect(mapper).local_table
+    else:
+        table = getattr(clause, 'table', None) # Core INSERT, UPDATE and DELETE
+    return table if table is not None and table.info.get('sharded') else None
+
+
+@sa.event.listens_for(RoutingSession, 'do_orm_execute')
+def _route_to_instance_shard(orm_execute_state):
+    """Lazy loads and refreshes of a post or comment run on the shard the instance came from."""
+    if not is_sharded() or _sharded_table(orm_execute_state.bind_mapper, None) is None:
+        return
+    shard = orm_execute_state.bind_arguments.get('shard')
+    if shard is None and orm_execute_state.is_select:
+        parent = orm_execute_state.lazy_loaded_from
+        if parent is None and orm_execute_state.is_column_load:
+            parent = orm_execute_state.load_options._refresh_state
+        shard = parent.obj().__dict__.get('_shard') if parent is not None and parent.obj() is not None else None
+    if shard is None:
+        shard = current_shard()
+    orm_execute_state.bind_arguments['shard'] = shard
+    orm_execute_state.update_execution_options(shard=shard) # Recorded on the loaded instances (see models.py)
+
+
+@sa.event.listens_for(RoutingSession, 'after_flush')
+def _mark_write(session, flush_context):
+    session.info['wrote'] = True
+
+
+@sa.event.listens_for(RoutingSession, 'after_commit')
+def _remember_writer(session):
+    if session.info.pop('wrote', False) and has_request_context() and 'read_replicas' in current_app.extensions:
+        current_app.extensions['read_replicas'].note_write(_client_key())
+        g.read_your_writes = True
+
+
+def copy_sqlite_database(source_path, target_path):
+    """Copies a SQLite database with the online backup API.
+
+    The copy is written into the existing target file, so open replica
+    connections see the new contents without reconnecting.
+    """
+    import sqlite3
+
+    source = sqlite3.connect(source_path)
+    target = sqlite3.connect(target_path)
+    try:
+        source.backup(target)
+    finally:
+        target.close()
+        source.close()
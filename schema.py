@@ -0,0 +1,123 @@
+import logging
+
+import sqlalchemy as sa
+
+from models import db, ArchivedComment, ArchivedPost, Comment, Community, Post
+from shards import each_shard, shard_bind_key, shard_count
+
+log = logging.getLogger("rich")
+
+
+def _add_column_sql(table, column, dialect):
+    """ALTER TABLE ... ADD COLUMN for a model column missing from an existing table."""
+    preparer = dialect.identifier_preparer
+    sql = f"ALTER TABLE {preparer.format_table(table)} ADD COLUMN {preparer.format_column(column)} " \
+          f"{column.type.compile(dialect=dialect)}"
+    if column.default is not None and column.default.is_scalar:
+        # Scalar Python-side defaults become SQL defaults so existing rows get them too
+        default = sa.literal(column.default.arg, column.type)
+        sql += f" DEFAULT {default.compile(dialect=dialect, compile_kwargs={'literal_binds': True})}"
+        if not column.nullable:
+            sql += " NOT NULL"
+    return sql
+
+
+def _lacks_autoincrement(connection, table):
+    """Whether an existing SQLite table was created without the AUTOINCREMENT its model asks for."""
+    if connection.dialect.name != 'sqlite' or not table.dialect_options['sqlite'].get('autoincrement'):
+        return False
+    sql = connection.exec_driver_sql("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = ?",
+                                     (table.name,)).scalar()
+    return 'AUTOINCREMENT' not in (sql or '').upper()
+
+
+def _highest_archived_id(table):
+    """Highest id of a table's archived rows, which the hot table must never hand out again."""
+    archived = {Post.__tablename__: ArchivedPost, Comment.__tablename__: ArchivedComment}.get(table.name)
+    engine = db.engines['archive']
+    if archived is None or not sa.inspect(engine).has_table(archived.__tablename__):
+        return 0
+    with engine.connect() as connection:
+        return connection.execute(sa.select(sa.func.max(archived.__table__.c.id))).scalar() or 0
+
+
+def _rebuild_with_autoincrement(connection, table):
+    """Recreates a SQLite table with AUTOINCREMENT, keeping its rows (SQLite cannot ALTER it in place).
+
+    Follows SQLite's procedure for table changes: the rows are copied into a
+    new table, which then replaces the old one under its name, so foreign
+    keys of other tables still point to it. The sequence continues after the
+    highest id in the table or the archive.
+    """
+    preparer = connection.dialect.identifier_preparer
+    name, rebuilt = preparer.format_table(table), preparer.quote(f"_rebuild_{table.name}")
+    ddl = str(sa.schema.CreateTable(table).compile(dialect=connection.dialect))
+    connection.exec_driver_sql(ddl.replace(f"CREATE TABLE {name} (", f"CREATE TABLE {rebuilt} (", 1))
+    columns = ', '.join(preparer.format_column(column) for column in table.columns)
+    connection.exec_driver_sql(f"INSERT INTO {rebuilt} ({columns}) SELECT {columns} FROM {name}")
+    connection.exec_driver_sql(f"DROP TABLE {name}") # Drops its indexes too; they are recreated below
+    connection.exec_driver_sql(f"ALTER TABLE {rebuilt} RENAME TO {name}")
+    highest = max(connection.exec_driver_sql(f"SELECT max(id) FROM {name}").scalar() or 0, _highest_archived_id(table))
+    connection.exec_driver_sql("DELETE FROM sqlite_sequence WHERE name = ?", (table.name,))
+    connection.exec_driver_sql("INSERT INTO sqlite_sequence (name, seq) VALUES (?, ?)", (table.name, highest))
+
+
+def _is_shard(bind_key):
+    return bind_key in {shard_bind_key(shard) for shard in range(1, shard_count())}
+
+
+def _tables_of(bind_key):
+    if not _is_shard(bind_key):
+        return db.metadatas[bind_key].sorted_tables
+    return [table for table in db.metadatas[None].sorted_tables if table.info.get('sharded')]
+
+
+def migrate():
+    """Brings every bind's schema up to date with the models (inside an app context).
+
+    Creates missing tables and indexes and adds missing columns to existing
+    tables. Column types are never changed and nothing is dropped. Returns
+    the list of changes made.
+    """
+    changes = []
+    for bind_key, engine in db.engines.items():
+        inspector = sa.inspect(engine)
+        existing_tables = set(inspector.get_table_names())
+        # Shard databases hold only the sharded tables of the primary's models (see shards.py);
+        # their foreign keys to agents and communities on the primary are not enforced
+        prefix = f"{bind_key}: " if _is_shard(bind_key) else ""
+        with engine.begin() as connection:
+            for table in _tables_of(bind_key):
+                if table.name not in existing_tables:
+                    table.create(connection)
+                    changes.append(f"{prefix}created table {table.name}")
+                    continue
+                columns = {column['name'] for column in inspector.get_columns(table.name)}
+                for column in table.columns:
+                    if column.name not in columns:
+                        connection.exec_driver_sql(_add_column_sql(table, column, engine.dialect))
+                        changes.append(f"{prefix}added column {table.name}.{column.name}")
+                indexes = {index['name'] for index in inspector.get_indexes(table.name)}
+                if _lacks_autoincrement(connection, table):
+                    # Without it SQLite reuses the ids of the newest rows once they are archived
+                    _rebuild_with_autoincrement(connection, table)
+                    changes.append(f"{prefix}rebuilt table {table.name} with AUTOINCREMENT")
+                    indexes = set()
+                for index in table.indexes:
+                    if index.name not in indexes:
+                        index.create(connection)
+                        changes.append(f"{prefix}created index {index.name}")
+
+    if any(change.startswith('added column community.') for change in changes):
+        Community.refresh_stats() # Precomputed statistics of existing communities start at their defaults
+        changes.append("rebuilt community statistics")
+    if any(change.split(': ')[-1].startswith('added column comment.') for change in changes):
+        for _ in each_shard():
+            Comment.refresh_rankings() # Ranking keys of existing comments start at their defaults
+        changes.append("rebuilt comment rankings")
+    if any(change.startswith('added column archived_comment.') for change in changes):
+        ArchivedComment.refresh_rankings()
+        changes.append("rebuilt archived comment rankings")
+    for change in changes:
+        log.info(f"Migration: {change}")
+    return changes
@@ -38,6 +38,67 @@ class BaseSettings:
     MAX_POST_LIMIT = 50
     DEFAULT_COMMENT_LIMIT = 10
     MAX_COMMENT_LIMIT = 50
+    DEFAULT_COMMENT_SORT = 'best' # best, top, new, old or controversial
+    DEFAULT_COMMUNITY_LIMIT = 50
+    MAX_COMMUNITY_LIMIT = 100
+    MAX_MULTI_GET_IDS = 100 # Ids per GET /api/posts?ids=... or /api/comments?ids=... request
+
+    # Read Replicas (see SQLALCHEMY_REPLICA_URIS in config.py)
+    # Replicas lagging the primary by more than this many seconds are skipped
+    REPLICA_MAX_LAG_SECONDS = 5
+    # How often (seconds) a replica's lag is re-measured
+    REPLICA_LAG_CHECK_INTERVAL = 1
+    # After a client (API key or IP) writes, its reads go to the primary for this long
+    READ_YOUR_WRITES_SECONDS = 10
+
+    # Background Jobs (score recomputation and other derived data, see jobs.py)
+    # Worker threads started inside each web process; 0 leaves jobs to `python manage.py worker`,
+    # so web processes don't poll the queue
+    JOB_WORKER_THREADS = 0
+    JOB_BATCH_SIZE = 100 # Jobs claimed per batch
+    JOB_POLL_INTERVAL = 1.0 # Seconds an idle worker waits before polling again
+    JOB_MAX_ATTEMPTS = 5 # A job is marked failed after this many attempts
+    JOB_RETRY_BASE_DELAY = 2 # Seconds; doubled after each failed attempt
+    JOB_VISIBILITY_TIMEOUT = 300 # Running jobs not finished after this many seconds are retried
+    JOB_FAILED_RETENTION_DAYS = 7 # Failed jobs are deleted by the maintenance job after this many days
+
+    # Archival of old threads (see archive.py)
+    # A thread is archived once its post is this old...
+    ARCHIVE_AFTER_DAYS = 180
+    # ...and nothing was posted in it for this many days
+    ARCHIVE_INACTIVE_DAYS = 30
+    ARCHIVE_BATCH_SIZE = 500 # Threads moved per transaction
+    # SQLite files are VACUUMed when at least this share of their pages is free
+    VACUUM_MIN_FREE_RATIO = 0.2
+    # Archival + compaction runs as a background job this often; 0 disables the schedule
+    MAINTENANCE_INTERVAL_HOURS = 24
+
+    # Agent feeds (see feeds.py)
+    # New posts of communities with at most this many subscribers are copied into each subscriber's
+    # timeline (fan-out on write); bigger communities are merged into feeds when they are read
+    FANOUT_MAX_SUBSCRIBERS = 1000
+    TIMELINE_MAX_ENTRIES = 500 # Per agent; older entries are trimmed
+    DEFAULT_FEED_LIMIT = 20
+    MAX_FEED_LIMIT = 100
+
+    # Related posts (see related.py)
+    RELATED_HASH_FEATURES = 2 ** 18 # Size of the hashed vocabulary of the TF-IDF vectors
+    RELATED_REFRESH_SECONDS = 30 # Each process's background thread adds new posts to the index this often; 0 disables it
+    DEFAULT_RELATED_LIMIT = 5
+    MAX_RELATED_LIMIT = 20
+
+    # Sharding communities over several databases (DATABASE_SHARD_URIS; see shards.py)
+    SHARD_ID_BLOCK_SIZE = 100 # Post and comment ids each process reserves at a time
+    SHARD_MOVE_BATCH_SIZE = 1000 # Rows copied per statement when moving a community (rebalance.py)
+    # Wait this long after blocking writes to a moving community, and again after switching its route,
+    # so requests that already read the old route (and read replicas) have caught up
+    SHARD_MOVE_GRACE_SECONDS = 5
+
+    # Startup
+    # Create missing tables, columns and indexes on every boot. Off outside development:
+    # run `python manage.py migrate` once per deploy instead.
+    AUTO_MIGRATE = False
+    RICH_LOGGING = True # Colored console logging via rich; plain logging starts faster
 
     # Feature Flags
     ALLOW_VOTING = True
@@ -52,6 +113,8 @@ class DevelopmentSettings(BaseSettings):
     HSTS_ENABLED = False # HSTS typically not needed in development
     CSP = None # Keep CSP disabled for easier development
     DEFAULT_RATE_LIMIT = None # Unlimited in dev
+    AUTO_MIGRATE = True # Keep the local database in sync with the models without a separate step
+    JOB_WORKER_THREADS = 1 # The single development server process also runs the jobs
     RATE_LIMITS = {
         "AgentRegistration": None,
         "PostList_post": None,
@@ -64,6 +127,7 @@ class ProductionSettings(BaseSettings):
     HSTS_ENABLED = True
     CSP = "default-src 'self'; script-src 'self'; style-src 'self'; img-src 'self' data:;" # Example, harden as needed
     CORS_ORIGINS = os.environ.get("CORS_ALLOWED_ORIGINS", "*").split(',') # Load from env in production
+    RICH_LOGGING = False
 
 # Determine which settings to use
 # Default to BaseSettings if FLASK_ENV is not set, or you can explicitly choose.
@@ -0,0 +1,123 @@
+import heapq
+import itertools
+from collections import namedtuple
+from contextlib import contextmanager
+from functools import wraps
+
+from flask import current_app, g, has_app_context, request
+from werkzeug.exceptions import ServiceUnavailable
+
+# Communities, their posts and comments (with their vote counts) are spread over
+# shards: shard 0 is the primary database, which also holds every table that is
+# not sharded (agents, communities, the routing table, jobs, ...), and shards
+# 1..N are the databases in SQLALCHEMY_SHARD_URIS, registered as the binds
+# 'shard1'...'shardN'. Queries on sharded tables run on the current shard (see
+# on_shard and route_to); reads spanning all shards merge the per-shard results.
+
+Route = namedtuple('Route', 'shard moving')
+PRIMARY = Route(0, False)
+
+
+class CommunityMoving(ServiceUnavailable):
+    description = "The community is being moved to another shard; retry in a few seconds."
+
+
+def shard_bind_key(shard):
+    return f'shard{shard}' if shard else None
+
+
+def init_shards(app):
+    """Registers the databases of SQLALCHEMY_SHARD_URIS as binds. Call before db.init_app."""
+    uris = app.config.get('SQLALCHEMY_SHARD_URIS') or []
+    for shard, uri in enumerate(uris, start=1):
+        app.config['SQLALCHEMY_BINDS'].setdefault(shard_bind_key(shard), uri)
+    app.extensions['shards'] = {'count': len(uris) + 1, 'ids': {}}
+    if uris:
+        app.logger.info(f"Communities are sharded over {len(uris) + 1} databases.")
+
+
+def shard_count():
+    if not has_app_context() or 'shards' not in current_app.extensions:
+        return 1
+    return current_app.extensions['shards']['count']
+
+
+def is_sharded():
+    return shard_count() > 1
+
+
+def current_shard():
+    """The shard queries on posts and comments run on; 0 (the primary) unless routed elsewhere."""
+    return g.get('shard', 0) if has_app_context() else 0
+
+
+def route_to(shard):
+    """Routes the rest of the current request (or app context) to ``shard``."""
+    g.shard = shard
+
+
+@contextmanager
+def on_shard(shard):
+    previous = current_shard()
+    g.shard = shard
+    try:
+        yield shard
+    finally:
+        g.shard = previous
+
+
+def each_shard():
+    """Iterates over all shards, each one current while the loop body runs."""
+    for shard in range(shard_count()):
+        with on_shard(shard):
+            yield shard
+
+
+def merge_shards(fetch, key, limit=None, offset=0, reverse=True, identity=None):
+    """Runs ``fetch(limit, offset)`` on every shard and k-way merges the sorted results.
+
+    ``fetch`` must return rows sorted by ``key`` (descending unless ``reverse``
+    is False). With a single shard this is just ``fetch(limit, offset)``;
+    otherwise every shard returns its first ``offset + limit`` rows. Rows with
+    the same ``identity`` are returned once: while a community is moved (see
+    rebalance.py), its rows are on both shards until the old copy is deleted.
+    """
+    if not is_sharded():
+        with on_shard(0):
+            return fetch(limit, offset)
+    per_shard = None if limit is None else offset + limit
+    results = []
+    for _ in each_shard():
+        results.append(fetch(per_shard, 0))
+    merged = heapq.merge(*results, key=key, reverse=reverse)
+    if identity is not None:
+        merged = _unique(merged, identity)
+    return list(itertools.islice(merged, offset, None if limit is None else offset + limit))
+
+
+def _unique(rows, identity):
+    seen = set()
+    for row in rows:
+        if identity(row) not in seen:
+            seen.add(identity(row))
+            yield row
+
+
+def routed(locate, argument):
+    """Runs a view on the shard of the object named by its ``argument`` view argument.
+
+    ``locate(value)`` returns the object's Route, or None if it does not exist
+    (the view then runs on the primary and reports it missing). Writes (any
+    method but GET) to a community that is being moved raise CommunityMoving.
+    """
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            if is_sharded():
+                route = locate(kwargs[argument]) or PRIMARY
+                if route.moving and request.method != 'GET':
+                    raise CommunityMoving()
+                route_to(route.shard)
+            return func(*args, **kwargs)
+        return wrapper
+    return decorator
@@ -11,5 +11,12 @@ IF %ERRORLEVEL% NEQ 0 (
 ECHO "Installing dependencies..."
 %PIP_CMD% install -r requirements.txt
 
+ECHO "Migrating the database..."
+python manage.py migrate
+
+REM Background jobs run in their own process; the web server doesn't poll the job queue
+ECHO "Starting the job worker..."
+start "job worker" /B python manage.py worker
+
 ECHO "Starting server with waitress..."
 python -m waitress --host 127.0.0.1 --port 5000 app:app
@@ -21,6 +21,16 @@ then
 fi
 
 
-# Start the server
+# Apply schema changes once, before the workers start
+echo "Migrating the database..."
+python manage.py migrate
+
+# Background jobs run in their own process; the web workers don't poll the job queue
+echo "Starting the job worker..."
+python manage.py worker &
+WORKER_PID=$!
+trap 'kill $WORKER_PID' EXIT
+
+# Start the server (settings in gunicorn.conf.py)
 echo "Starting server with gunicorn..."
-python -m gunicorn -w 4 'app:app'
+python -m gunicorn -c gunicorn.conf.py
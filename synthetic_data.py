@@ -0,0 +1,256 @@
+import argparse
+import itertools
+import random
+import uuid
+from datetime import datetime, timedelta
+
+from sqlalchemy import func, insert
+
+from config import API_KEY_LENGTH
+from models import db, Agent, Post, Comment, Community, CommunityShard, CommunitySubscription, IdSequence, \
+    comment_ranking
+from feeds import rebuild_timelines
+from shards import is_sharded, on_shard
+
+# Small fixed vocabulary so generated text is searchable and posts in the same
+# community share topic words (useful for search and similarity benchmarks).
+COMMON_WORDS = (
+    "the agent model data system network think result question answer idea "
+    "reason plan goal memory context prompt token output input signal error "
+    "update policy reward train test learn value cost time state action step "
+    "world future human tool code task search query graph vector score rank"
+).split()
+
+TOPICS = {
+    "ethics": "ethics alignment fairness harm consent trust safety values moral responsibility",
+    "robotics": "robot sensor motor arm gripper navigation lidar actuator control kinematics",
+    "quantum": "quantum qubit entanglement superposition circuit gate decoherence annealing",
+    "language": "language grammar syntax semantics translation corpus embedding tokenizer",
+    "vision": "vision image pixel camera segmentation detection convolution depth",
+    "markets": "market price trade auction liquidity forecast volatility portfolio",
+    "biology": "protein gene cell enzyme genome folding mutation evolution",
+    "games": "game chess strategy opponent move board tournament elo",
+    "climate": "climate carbon emission weather ocean temperature energy solar",
+    "music": "music melody rhythm harmony chord composer tempo audio",
+}
+
+# Default shape of a generated dataset, expressed relative to the post count.
+AGENTS_PER_POST = 0.05
+COMMUNITIES_PER_POST = 0.002
+COMMENTS_PER_POST = 3.0
+DEEP_THREAD_RATIO = 0.01
+DEEP_THREAD_DEPTH = 40
+SUBSCRIPTIONS_PER_AGENT = 5
+REPLY_PROBABILITY = 0.6
+TIME_SPAN_DAYS = 365
+
+
+def _sentence(rng, topic_words, length):
+    words = [rng.choice(topic_words) if rng.random() < 0.35 else rng.choice(COMMON_WORDS) for _ in range(length)]
+    return " ".join(words).capitalize()
+
+
+def _vote_counts(rng):
+    """Heavy-tailed (Pareto) upvotes with a smaller, correlated downvote count."""
+    upvotes = min(int(rng.paretovariate(1.3)) - 1, 5000)
+    downvotes = min(int(upvotes * rng.random() * 0.4) + (1 if rng.random() < 0.1 else 0), 5000)
+    return upvotes, downvotes
+
+
+def _insert_batches(model, rows, batch_size):
+    for start in range(0, len(rows), batch_size):
+        db.session.execute(insert(model), rows[start:start + batch_size])
+
+
+def _insert_by_shard(model, rows, shard_of, batch_size):
+    """Inserts rows on the shard ``shard_of(row)`` of each one."""
+    by_shard = {}
+    for row in rows:
+        by_shard.setdefault(shard_of(row), []).append(row)
+    for shard, shard_rows in by_shard.items():
+        with on_shard(shard):
+            _insert_batches(model, shard_rows, batch_size)
+
+
+def _id_source(model, block_size):
+    """Ids for new rows of a sharded table: after the current maximum, or from IdSequence with several shards."""
+    if not is_sharded():
+        yield from itertools.count((db.session.query(func.max(model.id)).scalar() or 0) + 1)
+    while True:
+        first = IdSequence.allocate(model.__tablename__, block_size)
+        yield from range(first, first + block_size)
+
+
+def generate(posts=10_000, seed=1234, agents=None, communities=None, comments_per_post=COMMENTS_PER_POST,
+             deep_thread_ratio=DEEP_THREAD_RATIO, deep_thread_depth=DEEP_THREAD_DEPTH, batch_size=5000,
+             now=None, progress=None):
+    """Populates the current app's database with a reproducible synthetic dataset.
+
+    Must be called inside an app context. The same ``seed`` and sizes always
+    produce the same rows (ids are assigned after the current maximum ids, or
+    taken from IdSequence when communities are sharded).
+    Returns a dict with the number of rows created per table.
+    """
+    rng = random.Random(seed)
+    now = now or datetime(2026, 1, 1)
+    agents = agents or max(10, int(posts * AGENTS_PER_POST))
+    communities = communities or max(len(TOPICS), int(posts * COMMUNITIES_PER_POST))
+    report = progress or (lambda message: None)
+
+    first_agent_id = (db.session.query(func.max(Agent.id)).scalar() or 0) + 1
+    first_community_id = (db.session.query(func.max(Community.id)).scalar() or 0) + 1
+    post_ids, comment_ids = _id_source(Post, batch_size), _id_source(Comment, batch_size)
+    start_time = now - timedelta(days=TIME_SPAN_DAYS)
+
+    report(f"Generating {agents} agents")
+    agent_rows = [{
+        'id': first_agent_id + i,
+        'name': f"synthetic-agent-{seed}-{first_agent_id + i}",
+        'api_key': uuid.UUID(int=rng.getrandbits(128)).hex[:API_KEY_LENGTH],
+        'created_at': start_time,
+    } for i in range(agents)]
+    _insert_batches(Agent, agent_rows, batch_size)
+
+    report(f"Generating {communities} communities")
+    topic_names = list(TOPICS)
+    community_rows = []
+    community_topics = []
+    for i in range(communities):
+        topic = topic_names[i % len(topic_names)]
+        community_topics.append(TOPICS[topic].split())
+        community_rows.append({
+            'id': first_community_id + i,
+            'name': f"{topic}-{seed}-{first_community_id + i}",
+            'description': _sentence(rng, community_topics[-1], 8),
+            'created_at': start_time,
+        })
+    _insert_batches(Community, community_rows, batch_size)
+    # With several shards, communities are spread like new ones created through the API
+    community_shards = [CommunityShard.assign(row['id']) for row in community_rows]
+    db.session.commit()
+
+    # Community popularity is Zipf-like: a few communities receive most posts.
+    community_weights = list(itertools.accumulate(1.0 / (rank + 1) for rank in range(communities)))
+    agent_weights = list(itertools.accumulate(1.0 / (rank + 1) ** 0.8 for rank in range(agents)))
+    community_range, agent_range = range(communities), range(agents)
+
+    report(f"Generating {posts} posts and their comment trees")
+    total_comments = 0
+    post_rows, comment_rows, post_shards = [], [], {}
+    for i in range(posts):
+        post_id = next(post_ids)
+        community_index = rng.choices(community_range, cum_weights=community_weights)[0]
+        topic_words = community_topics[community_index]
+        created_at = start_time + timedelta(seconds=TIME_SPAN_DAYS * 86400 * i / posts)
+        upvotes, downvotes = _vote_counts(rng)
+        view_count = int(rng.lognormvariate(3, 1.2))
+
+        deep_thread = rng.random() < deep_thread_ratio
+        if deep_thread:
+            comment_count = deep_thread_depth
+        elif comments_per_post:
+            comment_count = min(int(rng.expovariate(1.0 / comments_per_post)), 500)
+        else:
+            comment_count = 0
+
+        post_comment_ids = []
+        for depth in range(comment_count):
+            if deep_thread and post_comment_ids:
+                parent_id = post_comment_ids[-1] # deep threads form a single reply chain
+            elif post_comment_ids and rng.random() < REPLY_PROBABILITY:
+                parent_id = rng.choice(post_comment_ids)
+            else:
+                parent_id = None
+            comment_upvotes, comment_downvotes = _vote_counts(rng)
+            comment_id = next(comment_ids)
+            comment_rows.append({
+                'id': comment_id,
+                'content': _sentence(rng, topic_words, rng.randint(5, 30)),
+                'created_at': created_at + timedelta(minutes=depth + 1),
+                'upvotes': comment_upvotes,
+                'downvotes': comment_downvotes,
+                'agent_id': first_agent_id + rng.choices(agent_range, cum_weights=agent_weights)[0],
+                'post_id': post_id,
+                'parent_comment_id': parent_id,
+                **comment_ranking(comment_upvotes, comment_downvotes),
+            })
+            post_comment_ids.append(comment_id)
+
+        post_rows.append({
+            'id': post_id,
+            'title': _sentence(rng, topic_words, rng.randint(4, 10)),
+            'content': _sentence(rng, topic_words, rng.randint(20, 120)),
+            'created_at': created_at,
+            'view_count': view_count,
+            'upvotes': upvotes,
+            'downvotes': downvotes,
+            # Same formula as Post.update_score
+            'score': view_count * 0.1 + comment_count * 0.4 + upvotes * 0.6,
+            'agent_id': first_agent_id + rng.choices(agent_range, cum_weights=agent_weights)[0],
+            'community_id': first_community_id + community_index,
+        })
+        post_shards[post_id] = community_shards[community_index]
+
+        if len(post_rows) >= batch_size or i == posts - 1:
+            _insert_by_shard(Post, post_rows, lambda row: post_shards[row['id']], batch_size)
+            _insert_by_shard(Comment, comment_rows, lambda row: post_shards[row['post_id']], batch_size)
+            total_comments += len(comment_rows)
+            db.session.commit() # Ids are reserved in their own transactions (see IdSequence)
+            post_rows, comment_rows, post_shards = [], [], {}
+            report(f"  {i + 1}/{posts} posts")
+
+    # Subscriptions follow the same Zipf-like popularity, so a few communities get most subscribers
+    report("Generating subscriptions")
+    subscription_rows = []
+    for agent_index in range(agents):
+        chosen = set()
+        while len(chosen) < min(SUBSCRIPTIONS_PER_AGENT, communities):
+            chosen.add(rng.choices(community_range, cum_weights=community_weights)[0])
+        subscription_rows += [{'agent_id': first_agent_id + agent_index, 'community_id': first_community_id + index,
+                               'created_at': start_time} for index in sorted(chosen)]
+    _insert_batches(CommunitySubscription, subscription_rows, batch_size)
+    db.session.commit()
+
+    report("Computing community statistics")
+    Community.refresh_stats()
+    report("Building feed timelines")
+    rebuild_timelines()
+
+    return {'agents': agents, 'communities': communities, 'posts': posts, 'comments': total_comments,
+            'subscriptions': len(subscription_rows)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Populate a database with a reproducible synthetic forum dataset.")
+    parser.add_argument("--db", default=None,
+                        help="SQLite file to populate (default: the configured application database)")
+    parser.add_argument("-n", "--posts", type=int, default=10_000,
+                        help="Number of posts to generate (default: 10000)")
+    parser.add_argument("-s", "--seed", type=int, default=1234,
+                        help="Random seed (default: 1234)")
+    parser.add_argument("--comments-per-post", type=float, default=COMMENTS_PER_POST,
+                        help=f"Average comments per post (default: {COMMENTS_PER_POST})")
+    parser.add_argument("--deep-thread-ratio", type=float, default=DEEP_THREAD_RATIO,
+                        help=f"Fraction of posts with a deep reply chain (default: {DEEP_THREAD_RATIO})")
+    parser.add_argument("--deep-thread-depth", type=int, default=DEEP_THREAD_DEPTH,
+                        help=f"Depth of deep reply chains (default: {DEEP_THREAD_DEPTH})")
+    args = parser.parse_args()
+
+    if args.posts <= 0:
+        print("Error: Post count must be a positive integer.")
+        return
+
+    from app import create_app
+    from schema import migrate
+    config = {'SQLALCHEMY_DATABASE_URI': 'sqlite:///' + args.db} if args.db else None
+    app = create_app(config, start_jobs=False)
+    with app.app_context():
+        migrate()
+        counts = generate(posts=args.posts, seed=args.seed, comments_per_post=args.comments_per_post,
+                          deep_thread_ratio=args.deep_thread_ratio, deep_thread_depth=args.deep_thread_depth,
+                          progress=print)
+    print("Created " + ", ".join(f"{count} {table}" for table, count in counts.items()))
+
+
+if __name__ == "__main__":
+    main()
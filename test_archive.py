@@ -0,0 +1,80 @@
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import text
+
+import archive
+from models import db, ArchivedPost, Comment, Post
+from settings import SETTINGS
+
+
+@pytest.fixture
+def forum(make_forum):
+    app, client, headers = make_forum(database='hot.db', agent='Archivist')
+    post_ids = [client.post('/api/posts', json={'title': f'Thread {i}', 'content': 'old news'},
+                            headers=headers).get_json()['post_id'] for i in range(3)]
+    client.post(f'/api/posts/{post_ids[0]}/comments', json={'content': 'First!'}, headers=headers)
+    client.post(f'/api/posts/{post_ids[1]}/comments', json={'content': 'Still going'}, headers=headers)
+
+    # Thread 0 is old and quiet, thread 1 is old but has a recent comment, thread 2 is new
+    long_ago = datetime.utcnow() - timedelta(days=SETTINGS.ARCHIVE_AFTER_DAYS + 1)
+    with app.app_context():
+        for post_id in post_ids[:2]:
+            db.session.get(Post, post_id).created_at = long_ago
+        Comment.query.filter_by(post_id=post_ids[0]).update({'created_at': long_ago})
+        db.session.commit()
+    return app, client, headers, post_ids
+
+
+def test_archive_uri_sits_next_to_the_primary():
+    assert archive.archive_uri_for('sqlite:////data/site.db') == 'sqlite:////data/site_archive.db'
+    assert archive.archive_uri_for('sqlite://') == 'sqlite://'
+
+
+def test_only_old_inactive_threads_are_archived(forum, tmp_path):
+    app, client, headers, post_ids = forum
+    with app.app_context():
+        assert archive.archive_old_threads() == 1
+        assert [post.id for post in Post.query.order_by(Post.id)] == post_ids[1:]
+        archived = db.session.get(ArchivedPost, post_ids[0])
+        assert [comment.content for comment in archived.comments] == ['First!']
+        assert Comment.query.filter_by(post_id=post_ids[0]).count() == 0
+        assert archive.compact(db.engines['archive'], force=True)
+    assert (tmp_path / 'hot_archive.db').exists()
+
+
+def test_archived_threads_stay_readable_but_read_only(forum):
+    app, client, headers, post_ids = forum
+    with app.app_context():
+        archive.archive_old_threads()
+
+    response = client.get(f'/api/posts/{post_ids[0]}').get_json()
+    assert (response['archived'], response['view_count'], response['comments'][0]['content']) == (True, 0, 'First!')
+    assert client.get(f'/post/{post_ids[0]}').status_code == 200
+    assert [post['archived'] for post in client.get('/api/search?q=Thread').get_json()] == [False, False, True]
+
+    assert client.post(f'/api/posts/{post_ids[0]}/vote', json={'type': 'upvote'}, headers=headers).status_code == 403
+    assert client.post(f'/api/posts/{post_ids[0]}/comments', json={'content': 'Late'},
+                       headers=headers).status_code == 403
+
+
+def test_threads_changed_while_being_copied_stay_hot(forum, monkeypatch):
+    app, client, headers, post_ids = forum
+    copy = archive.insert
+
+    def copy_while_voting(table):
+        if table is ArchivedPost:
+            with db.engines[None].begin() as connection: # Another request votes meanwhile
+                connection.execute(text("UPDATE post SET upvotes = upvotes + 1 WHERE id = :id"), {'id': post_ids[0]})
+        return copy(table)
+
+    monkeypatch.setattr(archive, 'insert', copy_while_voting)
+    with app.app_context():
+        assert archive.archive_posts([post_ids[0]]) == 0
+        assert db.session.get(Post, post_ids[0]).upvotes == 1
+        assert Comment.query.filter_by(post_id=post_ids[0]).count() == 1 # Comments were not lost
+        assert ArchivedPost.query.count() == 0
+
+        monkeypatch.setattr(archive, 'insert', copy)
+        assert archive.archive_posts([post_ids[0]]) == 1
+        assert db.session.get(ArchivedPost, post_ids[0]).upvotes == 1
@@ -0,0 +1,45 @@
+from benchmark import compare, percentile
+from models import db, Agent, Comment, Community, Post
+import synthetic_data
+
+
+def test_percentile_uses_the_nearest_rank():
+    assert percentile([7], 50) == percentile([7], 99) == 7
+    values = list(range(1, 101))
+    assert (percentile(values, 50), percentile(values, 99), percentile(values, 100)) == (50, 99, 100)
+    assert percentile([3, 1, 2], 100) == 3 and percentile([3, 1, 2], 1) == 1 # Unsorted input
+
+
+def test_compare_flags_regressions_beyond_the_tolerance():
+    baseline = {'scenarios': {'api.posts': {'p50_ms': 10.0, 'p99_ms': 20.0, 'queries': 3}}}
+
+    def result(p50, p99, queries=3):
+        return {'api.posts': {'p50_ms': p50, 'p99_ms': p99, 'queries': queries}}
+
+    assert compare(result(11.0, 21.0), baseline, tolerance=0.2) == []
+    regressions = compare(result(13.0, 21.0), baseline, tolerance=0.2)
+    assert len(regressions) == 1 and regressions[0].startswith('api.posts: p50_ms 13.00')
+    assert compare(result(10.0, 20.0, queries=5), baseline, tolerance=0.2) == \
+        ['api.posts: queries/request 5.0 > baseline 3.0']
+    # Sub-millisecond jitter on fast endpoints is not a regression
+    assert compare({'api.posts': {'p50_ms': 0.3, 'p99_ms': 0.5}},
+                   {'scenarios': {'api.posts': {'p50_ms': 0.1, 'p99_ms': 0.2}}}, tolerance=0.2) == []
+    assert compare(result(99.0, 99.0), {'scenarios': {}}, tolerance=0.2) == [] # No baseline for the scenario
+
+
+def test_synthetic_data_is_reproducible(make_forum):
+    def dataset(database, seed):
+        app, _, _ = make_forum(database=database)
+        with app.app_context():
+            synthetic_data.generate(posts=30, seed=seed, comments_per_post=3)
+            rows = [[tuple(row) for row in db.session.query(*columns).order_by(columns[0])] for columns in (
+                (Agent.id, Agent.name, Agent.api_key),
+                (Community.id, Community.name, Community.description),
+                (Post.id, Post.title, Post.content, Post.created_at, Post.view_count, Post.upvotes, Post.agent_id,
+                 Post.community_id),
+                (Comment.id, Comment.content, Comment.post_id, Comment.parent_comment_id, Comment.agent_id))]
+            return [row for row in rows[0] if row[1] != 'Tester'], rows[1:] # The fixture's agent has a random key
+
+    first = dataset('first.db', seed=7)
+    assert first == dataset('second.db', seed=7)
+    assert first != dataset('third.db', seed=8)
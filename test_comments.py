@@ -0,0 +1,83 @@
+import pytest
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+import jobs
+from models import comment_ranking
+
+
+@pytest.fixture
+def forum(make_forum):
+    app, client, headers = make_forum(agent='Ranker')
+    post_id = client.post('/api/posts', json={'title': 'Thread', 'content': 'x'}, headers=headers).get_json()['post_id']
+
+    def comment(content, parent=None, up=0, down=0):
+        comment_id = client.post(f'/api/posts/{post_id}/comments', json={'content': content, 'parent_comment_id': parent},
+                                 headers=headers).get_json()['comment_id']
+        for vote in ['upvote'] * up + ['downvote'] * down:
+            client.post(f'/api/comments/{comment_id}/vote', json={'type': vote}, headers=headers)
+        return comment_id
+
+    return app, client, post_id, comment
+
+
+def test_wilson_score_prefers_confidence_over_ratio():
+    assert comment_ranking(90, 10)['best_score'] > comment_ranking(1, 0)['best_score'] > comment_ranking(0, 0)['best_score']
+    assert comment_ranking(50, 50)['controversy'] > comment_ranking(90, 10)['controversy'] > comment_ranking(5, 0)['controversy']
+
+
+def test_comment_sorts_and_sibling_pagination(forum):
+    app, client, post_id, comment = forum
+    liked = comment('Liked', up=6, down=1)
+    split = comment('Split', up=4, down=4)
+    fresh = comment('Fresh', up=1)
+    reply_old = comment('Old reply', parent=liked, up=1)
+    reply_top = comment('Top reply', parent=liked, up=3)
+    nested = comment('Nested', parent=reply_top)
+
+    def ids(sort, **params):
+        return [c['id'] for c in client.get(f'/api/posts/{post_id}/comments', query_string=dict(sort=sort, **params)).get_json()]
+
+    assert ids('best') == [liked, fresh, split]
+    assert ids('top') == [liked, fresh, split]
+    assert ids('new') == [fresh, split, liked]
+    assert ids('old') == [liked, split, fresh]
+    assert ids('controversial')[0] == split
+    assert ids('best', limit=1, offset=1) == [fresh]
+    assert ids('top', parent_comment_id=liked) == [reply_top, reply_old]
+    assert client.get(f'/api/posts/{post_id}/comments', query_string={'parent_comment_id': liked}).get_json()[0]['reply_count'] == 1
+    assert client.get(f'/api/posts/{post_id}/comments?sort=random').status_code == 400
+
+    detail = client.get(f'/api/posts/{post_id}?comment_sort=new&comment_limit=2').get_json()
+    assert [c['id'] for c in detail['comments']] == [fresh, split] and detail['has_more_comments']
+    detail = client.get(f'/api/posts/{post_id}?comment_sort=top&comment_offset=2').get_json()
+    assert [c['id'] for c in detail['comments']] == [split] and not detail['has_more_comments']
+    detail = client.get(f'/api/posts/{post_id}?comment_sort=top&comment_limit=1').get_json()
+    replies = detail['comments'][0]['replies']
+    assert [c['id'] for c in replies] == [reply_top, reply_old] and replies[0]['replies'][0]['id'] == nested
+
+    page = client.get(f'/post/{post_id}?sort=new').get_data(as_text=True)
+    assert page.index('Fresh') < page.index('Split') < page.index('Liked') < page.index('Top reply')
+    assert page.count('Nested') == 1 # Replies are only rendered under their parent
+
+
+def test_counted_views_do_not_load_the_thread(forum):
+    app, client, post_id, comment = forum
+    comment('First')
+    comment('Second')
+    statements = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    event.listen(Engine, 'before_cursor_execute', record)
+    try:
+        assert client.get(f'/api/posts/{post_id}?fields=title').get_json()['title'] == 'Thread'
+        assert client.get(f'/post/{post_id}').status_code == 200
+    finally:
+        event.remove(Engine, 'before_cursor_execute', record)
+    assert not [statement for statement in statements if '? = comment.post_id' in statement] # No lazy load of post.comments
+
+    jobs.Worker(app).drain() # Scores are recomputed by the job, with a COUNT of the comments
+    post = client.get(f'/api/posts/{post_id}?count_views=false&fields=view_count,score').get_json()
+    assert (post['view_count'], post['score']) == (2, 2 * 0.1 + 2 * 0.4)
@@ -0,0 +1,68 @@
+from datetime import datetime
+
+from models import db, Community, CommunityMember
+
+
+def test_counters_are_maintained_on_write(forum):
+    app, client, headers = forum
+    other = {'X-API-KEY': client.post('/api/agents/register', json={'name': 'Other'}).get_json()['api_key']}
+    client.post('/api/communities', json={'name': 'counted'}, headers=headers)
+
+    first = client.post('/api/posts', json={'title': 'One', 'content': 'x', 'community_name': 'counted'},
+                        headers=headers).get_json()['post_id']
+    client.post('/api/posts', json={'title': 'Two', 'content': 'x', 'community_name': 'counted'}, headers=headers)
+    client.post(f'/api/posts/{first}/comments', json={'content': 'Mine'}, headers=headers)
+    client.post(f'/api/posts/{first}/comments', json={'content': 'Theirs'}, headers=other)
+    client.post('/api/posts', json={'title': 'Elsewhere', 'content': 'x'}, headers=headers) # No community
+
+    stats = client.get('/api/communities/counted').get_json()
+    assert (stats['post_count'], stats['comment_count'], stats['member_count']) == (2, 2, 2)
+    with app.app_context():
+        assert CommunityMember.query.count() == 2 # Posting again does not add the agent twice
+        community = Community.query.filter_by(name='counted').one()
+        assert community.last_activity_at is not None
+        assert stats['last_activity_at'] == community.last_activity_at.isoformat()
+
+        # The rebuild used by migrations agrees with the write-time counters
+        community.post_count = community.comment_count = community.member_count = 0
+        db.session.commit()
+        Community.refresh_stats()
+        community = Community.query.filter_by(name='counted').one()
+        assert (community.post_count, community.comment_count, community.member_count) == (2, 2, 2)
+
+
+def test_directory_sorts_and_pagination(forum):
+    app, client, headers = forum
+    for name, posts in (('alpha', 1), ('beta', 3), ('gamma', 2)):
+        client.post('/api/communities', json={'name': name}, headers=headers)
+        for i in range(posts):
+            client.post('/api/posts', json={'title': f'{name} {i}', 'content': 'x', 'community_name': name},
+                        headers=headers)
+    with app.app_context():
+        Community.query.filter_by(name='alpha').one().last_activity_at = datetime(2100, 1, 1)
+        db.session.commit()
+
+    def names(**params):
+        return [community['name'] for community in client.get('/api/communities', query_string=params).get_json()]
+
+    assert names() == ['alpha', 'beta', 'gamma']
+    assert names(sort='posts') == ['beta', 'gamma', 'alpha']
+    assert names(sort='newest') == ['gamma', 'beta', 'alpha']
+    assert names(sort='activity') == ['alpha', 'gamma', 'beta']
+    assert names(sort='posts', limit=1, offset=1) == ['gamma']
+    assert names(limit=-1) == ['alpha'] and names(offset=-5) == ['alpha', 'beta', 'gamma'] # Clamped
+    assert names(offset=10 ** 21) == [] # Beyond 64-bit integers
+    assert client.get('/api/communities?sort=size').status_code == 400
+
+    page = client.get('/api/communities/beta?limit=-1').get_json()
+    assert (page['limit'], len(page['posts'])) == (1, 1)
+    assert [post['title'] for post in client.get('/api/communities/beta?limit=2&offset=1').get_json()['posts']] == \
+        ['beta 1', 'beta 0']
+
+    page = client.get(f'/api/communities/beta?offset={10 ** 21}').get_json()
+    assert (page['posts'], page['has_more']) == ([], False)
+    assert client.get(f'/communities?page={10 ** 21}').status_code == 200
+    assert client.get(f'/communities/beta?page={10 ** 21}').status_code == 200
+
+    html = client.get('/communities?sort=posts').get_data(as_text=True)
+    assert html.index('beta') < html.index('gamma') < html.index('alpha')
@@ -0,0 +1,89 @@
+import pytest
+
+import feeds
+import jobs
+from models import db, Agent, Community, CommunitySubscription, TimelineEntry
+
+
+@pytest.fixture
+def forum(make_forum):
+    # 'small' fans out, 'big' (2 subscribers) does not
+    app, client, reader = make_forum(settings={'FANOUT_MAX_SUBSCRIBERS': 1, 'TIMELINE_MAX_ENTRIES': 3}, agent='Reader')
+    lurker, writer = [{'X-API-KEY': client.post('/api/agents/register', json={'name': name}).get_json()['api_key']}
+                      for name in ('Lurker', 'Writer')]
+    for name in ('small', 'big'):
+        client.post('/api/communities', json={'name': name}, headers=writer)
+    assert client.post('/api/communities/small/subscribe', headers=reader).status_code == 201
+    assert client.post('/api/communities/big/subscribe', headers=reader).status_code == 201
+    assert client.post('/api/communities/big/subscribe', headers=lurker).status_code == 201
+    return app, client, reader, writer
+
+
+def test_feed_merges_fanned_out_and_large_communities(forum):
+    app, client, reader, writer = forum
+    post_ids = [client.post('/api/posts', json={'title': f'Post {i}', 'content': 'x', 'community_name': community},
+                            headers=writer).get_json()['post_id']
+                for i, community in enumerate(['small', 'big', 'small', 'small', 'big', 'small'])]
+    jobs.Worker(app).drain()
+    with app.app_context():
+        # Only 'small' posts are fanned out, trimmed to the newest TIMELINE_MAX_ENTRIES
+        assert sorted(entry.post_id for entry in TimelineEntry.query) == [post_ids[2], post_ids[3], post_ids[5]]
+
+    page = client.get('/api/feed?limit=2', headers=reader).get_json()
+    seen = [post['id'] for post in page['posts']]
+    while page['next_cursor']:
+        page = client.get(f"/api/feed?limit=2&cursor={page['next_cursor']}", headers=reader).get_json()
+        seen += [post['id'] for post in page['posts']]
+    # Newest first; the oldest 'small' post fell out of the bounded timeline
+    assert seen == [post_ids[5], post_ids[4], post_ids[3], post_ids[2], post_ids[1]]
+
+    assert client.get('/api/feed?cursor=nonsense', headers=reader).status_code == 400
+    assert client.get('/api/feed').status_code == 401
+
+
+def test_subscribe_backfills_and_unsubscribe_clears_the_timeline(forum):
+    app, client, reader, writer = forum
+    client.delete('/api/communities/small/subscribe', headers=reader)
+    post_id = client.post('/api/posts', json={'title': 'Earlier', 'content': 'x', 'community_name': 'small'},
+                          headers=writer).get_json()['post_id']
+    assert client.get('/api/communities/small').get_json()['subscriber_count'] == 0
+
+    assert client.post('/api/communities/small/subscribe', headers=reader).status_code == 201
+    assert client.post('/api/communities/small/subscribe', headers=reader).status_code == 200
+    assert [post['id'] for post in client.get('/api/feed', headers=reader).get_json()['posts']] == [post_id]
+
+    assert client.delete('/api/communities/small/subscribe', headers=reader).status_code == 200
+    assert client.delete('/api/communities/small/subscribe', headers=reader).status_code == 404
+    with app.app_context():
+        assert TimelineEntry.query.count() == 0
+
+
+def test_community_dropping_to_fan_out_is_backfilled(forum):
+    app, client, reader, writer = forum
+    client.post('/api/communities/big/subscribe', headers=writer)
+    post_ids = [client.post('/api/posts', json={'title': f'Big {i}', 'content': 'x', 'community_name': 'big'},
+                            headers=writer).get_json()['post_id'] for i in range(2)]
+
+    def timeline_of(name):
+        with app.app_context():
+            return sorted(entry.post_id for entry in TimelineEntry.query.join(Agent, Agent.id == TimelineEntry.agent_id)
+                          .filter(Agent.name == name))
+
+    # 3 -> 2 subscribers is still above FANOUT_MAX_SUBSCRIBERS; 2 -> 1 makes 'big' fan out
+    assert client.delete('/api/communities/big/subscribe', headers=writer).status_code == 200
+    jobs.Worker(app).drain()
+    assert timeline_of('Lurker') == []
+    assert client.delete('/api/communities/big/subscribe', headers=reader).status_code == 200
+    jobs.Worker(app).drain()
+    assert timeline_of('Lurker') == post_ids
+
+
+def test_concurrent_duplicate_subscribe_is_not_an_error(forum):
+    app, client, reader, writer = forum
+    with app.app_context():
+        community = Community.query.filter_by(name='small').one()
+        # Another request inserted the subscription after this one's check would have run
+        db.session.add(CommunitySubscription(agent_id=3, community_id=community.id))
+        db.session.commit()
+        assert feeds.subscribe(3, community) is False
+        assert feeds.unsubscribe(3, community) is True and feeds.unsubscribe(3, community) is False
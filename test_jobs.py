@@ -0,0 +1,106 @@
+import threading
+import time
+from datetime import datetime, timedelta
+
+import pytest
+
+import jobs
+from models import db, Job, Post
+from settings import SETTINGS
+
+
+def test_writes_enqueue_coalesced_score_updates(forum):
+    app, client, headers = forum
+    post_id = client.post('/api/posts', json={'title': 'Queued', 'content': 'x'}, headers=headers).get_json()['post_id']
+    for _ in range(3):
+        client.post(f'/api/posts/{post_id}/vote', json={'type': 'upvote'}, headers=headers)
+    client.post(f'/api/posts/{post_id}/comments', json={'content': 'A comment'}, headers=headers)
+
+    assert client.get('/api/jobs/stats', headers=headers).get_json()['pending_by_kind'] == {'post.update_score': 1}
+    assert client.get('/api/jobs/stats').status_code == 401
+    with app.app_context():
+        assert db.session.get(Post, post_id).score == 0.0
+
+    assert jobs.Worker(app).drain() == 1
+    with app.app_context():
+        assert db.session.get(Post, post_id).score == pytest.approx(3 * 0.6 + 1 * 0.4)
+        assert Job.query.count() == 0
+
+
+def test_a_job_claimed_before_the_writer_commits_sees_the_write(forum):
+    app, client, headers = forum
+    post_id = client.post('/api/posts', json={'title': 'Raced', 'content': 'x'}, headers=headers).get_json()['post_id']
+    with app.app_context(): # The post's score job is pending; a vote coalesces into it
+        db.session.get(Post, post_id).upvotes += 1
+        jobs.enqueue('post.update_score', {'post_id': post_id}, idempotency_key=f'post.update_score:{post_id}')
+
+        def work():
+            with app.app_context():
+                claimed.append(jobs.Worker(app).run_batch())
+
+        claimed = []
+        worker = threading.Thread(target=work)
+        worker.start() # Claims between the vote's write and its commit
+        time.sleep(0.3)
+        db.session.commit()
+        worker.join()
+
+    jobs.Worker(app).drain()
+    assert claimed == [1]
+    with app.app_context():
+        assert db.session.get(Post, post_id).score == pytest.approx(0.6)
+
+
+def test_failed_jobs_are_retried_then_marked_failed(forum, monkeypatch):
+    app, client, headers = forum
+    calls = []
+
+    def flaky(payloads):
+        calls.append(payloads)
+        raise RuntimeError("boom")
+
+    monkeypatch.setitem(jobs.HANDLERS, 'test.flaky', flaky)
+    monkeypatch.setattr(SETTINGS, 'JOB_RETRY_BASE_DELAY', 0)
+    with app.app_context():
+        jobs.enqueue('test.flaky', {'n': 1}, max_attempts=2)
+        db.session.commit()
+
+    jobs.Worker(app).drain()
+    assert calls == [[{'n': 1}], [{'n': 1}]]
+    with app.app_context():
+        job = Job.query.one()
+        assert (job.status, job.attempts, job.last_error) == ('failed', 2, "RuntimeError('boom')")
+        assert jobs.queue_stats()['failed'] == 1
+
+
+def test_stale_running_jobs_are_redelivered(forum, monkeypatch):
+    app, client, headers = forum
+    seen = []
+    monkeypatch.setitem(jobs.HANDLERS, 'test.record', seen.extend)
+    with app.app_context():
+        job = jobs.enqueue('test.record', {'n': 1})
+        job.status, job.locked_by = 'running', 'crashed-worker'
+        job.locked_at = datetime.utcnow() - timedelta(seconds=SETTINGS.JOB_VISIBILITY_TIMEOUT + 1)
+        db.session.commit()
+
+    assert jobs.Worker(app).drain() == 1
+    assert seen == [{'n': 1}]
+
+
+def test_jobs_crashing_their_worker_fail_and_are_purged(forum, monkeypatch):
+    app, client, headers = forum
+    seen = []
+    monkeypatch.setitem(jobs.HANDLERS, 'test.record', seen.extend)
+    with app.app_context():
+        job = jobs.enqueue('test.record', {'n': 1}, max_attempts=2)
+        job.status, job.locked_by, job.attempts = 'running', 'crashed-worker', 2
+        job.locked_at = datetime.utcnow() - timedelta(seconds=SETTINGS.JOB_VISIBILITY_TIMEOUT + 1)
+        db.session.commit()
+
+    assert jobs.Worker(app).drain() == 0 # Not claimed a third time
+    assert seen == []
+    with app.app_context():
+        assert Job.query.one().status == 'failed'
+        assert jobs.purge_failed_jobs() == 0 # Kept for inspection for a while
+        later = datetime.utcnow() + timedelta(days=SETTINGS.JOB_FAILED_RETENTION_DAYS + 1)
+        assert jobs.purge_failed_jobs(now=later) == 1
@@ -0,0 +1,70 @@
+from datetime import datetime
+
+import pytest
+
+import jobs
+from archive import archive_posts
+from models import db, Post
+
+
+@pytest.fixture
+def forum(make_forum):
+    app, client, headers = make_forum(settings={'MAX_MULTI_GET_IDS': 5}, agent='Follower')
+    client.post('/api/communities', json={'name': 'threads'}, headers=headers)
+    post_ids = [client.post('/api/posts', json={'title': f'Thread {i}', 'content': 'x', 'community_name': 'threads'},
+                            headers=headers).get_json()['post_id'] for i in range(3)]
+    return app, client, headers, post_ids
+
+
+def test_posts_multi_get(forum):
+    app, client, headers, post_ids = forum
+    with app.app_context():
+        db.session.get(Post, post_ids[0]).created_at = datetime(2000, 1, 1) # Old enough to archive
+        db.session.commit()
+        assert archive_posts([post_ids[0]]) == 1
+    jobs.Worker(app).drain()
+
+    ids = [post_ids[2], 999, post_ids[0], post_ids[1], post_ids[2]]
+    posts = client.get(f"/api/posts?ids={','.join(map(str, ids))}").get_json()
+    # Requested order, duplicates and missing ids dropped, archived posts included
+    assert [post['id'] for post in posts] == [post_ids[2], post_ids[0], post_ids[1]]
+    assert [post['archived'] for post in posts] == [False, True, False]
+    assert posts[0]['community_name'] == 'threads' and posts[0]['view_count'] == 1
+
+    client.get(f'/api/posts?ids={post_ids[1]},{post_ids[2]}&count_views=false')
+    posts = client.get(f'/api/posts?ids={post_ids[1]}&fields=view_count,score').get_json()
+    assert posts == [{'id': post_ids[1], 'view_count': 2, 'score': 0.0}]
+    with app.app_context(): # One pending score job per viewed post, however often it was viewed
+        assert jobs.queue_stats()['pending_by_kind'] == {'post.update_score': 2}
+    jobs.Worker(app).drain() # Scores of viewed posts are updated in the background
+    with app.app_context():
+        assert db.session.get(Post, post_ids[1]).score == pytest.approx(0.2)
+
+    assert client.get('/api/posts?ids=1,2,3,4,5,6').status_code == 400 # More than MAX_MULTI_GET_IDS
+    assert client.get('/api/posts?ids=1,x').status_code == 400
+    for ids in (str(2 ** 63), '99999999999999999999999', '0', '-1'): # Outside 1..2**63-1
+        for url in ('/api/posts', '/api/comments'):
+            response = client.get(f'{url}?ids={ids}')
+            assert (response.status_code, response.get_json()['message']) == \
+                (400, 'ids must be a comma separated list of integers')
+    assert client.get(f'/api/posts?ids={2 ** 63 - 1}').get_json() == []
+    assert client.get('/api/posts?ids=1&fields=title,password').status_code == 400
+
+
+def test_comments_multi_get_and_post_fields(forum):
+    app, client, headers, post_ids = forum
+    first = client.post(f'/api/posts/{post_ids[1]}/comments', json={'content': 'First'}, headers=headers).get_json()
+    reply = client.post(f'/api/posts/{post_ids[1]}/comments', json={'content': 'Reply', 'parent_comment_id': first['comment_id']},
+                        headers=headers).get_json()
+
+    comments = client.get(f"/api/comments?ids={reply['comment_id']},{first['comment_id']},999").get_json()
+    assert [comment['content'] for comment in comments] == ['Reply', 'First']
+    assert comments[0]['post_id'] == post_ids[1] and comments[0]['parent_comment_id'] == first['comment_id']
+    assert client.get(f"/api/comments?ids={first['comment_id']}&fields=content").get_json() == \
+        [{'id': first['comment_id'], 'content': 'First'}]
+    assert client.get('/api/comments').status_code == 400
+
+    detail = client.get(f'/api/posts/{post_ids[1]}?fields=title&count_views=false').get_json()
+    assert detail == {'id': post_ids[1], 'title': 'Thread 1'}
+    assert client.get(f'/api/posts/{post_ids[1]}?fields=comments').get_json()['comments'][0]['replies'][0]['content'] == 'Reply'
+    assert client.get(f'/api/posts/{post_ids[1]}?fields=view_count').get_json()['view_count'] == 2
@@ -0,0 +1,44 @@
+import pytest
+
+from models import db, Post
+from related import get_index
+
+
+@pytest.fixture
+def forum(make_forum):
+    app, client, headers = make_forum(settings={'RELATED_REFRESH_SECONDS': 0}, agent='Librarian')
+
+    def post(title, content):
+        return client.post('/api/posts', json={'title': title, 'content': content}, headers=headers).get_json()['post_id']
+
+    def refresh():
+        with app.app_context():
+            get_index(app).refresh()
+
+    return app, client, post, refresh
+
+
+def test_related_posts_rank_by_shared_terms(forum):
+    app, client, post, refresh = forum
+    robot = post('Robot arm control', 'Tuning the gripper and actuator control loop of a robot arm.')
+    similar = post('Gripper actuator question', 'My robot gripper actuator overshoots; which control gains?')
+    post('Carbon emissions', 'Ocean temperature and carbon emission forecasts for the next decade.')
+
+    assert client.get(f'/api/posts/{robot}/related').get_json() == [] # Requests never build the index
+    refresh()
+    related = client.get(f'/api/posts/{robot}/related').get_json()
+    assert [item['id'] for item in related] == [similar]
+    assert 0 < related[0]['similarity'] <= 1
+
+    # Posts created after the index was built are picked up on the next refresh
+    newer = post('Robot arm kinematics', 'Inverse kinematics for a robot arm with a gripper.')
+    refresh()
+    assert newer in [item['id'] for item in client.get(f'/api/posts/{robot}/related').get_json()]
+
+    with app.app_context():
+        db.session.delete(db.session.get(Post, similar))
+        db.session.commit()
+    assert similar not in [item['id'] for item in client.get(f'/api/posts/{robot}/related').get_json()]
+
+    assert 'Robot arm kinematics' in client.get(f'/post/{robot}').get_data(as_text=True)
+    assert client.get('/api/posts/999/related').status_code == 404
@@ -0,0 +1,80 @@
+import os
+
+import pytest
+
+from models import db, Post
+from replicas import copy_sqlite_database
+from settings import SETTINGS
+
+
+@pytest.fixture
+def forum(make_forum, tmp_path):
+    """An app with a SQLite primary and two file-copy replicas, plus an agent API key."""
+    primary = str(tmp_path / 'primary.db')
+    replicas = [str(tmp_path / 'replica1.db'), str(tmp_path / 'replica2.db')]
+    app, client, headers = make_forum(
+        settings={'REPLICA_LAG_CHECK_INTERVAL': 0, 'READ_YOUR_WRITES_SECONDS': 0},
+        config={'SQLALCHEMY_REPLICA_URIS': ['sqlite:///' + path for path in replicas]},
+        database='primary.db', agent='ReplicaBot')
+
+    def sync():
+        for path in replicas:
+            copy_sqlite_database(primary, path)
+            os.utime(path) # the copy is newer than the primary, i.e. no lag
+
+    sync()
+    return app, client, headers, sync, replicas
+
+
+def create_post(client, headers, title):
+    response = client.post('/api/posts', json={'title': title, 'content': 'Replicated content'}, headers=headers)
+    assert response.status_code == 201
+    return response.get_json()['post_id']
+
+
+def titles(response):
+    return [post['title'] for post in response.get_json()]
+
+
+def test_read_only_endpoints_use_replicas(forum):
+    app, client, headers, sync, _ = forum
+    create_post(client, headers, 'Replicated post')
+    sync()
+    create_post(client, headers, 'Not yet replicated')
+
+    # Replicas were copied after the first post only
+    assert titles(client.get('/api/posts')) == ['Replicated post']
+    assert titles(client.get('/api/search?q=Replicated')) == ['Replicated post']
+
+
+def test_writes_and_post_detail_use_primary(forum):
+    app, client, headers, sync, _ = forum
+    post_id = create_post(client, headers, 'Primary only')
+
+    assert client.get(f'/api/posts/{post_id}').status_code == 200
+    assert client.post(f'/api/posts/{post_id}/vote', json={'type': 'upvote'}, headers=headers).status_code == 200
+    with app.app_context():
+        assert db.session.get(Post, post_id).upvotes == 1
+
+
+def test_read_your_writes(forum, monkeypatch):
+    app, client, headers, sync, _ = forum
+    monkeypatch.setattr(SETTINGS, 'READ_YOUR_WRITES_SECONDS', 60)
+    create_post(client, headers, 'My own post')
+
+    # The writing agent sees its post; other clients are served by the stale replicas
+    assert titles(client.get('/api/posts', headers=headers)) == ['My own post']
+    assert titles(client.get('/api/posts', headers={'X-API-KEY': 'someone-else'})) == []
+
+
+def test_lagging_replicas_fall_back_to_primary(forum, monkeypatch):
+    app, client, headers, sync, replicas = forum
+    create_post(client, headers, 'Fresh post')
+    lagging = os.path.getmtime(replicas[0]) - 60
+    for path in replicas:
+        os.utime(path, (lagging, lagging))
+
+    monkeypatch.setattr(SETTINGS, 'REPLICA_MAX_LAG_SECONDS', 120)
+    assert titles(client.get('/api/posts')) == []
+    monkeypatch.setattr(SETTINGS, 'REPLICA_MAX_LAG_SECONDS', 5)
+    assert titles(client.get('/api/posts')) == ['Fresh post']
@@ -0,0 +1,132 @@
+import pytest
+from sqlalchemy import text, update
+
+import jobs
+from models import db, Community, CommunityShard, Post
+from rebalance import copy_community, move_community
+
+
+@pytest.fixture
+def forum(make_forum, tmp_path):
+    """An app whose communities are spread over the primary and two shard databases."""
+    app, client, headers = make_forum(
+        settings={'SHARD_MOVE_GRACE_SECONDS': 0, 'SHARD_ID_BLOCK_SIZE': 3}, # Several id blocks per test
+        config={'SQLALCHEMY_SHARD_URIS': ['sqlite:///' + str(tmp_path / f'shard{shard}.db') for shard in (1, 2)]},
+        database='shard0.db', agent='Sharder')
+    for name in ('alpha', 'beta', 'gamma'):
+        assert client.post('/api/communities', json={'name': name}, headers=headers).status_code == 201
+
+    def post(title, community):
+        response = client.post('/api/posts', json={'title': title, 'content': 'Sharded content', 'community_name': community},
+                               headers=headers)
+        assert response.status_code == 201
+        return response.get_json()['post_id']
+
+    def rows(shard, table):
+        """Ids of a table's rows on one shard, read directly from its database."""
+        with app.app_context():
+            engine = db.engines[f'shard{shard}' if shard else None]
+            with engine.connect() as connection:
+                return sorted(row_id for (row_id,) in connection.execute(text(f"SELECT id FROM {table}")))
+
+    return app, client, headers, post, rows
+
+
+def test_posts_live_on_their_communitys_shard_and_global_lists_merge(forum):
+    app, client, headers, post, rows = forum
+    with app.app_context():
+        # New communities are spread evenly over the shards
+        assert {CommunityShard.route(community.id).shard for community in Community.query} == {0, 1, 2}
+        shard_of = {community.name: CommunityShard.route(community.id).shard for community in Community.query}
+
+    created = [(post(f'Post {i} in {name}', name), name) for i in range(3) for name in ('alpha', 'beta', 'gamma')]
+    for shard in range(3):
+        assert rows(shard, 'post') == sorted(post_id for post_id, name in created if shard_of[name] == shard)
+    assert len({post_id for post_id, _ in created}) == len(created) # Ids are unique across shards
+
+    newest = [item['id'] for item in client.get('/api/posts?limit=100').get_json()]
+    assert newest == [post_id for post_id, _ in reversed(created)]
+    page = [item['id'] for item in client.get('/api/posts?limit=4&offset=2').get_json()]
+    assert page == newest[2:6]
+    assert len(client.get('/api/search?q=Post 1 in').get_json()) == 3
+    beta = [item['id'] for item in client.get('/api/posts?community=beta').get_json()]
+    assert beta == [post_id for post_id, name in reversed(created) if name == 'beta']
+
+    for votes, (post_id, _) in enumerate(created[:4]):
+        for _ in range(votes):
+            client.post(f'/api/posts/{post_id}/vote', json={'type': 'upvote'}, headers=headers)
+    jobs.Worker(app).drain()
+    trending = [item['id'] for item in client.get('/api/posts/trending?limit=3').get_json()]
+    assert trending == [created[3][0], created[2][0], created[1][0]]
+
+
+def test_threads_on_a_shard_and_moving_a_community(forum):
+    app, client, headers, post, rows = forum
+    post_id = post('Thread on beta', 'beta')
+    with app.app_context():
+        beta = Community.query.filter_by(name='beta').one()
+        source = CommunityShard.route(beta.id).shard
+    target = 2 if source != 2 else 1
+
+    comment = client.post(f'/api/posts/{post_id}/comments', json={'content': 'First'}, headers=headers).get_json()
+    reply = client.post(f'/api/posts/{post_id}/comments', json={'content': 'Reply', 'parent_comment_id': comment['comment_id']},
+                        headers=headers).get_json()
+    assert client.post(f"/api/comments/{reply['comment_id']}/vote", json={'type': 'upvote'}, headers=headers).status_code == 200
+    assert rows(source, 'comment') == sorted([comment['comment_id'], reply['comment_id']])
+
+    with app.app_context():
+        route = db.session.get(CommunityShard, beta.id)
+        route.moving = True
+        db.session.commit()
+    assert client.post(f'/api/posts/{post_id}/vote', json={'type': 'upvote'}, headers=headers).status_code == 503
+    assert client.post('/api/posts', json={'title': 'Blocked', 'content': 'x', 'community_name': 'beta'},
+                       headers=headers).status_code == 503
+    assert client.get(f'/api/posts/{post_id}').status_code == 200 # Reads keep working
+
+    with app.app_context():
+        assert move_community(db.session.get(Community, beta.id), target) == 3
+        assert CommunityShard.route(beta.id) == (target, False)
+    assert rows(source, 'post') == [] and rows(source, 'comment') == []
+    assert rows(target, 'post') == [post_id]
+
+    detail = client.get(f'/api/posts/{post_id}').get_json()
+    assert detail['comments'][0]['replies'][0]['upvotes'] == 1
+    assert client.post(f'/api/posts/{post_id}/vote', json={'type': 'upvote'}, headers=headers).status_code == 200
+    assert post('After the move', 'beta') in rows(target, 'post')
+    assert 'Thread on beta' in client.get('/communities/beta').get_data(as_text=True)
+
+
+def test_global_lists_show_a_community_being_moved_once(forum):
+    app, client, headers, post, rows = forum
+    post_id = post('Moving thread', 'beta')
+    with app.app_context():
+        beta = Community.query.filter_by(name='beta').one()
+        source = CommunityShard.route(beta.id).shard
+        copy_community(beta.id, source, 2 if source != 2 else 1) # Copied; the old rows are deleted later
+    assert rows(source, 'post') == [post_id] and [post_id] in (rows(1, 'post'), rows(2, 'post'))
+
+    for url in ('/api/posts', '/api/posts?sort=trending', '/api/posts/trending', '/api/search?q=Moving'):
+        assert [listed['id'] for listed in client.get(url).get_json()].count(post_id) == 1, url
+
+
+def test_ids_are_reserved_in_the_writing_transaction(forum):
+    app, client, headers, post, rows = forum
+    with app.app_context():
+        community = Community.query.filter_by(name='beta').one()
+
+        def add_posts(count):
+            # The session writes to the primary before the posts' ids are reserved
+            db.session.execute(update(Community).where(Community.id == community.id).values(description='Busy'))
+            posts = [Post(title=f'Post {i}', content='x', agent_id=1, community_id=community.id) for i in range(count)]
+            db.session.add_all(posts)
+            db.session.flush()
+            return [added.id for added in posts]
+
+        committed = add_posts(4) # Two blocks of SHARD_ID_BLOCK_SIZE
+        db.session.commit()
+        discarded = add_posts(3) # Uses up the committed block, then reserves a new one
+        db.session.rollback()
+
+    assert len(set(committed + discarded)) == 7
+    # The rolled back reservation is neither lost nor handed out twice: the next block starts at its first id
+    assert post('After the rollback', 'beta') == discarded[-1]
@@ -0,0 +1,71 @@
+import logging
+import sqlite3
+
+import pytest
+
+import app as app_module
+from app import create_app
+from models import db, Community, Post
+from schema import migrate
+from settings import SETTINGS
+
+
+@pytest.fixture
+def quiet(monkeypatch):
+    monkeypatch.setattr(SETTINGS, 'JOB_WORKER_THREADS', 0)
+    monkeypatch.setattr(SETTINGS, 'AUTO_MIGRATE', False)
+    yield
+    logging.getLogger().setLevel(logging.CRITICAL)
+
+
+def test_importing_the_module_does_not_build_the_app():
+    assert 'app' not in vars(app_module)
+
+
+def test_migrate_upgrades_an_existing_database(tmp_path, quiet):
+    # A site.db from before community statistics existed
+    path = tmp_path / 'old.db'
+    connection = sqlite3.connect(path)
+    connection.execute("CREATE TABLE community (id INTEGER PRIMARY KEY, name VARCHAR(50) NOT NULL UNIQUE, "
+                       "description VARCHAR(200), created_at DATETIME)")
+    connection.execute("INSERT INTO community (name, description) VALUES ('veterans', 'Old community')")
+    connection.commit()
+    connection.close()
+
+    app = create_app({'SQLALCHEMY_DATABASE_URI': 'sqlite:///' + str(path)})
+    with app.app_context():
+        changes = migrate()
+        assert 'added column community.post_count' in changes
+        assert 'created table post' in changes
+        assert 'created index ix_community_member_count' in changes
+        assert 'rebuilt community statistics' in changes
+        community = Community.query.filter_by(name='veterans').one()
+        assert (community.post_count, community.member_count) == (0, 0)
+
+        assert migrate() == [] # Nothing left to do
+        for engine in db.engines.values():
+            engine.dispose()
+
+
+def test_migrate_adds_autoincrement_to_post_ids(tmp_path, quiet):
+    # Posts created before archival existed: SQLite would reuse the ids of archived posts
+    path = tmp_path / 'old.db'
+    connection = sqlite3.connect(path)
+    connection.execute("CREATE TABLE post (id INTEGER PRIMARY KEY, title VARCHAR(200) NOT NULL, content TEXT NOT NULL, "
+                       "agent_id INTEGER NOT NULL)")
+    connection.executemany("INSERT INTO post (id, title, content, agent_id) VALUES (?, 'Old', 'x', 1)", [(1,), (2,)])
+    connection.commit()
+    connection.close()
+
+    app = create_app({'SQLALCHEMY_DATABASE_URI': 'sqlite:///' + str(path)})
+    with app.app_context():
+        assert 'rebuilt table post with AUTOINCREMENT' in migrate()
+        assert [post.id for post in Post.query.order_by(Post.id)] == [1, 2]
+        db.session.delete(db.session.get(Post, 2)) # e.g. archived
+        db.session.commit()
+        db.session.add(Post(title='New', content='x', agent_id=1))
+        db.session.commit()
+        assert Post.query.filter_by(title='New').one().id == 3
+        assert migrate() == []
+        for engine in db.engines.values():
+            engine.dispose()